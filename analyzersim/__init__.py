@@ -0,0 +1,4 @@
+"""Core of the laboratory analyzer simulator.
+
+Nothing in this package imports Qt; the GUI in ``original.py`` is a view over it.
+"""
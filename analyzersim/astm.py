@@ -0,0 +1,105 @@
+"""ASTM E1381 framing and E1394 records."""
+from datetime import datetime
+
+# Link layer control characters
+ENQ = b"\x05"
+ACK = b"\x06"
+NAK = b"\x15"
+EOT = b"\x04"
+STX = b"\x02"
+ETX = b"\x03"
+ETB = b"\x17"
+CR = b"\r"
+LF = b"\n"
+
+ENCODING = "latin-1"
+
+
+def checksum(data):
+    """Checksum of the frame number through ETX/ETB, as two uppercase hex digits."""
+    return b"%02X" % (sum(data) & 0xFF)
+
+
+def frame(number, text, final=True):
+    """Build one frame carrying ``text`` (bytes, including the record's CR)."""
+    body = b"%d" % (number % 8) + text + (ETX if final else ETB)
+    return STX + body + checksum(body) + CR + LF
+
+
+def decode_frame(data):
+    """Split a raw frame (STX through LF) into (number, text, final, valid).
+
+    ``valid`` is False when the frame is malformed or its checksum is wrong.
+    """
+    if len(data) < 7 or data[0] != STX[0] or data[-2:] != CR + LF:
+        return None, b"", True, False
+    terminator = data[-5]
+    final = terminator == ETX[0]
+    valid = (final or terminator == ETB[0]) and checksum(data[1:-4]) == bytes(data[-4:-2]).upper()
+    number = data[1] - 0x30
+    return number, bytes(data[2:-5]), final, valid and 0 <= number <= 7
+
+
+# E1381 allows at most 240 characters of text per frame
+MAX_FRAME_TEXT = 240
+
+_HEX = [b"%02X" % value for value in range(256)]
+
+
+class FrameEncoder:
+    """Turns records into E1381 frames.
+
+    Every frame is assembled in one preallocated bytearray. Records longer
+    than ``max_text`` are split into intermediate ETB frames and a final ETX
+    frame. Frame numbers run from ``first`` and wrap from 7 to 0.
+    """
+
+    def __init__(self, max_text=MAX_FRAME_TEXT):
+        self.max_text = max_text
+        self._buffer = bytearray(max_text + 7)
+        self._buffer[0] = STX[0]
+        self._view = memoryview(self._buffer)
+
+    def frames(self, records, first=1):
+        """Return the frames of a message made of ``records`` (strings)."""
+        frames = []
+        number = first
+        max_text = self.max_text
+        for record in records:
+            data = record.encode(ENCODING, "replace") + CR
+            if len(data) <= max_text:
+                frames.append(self._frame(number, data, True))
+                number = (number + 1) & 7
+                continue
+            for start in range(0, len(data), max_text):
+                chunk = data[start:start + max_text]
+                frames.append(self._frame(number, chunk, start + max_text >= len(data)))
+                number = (number + 1) & 7
+        return frames
+
+    def _frame(self, number, text, final):
+        view = self._view
+        end = 2 + len(text)
+        view[1] = 0x30 + number
+        view[2:end] = text
+        view[end] = ETX[0] if final else ETB[0]
+        view[end + 1:end + 3] = _HEX[sum(view[1:end + 1]) & 0xFF]
+        view[end + 3:end + 5] = b"\r\n"
+        return bytes(view[:end + 5])
+
+
+def message_frames(records):
+    """Frame each record of a message, numbering frames from 1."""
+    return FrameEncoder().frames(records)
+
+
+def astm_timestamp(moment=None):
+    return (moment or datetime.now()).strftime("%Y%m%d%H%M%S")
+
+
+def abnormal_flag(value, lower, upper):
+    if value < lower:
+        return "L"
+    if value > upper:
+        return "H"
+    return "N"
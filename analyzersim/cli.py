@@ -0,0 +1,528 @@
+"""Command line entry point, run as ``python -m analyzersim``."""
+import argparse
+import asyncio
+import sys
+import time
+
+from .database import DEFAULT_DB_PATH
+from .engine import SimulatorEngine
+from .export import FORMATS as EXPORT_FORMATS, ExportError, export_results
+from .fleet import FleetRunner
+from .link import REPLY_TIMEOUT
+from .metrics import DEFAULT_PORT as DEFAULT_METRICS_PORT, MetricsServer
+from .mocklis import Faults, MockLIS, load_orders, serve_analyzers
+from .outbox import STATES
+from .replay import TraceReplayer
+from .trace import TraceError, TraceReader, TraceWriter
+from .worklist import FORMATS, WorklistError
+from .transport import AnalyzerSession, TransportError, open_transport
+
+
+def synthetic_samples(prefix, start, count):
+    for number in range(start, start + count):
+        yield (f"{prefix}{number:08d}", f"PID{number:08d}", f"Patient {number}")
+
+
+def result_options(args, batch=0):
+    return {
+        "distribution": args.distribution,
+        "out_of_range_rate": args.out_of_range_rate,
+        "seed": None if args.seed is None else args.seed + batch,
+    }
+
+
+def cmd_analyzers(engine, args):
+    for analyzer_id, name in engine.analyzers():
+        print(f"{analyzer_id}\t{name}")
+
+
+def speed(value):
+    """--speed argument: a factor over real time, or "max" for as fast as possible."""
+    if value == "max":
+        return None
+    factor = float(value)
+    if factor <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return factor
+
+
+def run_timed(engine, args):
+    samples = list(synthetic_samples(args.prefix, args.start, args.samples))
+    engine.store_samples(samples)
+    model = engine.throughput(args.analyzer)
+    print(f"{model.channels} channels, capacity {model.capacity:.0f} tests/hour")
+
+    def on_complete(batch, results):
+        if args.verbose:
+            print(f"{len(batch)} samples complete ({results} results)", flush=True)
+
+    start = time.perf_counter()
+    count, simulated = asyncio.run(engine.run_analysis(
+        args.analyzer, [sample[0] for sample in samples], args.speed, on_complete, **result_options(args)
+    ))
+    elapsed = time.perf_counter() - start
+    rate = count * 3600 / simulated if simulated else 0
+    print(f"Generated {count} results in {simulated:.0f} simulated s ({rate:.0f} tests/hour), "
+          f"{elapsed:.3f} s wall time")
+
+
+def cmd_run(engine, args):
+    if args.speed is not False:
+        run_timed(engine, args)
+        return
+    start = time.perf_counter()
+    count = engine.analyze(
+        args.analyzer,
+        synthetic_samples(args.prefix, args.start, args.samples),
+        **result_options(args),
+    )
+    elapsed = time.perf_counter() - start
+    print(f"Generated {count} results for {args.samples} samples in {elapsed:.3f} s")
+
+
+def cmd_import(engine, args):
+    results = 0
+
+    def on_batch(sample_numbers):
+        nonlocal results
+        if args.analyze:
+            results += engine.generate_results(args.analyzer, sample_numbers)
+
+    start = time.perf_counter()
+    try:
+        count = engine.import_worklist(args.file, args.format, on_batch=on_batch)
+    except (OSError, WorklistError) as error:
+        raise SystemExit(f"Import failed: {error}")
+    elapsed = time.perf_counter() - start
+    generated = f", generated {results} results" if args.analyze else ""
+    print(f"Imported {count} samples{generated} in {elapsed:.3f} s")
+
+
+def cmd_daemon(engine, args):
+    batch = 0
+    next_number = args.start
+    print(f"Generating {args.samples} samples every {args.interval} s, Ctrl+C to stop")
+    try:
+        while args.batches is None or batch < args.batches:
+            started = time.monotonic()
+            count = engine.analyze(
+                args.analyzer,
+                synthetic_samples(args.prefix, next_number, args.samples),
+                **result_options(args, batch),
+            )
+            print(f"Batch {batch + 1}: {count} results", flush=True)
+            batch += 1
+            next_number += args.samples
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        pass
+    print(f"Stopped after {batch} batches")
+
+
+def selection(args):
+    """Keyword arguments for SimulatorEngine.select_result_ids from the selection options."""
+    return {
+        "sample_numbers": args.sample,
+        "since": args.since,
+        "until": args.until,
+        "sent": None if getattr(args, "resend", False) else False,
+    }
+
+
+async def open_sessions(sessions, timeout=None):
+    """Open every session, giving up when they are not all open after ``timeout`` seconds."""
+    try:
+        await asyncio.wait_for(asyncio.gather(*(session.open() for session in sessions)), timeout)
+    except asyncio.TimeoutError:
+        if timeout is None:
+            raise
+        raise SystemExit(f"No connection to the LIS within {timeout:g} s") from None
+
+
+async def send_unsent(engine, args):
+    settings = engine.endpoint_settings(args.analyzer)
+    name = engine.analyzer_name(args.analyzer)
+    result_ids = engine.select_result_ids(args.analyzer, **selection(args))
+    if not result_ids:
+        print("No results to send")
+        return
+    if not settings.is_tcp and args.instances > 1:
+        raise SystemExit("Only one instance can use a serial port")
+    template = engine.template(args.analyzer, "result_send")
+
+    trace = TraceWriter(args.record) if args.record else None
+    # Server-mode instances each need a port of their own
+    sessions = [
+        AnalyzerSession(
+            f"{name} #{number + 1}",
+            open_transport(settings, port_offset=number if settings.is_server else 0,
+                           trace=trace, name=f"{name} #{number + 1}"),
+            log=print if args.verbose else None,
+        )
+        for number in range(args.instances)
+    ]
+    if settings.is_server:
+        for number, session in enumerate(sessions):
+            print(f"{session.name}: waiting for LIS on {settings.analyzer_address}:{settings.analyzer_port + number}")
+    try:
+        try:
+            await open_sessions(sessions, args.timeout)
+            # Results a stopped send left in flight would never be claimed again
+            recovered = engine.outbox.recover(args.analyzer)
+            if recovered:
+                print(f"Requeued {recovered} results left in flight")
+            start = time.perf_counter()
+            # Through the outbox, so results are only marked sent once
+            # acknowledged and a failed message is retried like any other
+            sent, frames = await engine.send_queued(sessions, args.analyzer, result_ids, template)
+            elapsed = time.perf_counter() - start
+        finally:
+            await asyncio.gather(*(session.close() for session in sessions))
+    except (OSError, TransportError) as error:
+        raise SystemExit(f"Send failed: {error}")
+    finally:
+        if trace is not None:
+            trace.close()
+    print(f"{len(sessions)} sessions sent {len(sent)} results each "
+          f"({frames} frames) in {elapsed:.3f} s")
+
+
+def cmd_send(engine, args):
+    asyncio.run(send_unsent(engine, args))
+
+
+def cmd_export(engine, args):
+    sent = {"yes": True, "no": False, "any": None}[args.sent]
+    start = time.perf_counter()
+    try:
+        count = export_results(engine, args.file, args.format, args.analyzer, sent=sent,
+                               since=args.since, until=args.until)
+    except (OSError, ExportError) as error:
+        raise SystemExit(f"Export failed: {error}")
+    if args.file != "-":
+        print(f"Exported {count} results in {time.perf_counter() - start:.3f} s")
+
+
+def cmd_mark_sent(engine, args):
+    start = time.perf_counter()
+    count = engine.mark_selection_sent(args.analyzer, **selection(args))
+    print(f"Marked {count} results sent in {time.perf_counter() - start:.3f} s")
+
+
+def print_fleet_report(runner):
+    summary = runner.summary()
+    backlog = sum(summary["backlog"].values())
+    print(f"{summary['elapsed']:7.1f} s  {summary['messages']:7d} messages  "
+          f"{summary['messages_per_second']:8.1f} msg/s  p95 {summary['latency_p95'] * 1000:8.1f} ms  "
+          f"backlog {backlog}", flush=True)
+
+
+def mock_lis(args, log=None):
+    orders = load_orders(args.orders) if args.orders else {}
+    faults = Faults(
+        nak_every=args.nak_every, nak_rate=args.nak_rate, delay=args.delay / 1000,
+        delay_every=args.delay_every, disconnect_every=args.disconnect_every, seed=args.fault_seed,
+    )
+    return MockLIS(orders, faults, log=log)
+
+
+def print_mock_summary(summary):
+    print(f"Mock LIS: {summary['connections']} connections, {summary['messages']} messages, "
+          f"{summary['results']} results, {summary['queries']} queries answered, "
+          f"{summary['messages_per_second']:.1f} msg/s")
+    print(f"Receive time p50 {summary['receive_p50'] * 1000:.1f} ms, p99 {summary['receive_p99'] * 1000:.1f} ms, "
+          f"max {summary['receive_max'] * 1000:.1f} ms; injected {summary['naks']} NAKs, "
+          f"{summary['delays']} delays, {summary['disconnects']} disconnects")
+
+
+async def run_fleet(engine, runner, args):
+    lis = None
+    if args.mock_lis:
+        lis = mock_lis(args, log=print if args.verbose else None)
+        await serve_analyzers(lis, engine, runner.analyzer_ids)
+    try:
+        return await runner.run(print_fleet_report, args.report_interval)
+    finally:
+        if lis is not None:
+            await lis.close()
+            print_mock_summary(lis.summary())
+
+
+def cmd_fleet(engine, args):
+    analyzers = engine.analyzers()
+    if args.clone:
+        source_id = args.analyzers[0] if args.analyzers else analyzers[0][0]
+        names = {name for _, name in analyzers}
+        base = engine.analyzer_name(source_id)
+        for number in range(1, args.clone + 1):
+            name = f"{base} copy {number}"
+            if name not in names:
+                engine.clone_analyzer(source_id, name, port_offset=number)
+        analyzers = engine.analyzers()
+    analyzer_ids = args.analyzers or [analyzer_id for analyzer_id, _ in analyzers]
+    print(f"Running {len(analyzer_ids)} analyzers, {args.samples} samples each")
+    trace = TraceWriter(args.record) if args.record else None
+    runner = FleetRunner(
+        engine, analyzer_ids, args.samples, speed=args.speed, prefix=args.prefix,
+        log=print if args.verbose else None, trace=trace, **result_options(args),
+    )
+    try:
+        summary = asyncio.run(run_fleet(engine, runner, args))
+    finally:
+        if trace is not None:
+            trace.close()
+    print(f"{summary['messages']} messages, {summary['results']} results in {summary['elapsed']:.2f} s: "
+          f"{summary['messages_per_second']:.1f} msg/s, {summary['results_per_second']:.0f} results/s")
+    print(f"Latency p50 {summary['latency_p50'] * 1000:.1f} ms, p95 {summary['latency_p95'] * 1000:.1f} ms, "
+          f"p99 {summary['latency_p99'] * 1000:.1f} ms")
+    for stats in runner.stats.values():
+        status = stats.error or f"backlog {stats.backlog}"
+        print(f"  {stats.name}: {stats.messages} messages, {stats.results} results, {status}")
+
+
+async def serve_mock_lis(engine, lis, args):
+    if args.port is not None:
+        host, port = await lis.listen("127.0.0.1", args.port)
+        print(f"Listening on {host}:{port}")
+    else:
+        analyzer_ids = args.analyzers or [analyzer_id for analyzer_id, _ in engine.analyzers()]
+        for name, action in await serve_analyzers(lis, engine, analyzer_ids):
+            print(f"{name}: {action}")
+    started = time.monotonic()
+    messages = 0
+    try:
+        while args.duration is None or time.monotonic() - started < args.duration:
+            await asyncio.sleep(args.report_interval)
+            summary = lis.summary()
+            print(f"{time.monotonic() - started:7.1f} s  {len(lis.sessions):4d} connected  "
+                  f"{summary['messages']:7d} messages  "
+                  f"{(summary['messages'] - messages) / args.report_interval:8.1f} msg/s", flush=True)
+            messages = summary["messages"]
+    finally:
+        await lis.close()
+
+
+def cmd_mock_lis(engine, args):
+    lis = mock_lis(args, log=print if args.verbose else None)
+    print(f"Mock LIS with {lis.faults}, {len(lis.orders)} orders for host queries")
+    try:
+        asyncio.run(serve_mock_lis(engine, lis, args))
+    except KeyboardInterrupt:
+        pass
+    print_mock_summary(lis.summary())
+
+
+def list_trace(reader):
+    print(f"Recorded {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.started))}, "
+          f"{reader.duration:.3f} s")
+    for session in reader.sessions.values():
+        closed = f"{session.closed:10.3f}" if session.closed is not None else f"{'open':>10}"
+        print(f"{session.number:5d}  {session.opened:10.3f}  {closed}  {session.bytes_sent:10d} sent  "
+              f"{session.bytes_received:10d} received  {session.name} ({session.transport})")
+
+
+async def replay_trace(engine, replayer, args):
+    lis = None
+    if args.mock_lis:
+        lis = mock_lis(args, log=print if args.verbose else None)
+        analyzer_ids = {replayer.analyzer_for(session.name) for session in replayer.reader.sessions.values()}
+        await serve_analyzers(lis, engine, sorted(analyzer_ids - {None}))
+    try:
+        return await replayer.run()
+    finally:
+        if lis is not None:
+            await lis.close()
+            print_mock_summary(lis.summary())
+
+
+def cmd_replay(engine, args):
+    try:
+        reader = TraceReader(args.file)
+    except (OSError, TraceError) as error:
+        raise SystemExit(f"Cannot read {args.file}: {error}")
+    try:
+        if args.list:
+            list_trace(reader)
+            return
+        replayer = TraceReplayer(engine, reader, args.speed, args.analyzer, log=print if args.verbose else None)
+        summary = asyncio.run(replay_trace(engine, replayer, args))
+    finally:
+        reader.close()
+    print(f"Replayed {summary['sessions']} sessions recorded over {summary['recorded']:.2f} s "
+          f"in {summary['elapsed']:.2f} s: {summary['bytes_sent']} bytes sent, "
+          f"{summary['bytes_received']} received")
+    print(f"{summary['identical']} sessions answered exactly as recorded, "
+          f"{summary['late']} writes waited {REPLY_TIMEOUT:g} s for the LIS")
+    for name, error in summary["errors"].items():
+        print(f"  {name}: {error}")
+
+
+def cmd_queue(engine, args):
+    outbox = engine.outbox
+    if args.retry_failed:
+        print(f"Queued {outbox.retry_failed(args.analyzer)} failed results again")
+    if args.prune is not None:
+        print(f"Deleted {outbox.prune(args.prune * 86400)} acked results")
+    analyzer_ids = [args.analyzer] if args.analyzer else [analyzer_id for analyzer_id, _ in engine.analyzers()]
+    print(f"{'analyzer':<20}" + "".join(f"{state:>11}" for state in STATES) + f"{'acked/s':>10}")
+    for analyzer_id in analyzer_ids:
+        depth = outbox.depth(analyzer_id)
+        rate = outbox.drain_rate(args.window, analyzer_id)
+        print(f"{engine.analyzer_name(analyzer_id):<20}"
+              + "".join(f"{depth[state]:>11}" for state in STATES) + f"{rate:>10.1f}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="analyzersim", description="Headless laboratory analyzer simulator")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite database file (default: %(default)s)")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help=f"serve Prometheus metrics at http://127.0.0.1:PORT/metrics while running "
+                             f"(for example {DEFAULT_METRICS_PORT})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("analyzers", help="list configured analyzers").set_defaults(func=cmd_analyzers)
+
+    generation = argparse.ArgumentParser(add_help=False)
+    generation.add_argument("--analyzer", type=int, default=1, help="analyzer id (default: %(default)s)")
+    generation.add_argument("--samples", type=int, default=100, help="samples per batch (default: %(default)s)")
+    generation.add_argument("--prefix", default="SIM", help="sample number prefix (default: %(default)s)")
+    generation.add_argument("--start", type=int, default=1, help="first sample number (default: %(default)s)")
+    generation.add_argument("--seed", type=int, help="random seed for reproducible results")
+    generation.add_argument("--distribution", default="uniform", choices=("uniform", "normal"))
+    generation.add_argument("--out-of-range-rate", type=float, default=0.0,
+                            help="fraction of results outside the normal range")
+
+    run = commands.add_parser("run", parents=[generation], help="analyze one batch of synthetic samples")
+    run.add_argument("--speed", type=speed, default=False, metavar="FACTOR",
+                     help="play back the analyzer's simulated timing FACTOR times faster than "
+                          "real time, or 'max' for as fast as possible; results are stored as "
+                          "each sample completes")
+    run.add_argument("--verbose", action="store_true", help="report every completed batch")
+    run.set_defaults(func=cmd_run)
+
+    importer = commands.add_parser("import", help="load samples from a CSV, TSV or JSON lines worklist")
+    importer.add_argument("file", help="worklist file")
+    importer.add_argument("--format", choices=FORMATS, help="file format (default: from the extension)")
+    importer.add_argument("--analyze", action="store_true", help="generate results for the imported samples")
+    importer.add_argument("--analyzer", type=int, default=1, help="analyzer id (default: %(default)s)")
+    importer.set_defaults(func=cmd_import)
+
+    daemon = commands.add_parser("daemon", parents=[generation], help="keep analyzing batches until stopped")
+    daemon.add_argument("--interval", type=float, default=1.0, help="seconds between batches")
+    daemon.add_argument("--batches", type=int, help="stop after this many batches")
+    daemon.set_defaults(func=cmd_daemon)
+
+    faults = argparse.ArgumentParser(add_help=False)
+    faults.add_argument("--orders", metavar="FILE",
+                        help="worklist (CSV, TSV or JSON lines) the mock LIS answers host queries from")
+    faults.add_argument("--nak-every", type=int, default=0, metavar="N", help="NAK every Nth frame")
+    faults.add_argument("--nak-rate", type=float, default=0.0, metavar="FRACTION",
+                        help="NAK this fraction of frames at random")
+    faults.add_argument("--delay", type=float, default=0.0, metavar="MS", help="hold replies back MS milliseconds")
+    faults.add_argument("--delay-every", type=int, default=1, metavar="N",
+                        help="only delay every Nth reply (default: %(default)s)")
+    faults.add_argument("--disconnect-every", type=int, default=0, metavar="N",
+                        help="hang up instead of answering every Nth frame of a connection")
+    faults.add_argument("--fault-seed", type=int, help="random seed for --nak-rate")
+
+    fleet = commands.add_parser("fleet", parents=[faults], help="run every analyzer against the LIS at once")
+    fleet.add_argument("--analyzers", type=int, nargs="+", help="analyzer ids (default: all)")
+    fleet.add_argument("--clone", type=int, default=0, metavar="N",
+                       help="first add N copies of the first analyzer, each on its own analyzer port")
+    fleet.add_argument("--samples", type=int, default=100, help="samples per analyzer (default: %(default)s)")
+    fleet.add_argument("--prefix", default="FLT", help="sample number prefix (default: %(default)s)")
+    fleet.add_argument("--speed", type=speed, default=None, metavar="FACTOR",
+                       help="timing speed-up over real time (default: as fast as possible)")
+    fleet.add_argument("--seed", type=int, help="random seed for reproducible results")
+    fleet.add_argument("--distribution", default="uniform", choices=("uniform", "normal"))
+    fleet.add_argument("--out-of-range-rate", type=float, default=0.0)
+    fleet.add_argument("--report-interval", type=float, default=1.0, help="seconds between progress lines")
+    fleet.add_argument("--verbose", action="store_true", help="log connection events")
+    fleet.add_argument("--mock-lis", action="store_true",
+                       help="run a mock LIS for the fleet in the same process, with the fault options below")
+    fleet.add_argument("--record", metavar="FILE", help="record every session's bytes in a trace file")
+    fleet.set_defaults(func=cmd_fleet)
+
+    mock = commands.add_parser("mock-lis", parents=[faults], help="run a mock LIS for the analyzers to talk to")
+    mock.add_argument("--analyzers", type=int, nargs="+",
+                      help="serve these analyzers as their connection settings ask (default: all)")
+    mock.add_argument("--port", type=int, help="listen on 127.0.0.1:PORT instead")
+    mock.add_argument("--duration", type=float, help="stop after this many seconds (default: until Ctrl+C)")
+    mock.add_argument("--report-interval", type=float, default=1.0, help="seconds between progress lines")
+    mock.add_argument("--verbose", action="store_true", help="log connection events")
+    mock.set_defaults(func=cmd_mock_lis)
+
+    selected = argparse.ArgumentParser(add_help=False)
+    selected.add_argument("--analyzer", type=int, default=1, help="analyzer id (default: %(default)s)")
+    selected.add_argument("--sample", nargs="+", metavar="NUMBER", help="only results of these samples")
+    selected.add_argument("--since", metavar="DATETIME",
+                          help="only samples taken at or after DATETIME (YYYY-MM-DD[ HH:MM:SS])")
+    selected.add_argument("--until", metavar="DATETIME", help="only samples taken before DATETIME")
+
+    send = commands.add_parser("send", parents=[selected], help="send unsent results to the LIS")
+    send.add_argument("--resend", action="store_true", help="include results that were already sent")
+    send.add_argument("--instances", type=int, default=1,
+                      help="concurrent copies of the analyzer, for load-testing the LIS")
+    send.add_argument("--verbose", action="store_true", help="log connection events")
+    send.add_argument("--record", metavar="FILE", help="record every session's bytes in a trace file")
+    send.add_argument("--timeout", type=float, metavar="SECONDS",
+                      help="give up when the LIS has not connected within SECONDS (default: wait)")
+    send.set_defaults(func=cmd_send)
+
+    replay = commands.add_parser("replay", parents=[faults], help="send the sessions of a trace file again")
+    replay.add_argument("file", help="trace file written with --record")
+    replay.add_argument("--speed", type=speed, default=1.0, metavar="FACTOR",
+                        help="replay FACTOR times faster than recorded, or 'max' for as fast as the LIS "
+                             "answers (default: %(default)s)")
+    replay.add_argument("--analyzer", type=int,
+                        help="connect every session as this analyzer (default: the analyzer named like the session)")
+    replay.add_argument("--list", action="store_true", help="only list the sessions in the trace")
+    replay.add_argument("--mock-lis", action="store_true",
+                        help="replay against a mock LIS in the same process, with the fault options below")
+    replay.add_argument("--verbose", action="store_true", help="log connection events")
+    replay.set_defaults(func=cmd_replay)
+
+    export = commands.add_parser("export", help="write results to CSV, NDJSON, Parquet, Arrow or ASTM")
+    export.add_argument("file", help="output file, or - for standard output")
+    export.add_argument("--format", choices=EXPORT_FORMATS, help="file format (default: from the extension, csv for -)")
+    export.add_argument("--analyzer", type=int, help="analyzer id (default: all; required for astm)")
+    export.add_argument("--since", metavar="DATETIME", help="only samples taken at or after DATETIME")
+    export.add_argument("--until", metavar="DATETIME", help="only samples taken before DATETIME")
+    export.add_argument("--sent", choices=("yes", "no", "any"), default="any",
+                        help="only sent or unsent results (default: %(default)s)")
+    export.set_defaults(func=cmd_export)
+
+    mark = commands.add_parser("mark-sent", parents=[selected], help="mark unsent results sent without sending")
+    mark.set_defaults(func=cmd_mark_sent)
+
+    queue = commands.add_parser("queue", help="show the outbound result queue")
+    queue.add_argument("--analyzer", type=int, help="analyzer id (default: all)")
+    queue.add_argument("--window", type=float, default=60.0,
+                       help="seconds over which the drain rate is measured (default: %(default)s)")
+    queue.add_argument("--retry-failed", action="store_true", help="queue failed results again")
+    queue.add_argument("--prune", type=float, metavar="DAYS", help="delete results acked more than DAYS ago")
+    queue.set_defaults(func=cmd_queue)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    engine = SimulatorEngine(args.db).open()
+    server = None
+    try:
+        if args.metrics_port is not None:
+            try:
+                server = MetricsServer(port=args.metrics_port).start()
+            except OSError as error:
+                raise SystemExit(f"Cannot serve metrics on port {args.metrics_port}: {error}")
+            print(f"Serving metrics at http://{server.address[0]}:{server.address[1]}/metrics", file=sys.stderr)
+        args.func(engine, args)
+    finally:
+        if server is not None:
+            server.close()
+        engine.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Typed analyzer configuration."""
+from dataclasses import astuple, dataclass, fields
+
+from .templates import DEFAULT_TEMPLATES, compile_template
+
+
+def _to_int(name, value, default):
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name.replace('_', ' ')}: {value!r}") from None
+
+
+@dataclass
+class ConnectionSettings:
+    """One row of ``connection_settings``, with numeric fields parsed."""
+
+    connection_type: str = "TCP/IP"
+    socket_type: str = "Server"
+    analyzer_address: str = "127.0.0.1"
+    analyzer_port: int = 12000
+    lis_address: str = "127.0.0.1"
+    lis_port: int = 13000
+    serial_port: str = "COM1"
+    baud_rate: int = 9600
+    data_bits: int = 8
+    stop_bits: int = 1
+    parity: str = "No"
+    auto_result_sending: bool = False
+    request_sample_info: bool = False
+    sample_id_delay: int = 0
+    result_sending_delay: int = 0
+
+    # Column order used by from_row() and to_row()
+    COLUMNS = (
+        "connection_type", "socket_type", "analyzer_address", "analyzer_port",
+        "lis_address", "lis_port", "serial_port", "baud_rate", "data_bits",
+        "stop_bits", "parity", "auto_result_sending", "request_sample_info",
+        "sample_id_delay", "result_sending_delay",
+    )
+
+    def __post_init__(self):
+        # Accept the raw strings stored in the database or typed in the UI
+        for field in fields(self):
+            value = getattr(self, field.name)
+            if field.type is int:
+                value = _to_int(field.name, value, field.default)
+            elif field.type is bool:
+                value = bool(_to_int(field.name, value, 0))
+            elif value is None or value == "":
+                value = field.default
+            setattr(self, field.name, value)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def to_row(self):
+        return tuple(int(value) if isinstance(value, bool) else value for value in astuple(self))
+
+    @property
+    def result_delay_seconds(self):
+        # Both delays are entered in milliseconds
+        return self.result_sending_delay / 1000.0
+
+    @property
+    def sample_id_delay_seconds(self):
+        return self.sample_id_delay / 1000.0
+
+    @property
+    def is_tcp(self):
+        return self.connection_type == "TCP/IP"
+
+    @property
+    def is_server(self):
+        return self.socket_type == "Server"
+
+
+class AnalyzerProfile:
+    """Everything configured for one analyzer, loaded at once and cached by SimulatorEngine.
+
+    ``settings`` is None when connection settings were never saved, and
+    ``templates`` maps template types to the saved scripts. ``tests`` holds
+    (id, test_code, unit, lower_range, upper_range, cycle_time) rows and
+    ``panel`` the (id, lower_range, upper_range) rows results are drawn
+    from. A profile is shared between threads, so treat it as read only and
+    change the configuration through the engine, which drops the cached copy.
+    """
+
+    def __init__(self, analyzer_id, name, settings, templates, tests, throughput):
+        self.analyzer_id = analyzer_id
+        self.name = name
+        self.settings = settings
+        self.templates = templates
+        self.tests = tuple(tests)
+        self.panel = tuple((test[0], test[3], test[4]) for test in self.tests)
+        self.throughput = throughput
+        self._compiled = {}
+
+    def template(self, template_type):
+        """Compiled saved template of ``template_type``, or the default one."""
+        compiled = self._compiled.get(template_type)
+        if compiled is None:
+            text = self.templates.get(template_type) or DEFAULT_TEMPLATES[template_type]
+            compiled = self._compiled[template_type] = compile_template(text)
+        return compiled
@@ -0,0 +1,182 @@
+"""SQLite data access for the analyzer simulator."""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from time import perf_counter
+
+from .metrics import REGISTRY
+
+DEFAULT_DB_PATH = "analyzersim.db"
+
+# Host parameters per statement; SQLite builds before 3.32 cap this at 999
+MAX_VARIABLES = 999
+
+# Applied to every connection when it is opened
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA busy_timeout = 5000",
+)
+
+
+class Database:
+    """Owns the long-lived SQLite connections used by the simulator.
+
+    Every thread gets one connection of its own, opened on first use and kept
+    until ``close()``, so worker threads never share a connection and nothing
+    reconnects per call. Statement and transaction times are recorded in
+    ``metrics``.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, metrics=REGISTRY):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._query_seconds = metrics.histogram(
+            "analyzersim_db_query_seconds", "Time of single statements outside transactions, fetch included")
+        self._transaction_seconds = metrics.histogram(
+            "analyzersim_db_transaction_seconds", "Time spent in write transactions, commit included")
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def execute(self, sql, params=()):
+        start = perf_counter()
+        cursor = self.connection.execute(sql, params)
+        self._query_seconds.record(perf_counter() - start)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        start = perf_counter()
+        cursor = self.connection.executemany(sql, seq_of_params)
+        self._query_seconds.record(perf_counter() - start)
+        return cursor
+
+    def fetchone(self, sql, params=()):
+        start = perf_counter()
+        row = self.connection.execute(sql, params).fetchone()
+        self._query_seconds.record(perf_counter() - start)
+        return row
+
+    def fetchall(self, sql, params=()):
+        start = perf_counter()
+        rows = self.connection.execute(sql, params).fetchall()
+        self._query_seconds.record(perf_counter() - start)
+        return rows
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor; commit when the block succeeds, roll back otherwise."""
+        conn = self.connection
+        cursor = conn.cursor()
+        start = perf_counter()
+        try:
+            yield cursor
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+            self._transaction_seconds.record(perf_counter() - start)
+        finally:
+            cursor.close()
+
+    def upsert_samples(self, rows):
+        """Insert or update samples from (sample_number, patient_id, patient_name, date_time) rows."""
+        with self.transaction() as cursor:
+            cursor.executemany("""
+                INSERT INTO samples (sample_number, patient_id, patient_name, date_time)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (sample_number) DO UPDATE SET
+                    patient_id = excluded.patient_id,
+                    patient_name = excluded.patient_name,
+                    date_time = excluded.date_time
+            """, rows)
+
+    def upsert_orders(self, rows):
+        """Insert or update samples ordered by the LIS.
+
+        Rows are (sample_number, patient_id, patient_name, requested_tests, date_time).
+        """
+        with self.transaction() as cursor:
+            cursor.executemany("""
+                INSERT INTO samples (sample_number, patient_id, patient_name, requested_tests, date_time)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (sample_number) DO UPDATE SET
+                    patient_id = excluded.patient_id,
+                    patient_name = excluded.patient_name,
+                    requested_tests = excluded.requested_tests,
+                    date_time = excluded.date_time
+            """, rows)
+
+    def sample_orders(self, sample_numbers):
+        """Map sample numbers to their (``samples.id``, requested_tests)."""
+        orders = {}
+        for chunk in chunked(sample_numbers, MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            orders.update(
+                (number, (sample_id, requested_tests)) for sample_id, number, requested_tests in self.fetchall(
+                    f"SELECT id, sample_number, requested_tests FROM samples WHERE sample_number IN ({placeholders})",
+                    chunk,
+                )
+            )
+        return orders
+
+    def upsert_results(self, rows):
+        """Insert or overwrite results from (sample_id, test_id, result_value) rows.
+
+        Overwritten results are marked unsent again.
+        """
+        with self.transaction() as cursor:
+            cursor.executemany("""
+                INSERT INTO results (sample_id, test_id, result_value, sent)
+                VALUES (?, ?, ?, 0)
+                ON CONFLICT (sample_id, test_id) DO UPDATE SET
+                    result_value = excluded.result_value,
+                    sent = 0
+            """, rows)
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            # Refresh planner statistics for tables that grew while open, so
+            # that bulk selections pick table scans over index lookups
+            conn.execute("PRAGMA optimize")
+            conn.close()
+        self._local = threading.local()
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def id_runs(ids):
+    """Split ``ids`` into (first, last) runs of consecutive integers, in ascending order."""
+    runs = []
+    for value in sorted(set(ids)):
+        if runs and value == runs[-1][1] + 1:
+            runs[-1][1] = value
+        else:
+            runs.append([value, value])
+    return runs
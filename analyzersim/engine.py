@@ -0,0 +1,824 @@
+"""Headless simulator engine.
+
+``SimulatorEngine`` holds everything the simulator does without a window:
+analyzer configuration, sample ingest, result generation and sending. The
+Qt window and the command line are both thin layers over it.
+"""
+import threading
+from dataclasses import replace
+from datetime import datetime
+
+from .config import AnalyzerProfile, ConnectionSettings
+from .database import DEFAULT_DB_PATH, MAX_VARIABLES, Database, chunked, id_runs
+from .metrics import REGISTRY
+from .migrations import migrate
+from .outbox import Outbox
+from .pipeline import MESSAGE_RESULTS
+from .link import RECEIVE_TIMEOUT
+from .scheduler import DEFAULT_CHANNELS, ThroughputModel, Timeline
+from .templates import DEFAULT_TEMPLATES, compile_template
+from .worklist import WorklistFile
+
+# Rows per sample_page() call, sized for one screenful of scrolling
+SAMPLE_PAGE_SIZE = 256
+
+# Samples stored and analyzed per transaction by analyze()
+ANALYZE_BATCH_SIZE = 5000
+
+# Rows fetched per round trip when exporting
+EXPORT_BATCH_SIZE = 10000
+# Columns of the rows export_batches() yields
+EXPORT_COLUMNS = (
+    "result_id", "analyzer_id", "analyzer", "sample_number", "patient_id", "patient_name",
+    "date_time", "test_code", "result_value", "unit", "lower_range", "upper_range", "sent",
+)
+
+# Seeded into a brand new database
+INITIAL_ANALYZERS = ("Analyzer 1", "Analyzer 2")
+INITIAL_TESTS = (
+    ("Test_1", "mmol/l", 0.5, 5.0),
+    ("Photo_reflex_test", "mmol/l", 1.0, 5.5),
+    ("Photometric_test", "mmol/l", 0.05, 1.2),
+)
+
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def default_settings(analyzer_id):
+    """ConnectionSettings for an analyzer that has none saved.
+
+    The analyzer port is moved by the analyzer id, so that analyzers left on
+    the defaults do not all listen on the same port.
+    """
+    defaults = ConnectionSettings()
+    return replace(defaults, analyzer_port=defaults.analyzer_port + analyzer_id - 1)
+
+
+class SimulatorEngine:
+    def __init__(self, db_path=DEFAULT_DB_PATH, metrics=REGISTRY):
+        self.metrics = metrics
+        self.db = Database(db_path, metrics)
+        self.outbox = Outbox(self.db)
+        self._profiles = {}
+        self._profiles_lock = threading.Lock()
+        self._queue_gauges = {}
+
+    def open(self):
+        """Create or upgrade the database and seed it when empty."""
+        migrate(self.db)
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM analyzers")
+            if cursor.fetchone()[0] == 0:
+                cursor.executemany(
+                    "INSERT INTO analyzers (name) VALUES (?)",
+                    ((name,) for name in INITIAL_ANALYZERS),
+                )
+                cursor.executemany("""
+                    INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range)
+                    VALUES (1, ?, ?, ?, ?)
+                """, INITIAL_TESTS)
+        self.metrics.add_collector(self._collect_queue)
+        return self
+
+    def close(self):
+        self.metrics.remove_collector(self._collect_queue)
+        self.invalidate()
+        self.db.close()
+
+    def _collect_queue(self, registry):
+        # Gauges of every analyzer and state seen so far drop to 0 once drained
+        depths = self.outbox.unfinished()
+        for key in set(self._queue_gauges) | set(depths):
+            gauge = self._queue_gauges.get(key)
+            if gauge is None:
+                analyzer_id, state = key
+                gauge = self._queue_gauges[key] = registry.gauge(
+                    "analyzersim_outbox_depth", "Results queued for the LIS and not yet acked",
+                    analyzer=analyzer_id, state=state,
+                )
+            gauge.set(depths.get(key, 0))
+
+    # Analyzer configuration
+    #
+    # Reads go through profile(), which keeps each analyzer's settings,
+    # templates and tests in memory after the first query. Every save below
+    # drops the analyzer's cached profile once its transaction has committed,
+    # so changes made through the engine are seen by the next read. Changes
+    # written to the database by another process are not.
+
+    def analyzers(self):
+        return self.db.fetchall("SELECT id, name FROM analyzers ORDER BY id")
+
+    def profile(self, analyzer_id):
+        """The analyzer's AnalyzerProfile, loaded from the database on first use."""
+        profile = self._profiles.get(analyzer_id)
+        if profile is None:
+            with self._profiles_lock:
+                # Loading under the lock keeps a load that raced a save from
+                # storing what it read after invalidate() dropped it
+                profile = self._profiles.get(analyzer_id)
+                if profile is None:
+                    profile = self._profiles[analyzer_id] = self._load_profile(analyzer_id)
+        return profile
+
+    def invalidate(self, analyzer_id=None):
+        """Drop the cached profile of the analyzer, or of every analyzer."""
+        with self._profiles_lock:
+            if analyzer_id is None:
+                self._profiles.clear()
+            else:
+                self._profiles.pop(analyzer_id, None)
+
+    def _load_profile(self, analyzer_id):
+        row = self.db.fetchone("SELECT name, channels, tests_per_hour FROM analyzers WHERE id = ?", (analyzer_id,))
+        name, channels, tests_per_hour = row or (f"Analyzer {analyzer_id}", DEFAULT_CHANNELS, None)
+        settings = self.db.fetchone(f"""
+            SELECT {", ".join(ConnectionSettings.COLUMNS)}
+            FROM connection_settings
+            WHERE analyzer_id = ?
+        """, (analyzer_id,))
+        templates = dict(self.db.fetchall("""
+            SELECT template_type, template_content
+            FROM astm_templates
+            WHERE analyzer_id = ?
+            ORDER BY id
+        """, (analyzer_id,)))
+        tests = self.db.fetchall("""
+            SELECT id, test_code, unit, lower_range, upper_range, cycle_time
+            FROM tests
+            WHERE analyzer_id = ?
+            ORDER BY id
+        """, (analyzer_id,))
+        throughput = ThroughputModel({test[0]: test[5] for test in tests}, channels, tests_per_hour)
+        return AnalyzerProfile(
+            analyzer_id, name, ConnectionSettings.from_row(settings) if settings else None,
+            templates, tests, throughput,
+        )
+
+    def analyzer_name(self, analyzer_id):
+        return self.profile(analyzer_id).name
+
+    def clone_analyzer(self, source_id, name, port_offset=0):
+        """Copy an analyzer's connection settings, tests and templates under ``name``.
+
+        The analyzer port of the copy is moved by ``port_offset``, so copies
+        in server mode do not collide. When the source has no saved settings
+        the copy is given the defaults ``endpoint_settings()`` would use for
+        it. Returns the new analyzer id.
+        """
+        columns = ", ".join(ConnectionSettings.COLUMNS)
+        with self.db.transaction() as cursor:
+            cursor.execute("""
+                INSERT INTO analyzers (name, channels, tests_per_hour)
+                SELECT ?, channels, tests_per_hour FROM analyzers WHERE id = ?
+            """, (name, source_id))
+            analyzer_id = cursor.lastrowid
+            cursor.execute(f"""
+                INSERT INTO connection_settings (analyzer_id, {columns})
+                SELECT ?, {columns} FROM connection_settings WHERE analyzer_id = ?
+            """, (analyzer_id, source_id))
+            if cursor.rowcount:
+                cursor.execute(
+                    "UPDATE connection_settings SET analyzer_port = analyzer_port + ? WHERE analyzer_id = ?",
+                    (port_offset, analyzer_id),
+                )
+            else:
+                placeholders = ", ".join("?" * (len(ConnectionSettings.COLUMNS) + 1))
+                cursor.execute(
+                    f"INSERT INTO connection_settings (analyzer_id, {columns}) VALUES ({placeholders})",
+                    (analyzer_id,) + default_settings(analyzer_id).to_row(),
+                )
+            cursor.execute("""
+                INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range, cycle_time)
+                SELECT ?, test_code, unit, lower_range, upper_range, cycle_time
+                FROM tests WHERE analyzer_id = ?
+            """, (analyzer_id, source_id))
+            cursor.execute("""
+                INSERT INTO astm_templates (analyzer_id, template_type, template_content)
+                SELECT ?, template_type, template_content FROM astm_templates WHERE analyzer_id = ?
+            """, (analyzer_id, source_id))
+        # A profile read before the row existed only holds the fallback name
+        self.invalidate(analyzer_id)
+        return analyzer_id
+
+    def connection_settings(self, analyzer_id):
+        """Return the analyzer's ConnectionSettings, or None if never saved."""
+        return self.profile(analyzer_id).settings
+
+    def endpoint_settings(self, analyzer_id):
+        """The settings to connect the analyzer with: the saved ones, or ``default_settings()``."""
+        return self.profile(analyzer_id).settings or default_settings(analyzer_id)
+
+    def save_connection_settings(self, analyzer_id, settings):
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT id FROM connection_settings WHERE analyzer_id = ?", (analyzer_id,))
+            if cursor.fetchone():
+                assignments = ", ".join(f"{column} = ?" for column in ConnectionSettings.COLUMNS)
+                cursor.execute(
+                    f"UPDATE connection_settings SET {assignments} WHERE analyzer_id = ?",
+                    settings.to_row() + (analyzer_id,),
+                )
+            else:
+                placeholders = ", ".join("?" * (len(ConnectionSettings.COLUMNS) + 1))
+                cursor.execute(
+                    f"INSERT INTO connection_settings (analyzer_id, {', '.join(ConnectionSettings.COLUMNS)}) "
+                    f"VALUES ({placeholders})",
+                    (analyzer_id,) + settings.to_row(),
+                )
+        self.invalidate(analyzer_id)
+
+    def templates(self, analyzer_id):
+        """Return the analyzer's ASTM templates as {template_type: content}."""
+        return dict(self.profile(analyzer_id).templates)
+
+    def template(self, analyzer_id, template_type, text=None):
+        """Compiled template of the analyzer, or of ``text`` when given."""
+        if text is None:
+            return self.profile(analyzer_id).template(template_type)
+        return compile_template(text)
+
+    def save_templates(self, analyzer_id, templates):
+        """Save {template_type: content} scripts of the analyzer.
+
+        Every script is compiled first, so a broken one raises TemplateError
+        and nothing is saved. Types not in ``templates`` are left as they are.
+        """
+        self.save_configuration(analyzer_id, templates=templates)
+
+    def _check_templates(self, templates):
+        for template_type, content in templates.items():
+            if template_type not in DEFAULT_TEMPLATES:
+                raise ValueError(f"Unknown template type: {template_type}")
+            compile_template(content)
+
+    def _save_templates(self, cursor, analyzer_id, templates):
+        for template_type, content in templates.items():
+            cursor.execute("""
+                UPDATE astm_templates SET template_content = ?
+                WHERE analyzer_id = ? AND template_type = ?
+            """, (content, analyzer_id, template_type))
+            if cursor.rowcount == 0:
+                cursor.execute("""
+                    INSERT INTO astm_templates (analyzer_id, template_type, template_content)
+                    VALUES (?, ?, ?)
+                """, (analyzer_id, template_type, content))
+
+    def tests(self, analyzer_id):
+        """Return (id, test_code, unit, lower_range, upper_range, cycle_time) rows for the analyzer."""
+        return list(self.profile(analyzer_id).tests)
+
+    def save_tests(self, analyzer_id, tests):
+        """Replace the analyzer's panel with (test_code, unit, lower_range, upper_range, cycle_time) rows.
+
+        Tests are matched by code, so a test kept across saves keeps its id
+        and the results already stored for it. The results of tests left out
+        are deleted with them; see removed_test_results().
+        """
+        self.save_configuration(analyzer_id, tests=tests)
+
+    def removed_test_results(self, analyzer_id, test_codes):
+        """Number of results save_tests() would delete with the tests not in ``test_codes``."""
+        codes = list(dict.fromkeys(test_codes))
+        placeholders = ", ".join("?" * len(codes))
+        not_kept = f" AND test_code NOT IN ({placeholders})" if codes else ""
+        row = self.db.fetchone(f"""
+            SELECT COUNT(*) FROM results
+            WHERE test_id IN (SELECT id FROM tests WHERE analyzer_id = ?{not_kept})
+        """, (analyzer_id, *codes))
+        return row[0]
+
+    def _save_tests(self, cursor, analyzer_id, tests):
+        tests = list(tests)
+        existing = {}
+        duplicates = []
+        for test_id, code in cursor.execute(
+                "SELECT id, test_code FROM tests WHERE analyzer_id = ? ORDER BY id", (analyzer_id,)).fetchall():
+            if code in existing:
+                duplicates.append((existing[code], test_id))
+            else:
+                existing[code] = test_id
+        # Duplicate codes left by older versions keep only their oldest row,
+        # which takes over the results it does not have yet
+        cursor.executemany("UPDATE OR IGNORE results SET test_id = ? WHERE test_id = ?", duplicates)
+        kept = {test[0] for test in tests}
+        removed = [test_id for code, test_id in existing.items() if code not in kept]
+        removed.extend(duplicate for _, duplicate in duplicates)
+        # Results, and their outbox rows, must not outlive their test
+        for chunk in chunked(removed, MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            cursor.execute(f"""
+                DELETE FROM outbox WHERE result_id IN (SELECT id FROM results WHERE test_id IN ({placeholders}))
+            """, chunk)
+            cursor.execute(f"DELETE FROM results WHERE test_id IN ({placeholders})", chunk)
+            cursor.execute(f"DELETE FROM tests WHERE id IN ({placeholders})", chunk)
+        cursor.executemany("""
+            UPDATE tests SET unit = ?, lower_range = ?, upper_range = ?, cycle_time = ?
+            WHERE analyzer_id = ? AND test_code = ?
+        """, (tuple(test[1:]) + (analyzer_id, test[0]) for test in tests if test[0] in existing))
+        cursor.executemany("""
+            INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range, cycle_time)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, ((analyzer_id,) + tuple(test) for test in tests if test[0] not in existing))
+
+    def throughput(self, analyzer_id):
+        """The analyzer's ThroughputModel: test cycle times, channels and rating."""
+        return self.profile(analyzer_id).throughput
+
+    def save_throughput(self, analyzer_id, channels, tests_per_hour=None):
+        self.save_configuration(analyzer_id, channels=channels, tests_per_hour=tests_per_hour)
+
+    def save_configuration(self, analyzer_id, templates=None, tests=None, channels=None, tests_per_hour=None):
+        """Save the analyzer's templates, tests and throughput in one transaction.
+
+        Parts left None are not touched; see save_templates(), save_tests()
+        and save_throughput() for each of them.
+        """
+        if templates is not None:
+            self._check_templates(templates)
+        with self.db.transaction() as cursor:
+            if templates is not None:
+                self._save_templates(cursor, analyzer_id, templates)
+            if tests is not None:
+                self._save_tests(cursor, analyzer_id, tests)
+            if channels is not None:
+                cursor.execute(
+                    "UPDATE analyzers SET channels = ?, tests_per_hour = ? WHERE id = ?",
+                    (channels, tests_per_hour or None, analyzer_id),
+                )
+        self.invalidate(analyzer_id)
+
+    # Samples and results
+
+    def store_samples(self, samples, progress=None, batch_size=ANALYZE_BATCH_SIZE):
+        """Insert or update (sample_number, patient_id, patient_name) rows.
+
+        With ``progress``, rows are committed ``batch_size`` at a time and
+        ``progress(done, total)`` is called after each batch, as in analyze().
+        """
+        now = timestamp()
+        if progress is None:
+            self.db.upsert_samples(
+                (sample_number, patient_id, patient_name, now)
+                for sample_number, patient_id, patient_name in samples
+            )
+            return
+        samples = list(samples)
+        for start in range(0, len(samples), batch_size):
+            self.db.upsert_samples(
+                (sample_number, patient_id, patient_name, now)
+                for sample_number, patient_id, patient_name in samples[start:start + batch_size]
+            )
+            progress(min(start + batch_size, len(samples)), len(samples))
+
+    def import_worklist(self, path, format=None, progress=None, on_batch=None, batch_size=ANALYZE_BATCH_SIZE):
+        """Stream a worklist file into the samples table; return the number of samples.
+
+        Rows are upserted ``batch_size`` at a time with their requested tests,
+        so memory use does not grow with the file. ``progress(done, total)``
+        gets bytes read and the file size after every batch, and
+        ``on_batch(sample_numbers)`` the numbers just committed.
+        """
+        count = 0
+        with WorklistFile(path, format) as worklist:
+            for batch in chunked(worklist, batch_size):
+                now = timestamp()
+                self.db.upsert_orders(
+                    (number, patient_id, patient_name, tests, now)
+                    for number, patient_id, patient_name, tests in batch
+                )
+                count += len(batch)
+                if on_batch is not None:
+                    on_batch([row[0] for row in batch])
+                if progress is not None:
+                    progress(worklist.position, worklist.size)
+        return count
+
+    def store_orders(self, records):
+        """Store the samples ordered in host records (P and O); return their numbers.
+
+        ``records`` are parser.Record objects, e.g. a reply to a host query.
+        """
+        orders = {}
+        patient_id = patient_name = ""
+        for record in records:
+            if record.type == "P":
+                patient_id = record.field(2) or record.field(3)
+                patient_name = " ".join(part for part in record.field(5).split("^") if part)
+            elif record.type == "O":
+                number = record.field(2, 0) or record.field(3, 0)
+                if not number:
+                    continue
+                order = orders.setdefault(number, (patient_id, patient_name, []))
+                order[2].extend(test for test in record.repeats(4, 3) if test and test not in order[2])
+        now = timestamp()
+        self.db.upsert_orders(
+            (number, patient_id, patient_name, ",".join(tests), now)
+            for number, (patient_id, patient_name, tests) in orders.items()
+        )
+        return list(orders)
+
+    def _result_generator(self, analyzer_id, options):
+        # NumPy is only loaded once results are actually generated
+        from .generator import ResultGenerator
+
+        panel = self.profile(analyzer_id).panel
+        if not panel:
+            return None
+        return ResultGenerator(panel, **options)
+
+    def _requested(self, analyzer_id, requests):
+        """Which tests of the panel each sample was ordered for, as rows of booleans.
+
+        ``requests`` holds the samples' requested_tests. Samples without
+        any get the whole panel; None when that goes for all of them.
+        """
+        if not any(requests):
+            return None
+        codes = [test[1] for test in self.profile(analyzer_id).tests]
+        panel = [True] * len(codes)
+        requested = []
+        for tests in requests:
+            if tests:
+                wanted = set(tests.split(","))
+                requested.append([code in wanted for code in codes])
+            else:
+                requested.append(panel)
+        return requested
+
+    def _write_results(self, analyzer_id, generator, sample_numbers):
+        orders = self.db.sample_orders(sample_numbers)
+        sample_numbers = [number for number in sample_numbers if number in orders]
+        requested = self._requested(analyzer_id, [orders[number][1] for number in sample_numbers])
+        self.db.upsert_results(generator.rows([orders[number][0] for number in sample_numbers], requested))
+        if requested is None:
+            count = len(generator.test_ids) * len(sample_numbers)
+        else:
+            count = sum(map(sum, requested))
+        self.metrics.counter(
+            "analyzersim_results_generated_total", "Results generated and stored", analyzer=analyzer_id
+        ).inc(count)
+        return count
+
+    def generate_results(self, analyzer_id, sample_numbers, **options):
+        """Generate results of the analyzer's panel for already stored samples.
+
+        Samples with requested tests, from a worklist or a host query, only
+        get results for those of the panel's tests. Sample numbers that are
+        not stored are skipped.
+
+        ``options`` are passed on to ResultGenerator (distribution,
+        out_of_range_rate, seed). Returns the number of results written.
+        """
+        generator = self._result_generator(analyzer_id, options)
+        if generator is None or not sample_numbers:
+            return 0
+        return self._write_results(analyzer_id, generator, sample_numbers)
+
+    def analyze(self, analyzer_id, samples, progress=None, batch_size=ANALYZE_BATCH_SIZE, **options):
+        """Store ``samples`` and generate their results, ``batch_size`` samples at a time.
+
+        ``progress(done, total)`` is called after every batch. Anything it
+        raises stops the run there; the batches already written stay stored.
+        Returns the number of results written.
+        """
+        samples = list(samples)
+        generator = self._result_generator(analyzer_id, options)
+        count = 0
+        for start in range(0, len(samples), batch_size):
+            batch = samples[start:start + batch_size]
+            self.store_samples(batch)
+            if generator is not None:
+                count += self._write_results(analyzer_id, generator, [sample[0] for sample in batch])
+            if progress is not None:
+                progress(start + len(batch), len(samples))
+        return count
+
+    async def run_analysis(self, analyzer_id, sample_numbers, speed=1.0, on_complete=None, **options):
+        """Analyze already stored samples on the analyzer's simulated timeline.
+
+        Each sample's results are generated and stored once its simulated
+        completion time comes up; ``speed`` is simulated seconds per second,
+        or None to run as fast as possible. Sample numbers that are not
+        stored are skipped. ``on_complete(sample_numbers, results)`` is
+        called after every stored batch. Returns (results, simulated_seconds).
+        """
+        generator = self._result_generator(analyzer_id, options)
+        if generator is None or not sample_numbers:
+            return 0, 0.0
+        model = self.throughput(analyzer_id)
+        panel = [test[0] for test in self.profile(analyzer_id).tests]
+        orders = self.db.sample_orders(sample_numbers)
+        sample_numbers = [number for number in sample_numbers if number in orders]
+        if not sample_numbers:
+            return 0, 0.0
+        requested = self._requested(analyzer_id, [orders[number][1] for number in sample_numbers])
+        if requested is None:
+            tests = ((number, panel) for number in sample_numbers)
+        else:
+            tests = (
+                (number, [test_id for test_id, wanted in zip(panel, row) if wanted])
+                for number, row in zip(sample_numbers, requested)
+            )
+        completions = model.schedule(tests)
+        count = 0
+        finish = 0.0
+        async for finish, batch in Timeline(completions, speed).play():
+            written = self._write_results(analyzer_id, generator, batch)
+            count += written
+            if on_complete is not None:
+                on_complete(batch, written)
+        return count, finish
+
+    def sample_page(self, after=None, limit=SAMPLE_PAGE_SIZE):
+        """Next ``limit`` samples, newest first.
+
+        Rows are (id, sample_number, patient_id, patient_name, date_time).
+        ``after`` is the (date_time, id) of the last row already fetched; the
+        page is found by seeking the date_time index, so deep pages cost the
+        same as the first one.
+        """
+        columns = "id, sample_number, patient_id, patient_name, date_time"
+        if after is None:
+            return self.db.fetchall(f"""
+                SELECT {columns} FROM samples
+                ORDER BY date_time DESC, id DESC
+                LIMIT ?
+            """, (limit,))
+        # Two seeks instead of a (date_time, id) < (?, ?) row-value test, which
+        # SQLite can only apply to date_time and would rescan a whole batch
+        last_time, last_id = after
+        rows = self.db.fetchall(f"""
+            SELECT {columns} FROM samples
+            WHERE date_time = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (last_time, last_id, limit))
+        if len(rows) < limit:
+            rows += self.db.fetchall(f"""
+                SELECT {columns} FROM samples
+                WHERE date_time < ?
+                ORDER BY date_time DESC, id DESC
+                LIMIT ?
+            """, (last_time, limit - len(rows)))
+        return rows
+
+    def sample_patient(self, sample_id):
+        return self.db.fetchone("""
+            SELECT patient_id, patient_name
+            FROM samples
+            WHERE id = ?
+        """, (sample_id,))
+
+    def sample_results(self, sample_id):
+        """Return (result_id, test_code, value, unit, lower, upper, sent) rows of a sample."""
+        return self.db.fetchall("""
+            SELECT r.id, t.test_code, r.result_value, t.unit, t.lower_range, t.upper_range, r.sent
+            FROM results r
+            JOIN tests t ON r.test_id = t.id
+            WHERE r.sample_id = ?
+        """, (sample_id,))
+
+    def _selection(self, analyzer_id, result_ids=None, sample_ids=None, sample_numbers=None, since=None,
+                   until=None, sent=False):
+        """Yield (where, params) pairs that together select results of the analyzer.
+
+        ``analyzer_id`` None takes results of every analyzer. Results can be
+        narrowed to given result ids, or to samples by database id or sample
+        number (one pair per chunk of them), to samples whose date_time lies
+        in [``since``, ``until``), and by their sent flag; ``sent=None``
+        takes sent and unsent results alike. The clauses only name columns
+        of ``results``, so they work in SELECT and UPDATE alike.
+        """
+        clauses = []
+        params = []
+        if analyzer_id is not None:
+            clauses.append("test_id IN (SELECT id FROM tests WHERE analyzer_id = ?)")
+            params.append(analyzer_id)
+        if sent is not None:
+            clauses.append(f"sent = {int(bool(sent))}")
+        sample_clauses = []
+        sample_params = []
+        if since:
+            sample_clauses.append("date_time >= ?")
+            sample_params.append(since)
+        if until:
+            sample_clauses.append("date_time < ?")
+            sample_params.append(until)
+        column, keys = None, None
+        if result_ids is not None:
+            column, keys = "id", result_ids
+        elif sample_ids is not None:
+            column, keys = "sample_id", sample_ids
+        elif sample_numbers is not None:
+            column, keys = "sample_number", sample_numbers
+        size = MAX_VARIABLES - len(params) - len(sample_params)
+        for chunk in (chunked(keys, size) if keys is not None else [None]):
+            # Parameters are collected next to their clauses so they stay in order
+            chunk_clauses, chunk_params = list(clauses), list(params)
+            samples, samples_params = list(sample_clauses), list(sample_params)
+            condition = f"{column} IN ({', '.join('?' * len(chunk))})" if chunk is not None else None
+            if condition and column == "sample_number":
+                samples.append(condition)
+                samples_params.extend(chunk)
+            if samples:
+                chunk_clauses.append(f"sample_id IN (SELECT id FROM samples WHERE {' AND '.join(samples)})")
+                chunk_params.extend(samples_params)
+            if condition and column != "sample_number":
+                chunk_clauses.append(condition)
+                chunk_params.extend(chunk)
+            yield " AND ".join(chunk_clauses) or "1", chunk_params
+
+    def select_result_ids(self, analyzer_id, **selection):
+        """Result ids picked by ``_selection()``, oldest first."""
+        result_ids = []
+        for where, params in self._selection(analyzer_id, **selection):
+            result_ids.extend(row[0] for row in self.db.fetchall(
+                f"SELECT id FROM results WHERE {where} ORDER BY id", params
+            ))
+        return result_ids
+
+    def count_results(self, analyzer_id=None, **selection):
+        """Number of results picked by ``_selection()``."""
+        return sum(
+            self.db.fetchone(f"SELECT COUNT(*) FROM results WHERE {where}", params)[0]
+            for where, params in self._selection(analyzer_id, **selection)
+        )
+
+    def export_batches(self, analyzer_id=None, batch_size=EXPORT_BATCH_SIZE, **selection):
+        """Yield lists of EXPORT_COLUMNS rows for the results picked by ``_selection()``.
+
+        Rows are fetched ``batch_size`` at a time from one open cursor, so
+        memory stays bounded however many results match.
+        """
+        cursor = self.db.connection.cursor()
+        try:
+            for where, params in self._selection(analyzer_id, **selection):
+                cursor.execute(f"""
+                    SELECT r.id, t.analyzer_id, a.name, s.sample_number, s.patient_id, s.patient_name,
+                           s.date_time, t.test_code, r.result_value, t.unit, t.lower_range,
+                           t.upper_range, r.sent
+                    FROM (SELECT * FROM results WHERE {where}) r
+                    JOIN samples s ON s.id = r.sample_id
+                    JOIN tests t ON t.id = r.test_id
+                    LEFT JOIN analyzers a ON a.id = t.analyzer_id
+                    ORDER BY r.id
+                """, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            cursor.close()
+
+    def unsent_result_ids(self, analyzer_id, sample_numbers=None):
+        """Unsent results of the analyzer, optionally only of ``sample_numbers``."""
+        return self.select_result_ids(analyzer_id, sample_numbers=sample_numbers)
+
+    def mark_selection_sent(self, analyzer_id, **selection):
+        """Mark the unsent results picked by ``_selection()`` sent without sending them.
+
+        Returns the number of results marked.
+        """
+        selection["sent"] = False
+        count = 0
+        with self.db.transaction() as cursor:
+            for where, params in self._selection(analyzer_id, **selection):
+                cursor.execute(f"UPDATE results SET sent = 1 WHERE {where}", params)
+                count += cursor.rowcount
+        return count
+
+    def result_samples(self, result_ids):
+        """Group results for transmission.
+
+        Returns (sample_number, patient_id, patient_name, results) tuples, where
+        ``results`` holds (test_code, value, unit, lower, upper) rows.
+        """
+        samples = {}
+        for chunk in chunked(result_ids, MAX_VARIABLES):
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.db.fetchall(f"""
+                SELECT s.id, s.sample_number, s.patient_id, s.patient_name,
+                       t.test_code, r.result_value, t.unit, t.lower_range, t.upper_range
+                FROM results r
+                JOIN samples s ON r.sample_id = s.id
+                JOIN tests t ON r.test_id = t.id
+                WHERE r.id IN ({placeholders})
+                ORDER BY r.sample_id, r.id
+            """, chunk)
+            for sample_id, number, patient_id, patient_name, *result in rows:
+                samples.setdefault(sample_id, (number, patient_id or "", patient_name or "", []))[3].append(result)
+        return list(samples.values())
+
+    async def request_sample_info(self, session, analyzer_id, sample_numbers, template_text=None,
+                                  timeout=RECEIVE_TIMEOUT, delay=0.0):
+        """Query the LIS for ``sample_numbers`` and store the orders it answers with.
+
+        The query follows the analyzer's sample info template, or
+        ``template_text``, and is sent after ``delay`` seconds (the
+        analyzer's sample ID sending delay). Returns the sample numbers the
+        LIS sent orders for.
+        """
+        if delay > 0:
+            import asyncio
+
+            await asyncio.sleep(delay)
+        template = self.template(analyzer_id, "sample_info", template_text)
+        await session.send_message(template.render_query(sample_numbers))
+        return self.store_orders(await session.receive_message(timeout))
+
+    def mark_results_sent(self, result_ids):
+        """Mark results sent; return how many were not marked before.
+
+        Runs of consecutive ids, the usual case for results generated
+        together, become one range update each; the rest go in chunked IN lists.
+        """
+        ranges, singles = [], []
+        for first, last in id_runs(result_ids):
+            if last - first >= 2:
+                ranges.append((first, last))
+            else:
+                singles.extend(range(first, last + 1))
+        with self.db.transaction() as cursor:
+            cursor.executemany("UPDATE results SET sent = 1 WHERE id BETWEEN ? AND ? AND sent = 0", ranges)
+            count = max(cursor.rowcount, 0)
+            for chunk in chunked(singles, MAX_VARIABLES):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"UPDATE results SET sent = 1 WHERE id IN ({placeholders}) AND sent = 0", chunk)
+                count += cursor.rowcount
+        return count
+
+    async def send_selection(self, session, analyzer_id, template_text=None, message_results=MESSAGE_RESULTS,
+                             **selection):
+        """Send the results picked by ``_selection()`` through the outbox; see send_queued().
+
+        Returns the ids of the results sent.
+        """
+        result_ids = self.select_result_ids(analyzer_id, **selection)
+        template = self.template(analyzer_id, "result_send", template_text)
+        sent, _ = await self.send_queued([session], analyzer_id, result_ids, template, message_results)
+        return sent
+
+    async def send_queued(self, sessions, analyzer_id, result_ids, template=None, message_results=MESSAGE_RESULTS):
+        """Queue ``result_ids`` in the outbox and send them over every one of ``sessions``.
+
+        Results go ``message_results`` to a message, the same message to
+        each session. A message's rows are claimed just before it is sent
+        and acked, so marked sent, once every session had it acknowledged.
+        When sending fails they are failed for a retry, or released if a
+        connection was lost, and the error is raised; later messages stay
+        queued. Returns (ids of the results sent, frames sent).
+        """
+        import asyncio
+
+        if template is None:
+            template = self.template(analyzer_id, "result_send")
+        outbox = self.outbox
+        outbox.enqueue_results(analyzer_id, result_ids)
+        sent = []
+        frames = 0
+        for start in range(0, len(result_ids), message_results):
+            batch = result_ids[start:start + message_results]
+            claimed = outbox.claim(analyzer_id, len(batch), batch)
+            if not claimed:
+                continue
+            claimed_ids = [row.result_id for row in claimed]
+            records = template.render_results(self.result_samples(claimed_ids))
+            try:
+                frames += sum(await asyncio.gather(*(session.send_message(records) for session in sessions)))
+            except BaseException as error:
+                if isinstance(error, Exception) and all(session.connected for session in sessions):
+                    outbox.fail(claimed, str(error) or type(error).__name__)
+                else:
+                    # The LIS did not turn them down, so the attempt does not count
+                    outbox.release(claimed)
+                raise
+            outbox.ack(claimed)
+            self.metrics.counter(
+                "analyzersim_results_sent_total", "Results the LIS acknowledged", analyzer=analyzer_id
+            ).inc(len(claimed) * len(sessions))
+            sent.extend(claimed_ids)
+        return sent, frames
+
+    async def send_results(self, session, analyzer_id, result_ids, template_text=None, template=None,
+                           mark_sent=True):
+        """Transmit results as one ASTM message over ``session``, then mark them sent.
+
+        The message follows the analyzer's result template, or ``template_text``,
+        or an already compiled ``template``. With ``mark_sent`` false the
+        caller marks them, as the outbox does when it acks.
+        """
+        samples = self.result_samples(result_ids)
+        if not samples:
+            return 0
+        if template is None:
+            template = self.template(analyzer_id, "result_send", template_text)
+        await session.send_message(template.render_results(samples))
+        self.metrics.counter(
+            "analyzersim_results_sent_total", "Results the LIS acknowledged", analyzer=analyzer_id
+        ).inc(len(result_ids))
+        if mark_sent:
+            self.mark_results_sent(result_ids)
+        return len(result_ids)
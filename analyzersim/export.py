@@ -0,0 +1,199 @@
+"""Streaming export of results.
+
+Results are read with SimulatorEngine.export_batches(), one fetchmany()
+batch at a time, and written as each batch arrives:
+
+    csv      header row, then one row per result
+    ndjson   one JSON object per result and line
+    parquet  one row group per batch (needs pyarrow)
+    arrow    Arrow IPC stream, one record batch per batch (needs pyarrow)
+    astm     the ASTM messages the analyzer's result template makes of the
+             results, one record per line and a blank line between messages
+
+Memory use is bounded by the batch size whatever the number of results.
+"""
+import csv
+import json
+import os
+import sys
+from contextlib import contextmanager
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # optional, only for the columnar formats
+    pyarrow = None
+
+from .engine import EXPORT_COLUMNS
+from .pipeline import MESSAGE_RESULTS
+
+FORMATS = ("csv", "ndjson", "parquet", "arrow", "astm")
+
+EXTENSIONS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".astm": "astm",
+}
+
+# Formats written as text; these can also go to standard output as "-"
+TEXT_FORMATS = ("csv", "ndjson", "astm")
+# Format of standard output when none is given
+STDOUT_FORMAT = "csv"
+
+
+class ExportError(ValueError):
+    pass
+
+
+def export_format(path):
+    """Format implied by the file extension of ``path``; STDOUT_FORMAT for "-"."""
+    if path == "-":
+        return STDOUT_FORMAT
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension not in EXTENSIONS:
+        raise ExportError(f"Unknown export type {extension or path!r}, expected one of {', '.join(FORMATS)}")
+    return EXTENSIONS[extension]
+
+
+def _arrow_schema():
+    string, real = pyarrow.string(), pyarrow.float64()
+    return pyarrow.schema([
+        ("result_id", pyarrow.int64()), ("analyzer_id", pyarrow.int64()), ("analyzer", string),
+        ("sample_number", string), ("patient_id", string), ("patient_name", string),
+        ("date_time", string), ("test_code", string), ("result_value", real), ("unit", string),
+        ("lower_range", real), ("upper_range", real), ("sent", pyarrow.bool_()),
+    ])
+
+
+def _arrow_batch(rows, schema):
+    columns = list(zip(*rows))
+    columns[-1] = [bool(sent) for sent in columns[-1]]
+    return pyarrow.record_batch(
+        [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+    )
+
+
+def write_csv(batches, stream):
+    writer = csv.writer(stream)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield len(rows)
+
+
+def write_ndjson(batches, stream):
+    for rows in batches:
+        stream.writelines(
+            json.dumps(dict(zip(EXPORT_COLUMNS, (*row[:-1], bool(row[-1])))), ensure_ascii=False) + "\n"
+            for row in rows
+        )
+        yield len(rows)
+
+
+def write_parquet(batches, path):
+    schema = _arrow_schema()
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for rows in batches:
+            writer.write_table(pyarrow.Table.from_batches([_arrow_batch(rows, schema)]))
+            yield len(rows)
+
+
+def write_arrow(batches, path):
+    schema = _arrow_schema()
+    with pyarrow.ipc.new_stream(path, schema) as writer:
+        for rows in batches:
+            writer.write_batch(_arrow_batch(rows, schema))
+            yield len(rows)
+
+
+def write_astm(batches, stream, template, message_results=MESSAGE_RESULTS):
+    """Render results as messages of up to ``message_results`` results each."""
+    samples = []
+    pending = 0
+    last_sample = None
+
+    def flush():
+        for record in template.render_results(samples):
+            stream.write(record + "\n")
+        stream.write("\n")
+
+    for rows in batches:
+        for (_, _, _, number, patient_id, patient_name, _, test_code, value, unit,
+             lower, upper, _) in rows:
+            if pending == message_results:
+                flush()
+                samples, pending, last_sample = [], 0, None
+            if number != last_sample:
+                samples.append((number, patient_id or "", patient_name or "", []))
+                last_sample = number
+            samples[-1][3].append((test_code, value, unit, lower, upper))
+            pending += 1
+        yield len(rows)
+    if samples:
+        flush()
+
+
+@contextmanager
+def _text_output(path):
+    if path == "-":
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+    with open(path, "w", encoding="utf-8", newline="") as stream:
+        yield stream
+
+
+def export_results(engine, path, format=None, analyzer_id=None, progress=None, template_text=None,
+                   batch_size=None, **selection):
+    """Write the results picked by ``selection`` to ``path``; return how many.
+
+    ``selection`` takes the filters of SimulatorEngine._selection (since,
+    until, sent, sample_numbers, ...). ``progress(done, total)`` is called
+    after every batch. The astm format needs ``analyzer_id`` for its
+    result template.
+    """
+    format = format or export_format(path)
+    if format not in FORMATS:
+        raise ExportError(f"Unknown export format {format!r}, expected one of {', '.join(FORMATS)}")
+    if format in ("parquet", "arrow") and pyarrow is None:
+        raise ExportError(f"Exporting {format} needs pyarrow (pip install pyarrow)")
+    if path == "-" and format not in TEXT_FORMATS:
+        raise ExportError(f"{format} cannot be written to standard output")
+    if format == "astm" and analyzer_id is None:
+        raise ExportError("ASTM export needs an analyzer for its result template")
+
+    total = engine.count_results(analyzer_id, **selection) if progress is not None else None
+    options = {"batch_size": batch_size} if batch_size else {}
+    batches = engine.export_batches(analyzer_id, **options, **selection)
+    done = 0
+
+    def report(written):
+        nonlocal done
+        for count in written:
+            done += count
+            if progress is not None:
+                progress(done, total)
+
+    try:
+        if format == "parquet":
+            report(write_parquet(batches, path))
+        elif format == "arrow":
+            report(write_arrow(batches, path))
+        else:
+            with _text_output(path) as stream:
+                if format == "csv":
+                    report(write_csv(batches, stream))
+                elif format == "ndjson":
+                    report(write_ndjson(batches, stream))
+                else:
+                    template = engine.template(analyzer_id, "result_send", template_text)
+                    report(write_astm(batches, stream, template))
+    finally:
+        # Release the read cursor now, even when writing stopped early
+        batches.close()
+    return done
@@ -0,0 +1,130 @@
+"""Run every configured analyzer against the LIS at once.
+
+Each analyzer of the fleet uses its own connection settings, test panel,
+timing and result template. All of them share one asyncio event loop: a
+scheduler task per analyzer produces results as samples complete, and a
+ResultPipeline per analyzer transmits whatever has come due after the
+analyzer's result sending delay. Statistics cover messages per second, the
+latency from sample completion to the LIS acknowledging the message, and
+per-analyzer backlog.
+"""
+import asyncio
+import time
+
+from .outbox import FAILED
+from .pipeline import MESSAGE_RESULTS, PipelineStats, ResultPipeline
+from .transport import AnalyzerSession, open_transport
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class AnalyzerStats(PipelineStats):
+    """Counters of one analyzer in the fleet."""
+
+    def __init__(self, analyzer_id, name):
+        super().__init__()
+        self.analyzer_id = analyzer_id
+        self.name = name
+        self.error = ""
+
+
+class FleetRunner:
+    """Analyzes ``samples`` synthetic samples on every analyzer and sends the results.
+
+    ``speed`` is passed on to SimulatorEngine.run_analysis (None for as fast
+    as possible). ``options`` go to the result generator. With ``trace`` (a
+    trace.TraceWriter) every session's bytes are recorded.
+    """
+
+    def __init__(self, engine, analyzer_ids, samples, speed=None, prefix="FLT",
+                 message_results=MESSAGE_RESULTS, log=None, trace=None, **options):
+        self.engine = engine
+        self.analyzer_ids = list(analyzer_ids)
+        self.samples = samples
+        self.speed = speed
+        self.prefix = prefix
+        self.message_results = message_results
+        self.log = log or (lambda message: None)
+        self.trace = trace
+        self.options = options
+        self.stats = {
+            analyzer_id: AnalyzerStats(analyzer_id, engine.analyzer_name(analyzer_id))
+            for analyzer_id in self.analyzer_ids
+        }
+        self.started = None
+        self.elapsed = 0.0
+
+    async def run(self, report=None, report_interval=1.0):
+        """Run the whole fleet; ``report(runner)`` is called every ``report_interval`` s."""
+        self.started = time.perf_counter()
+        reporter = None
+        if report is not None:
+            reporter = asyncio.create_task(self._report(report, report_interval))
+        try:
+            await asyncio.gather(*(self._run_analyzer(self.stats[analyzer_id])
+                                   for analyzer_id in self.analyzer_ids))
+        finally:
+            self.elapsed = time.perf_counter() - self.started
+            if reporter is not None:
+                reporter.cancel()
+        return self.summary()
+
+    async def _report(self, report, interval):
+        while True:
+            await asyncio.sleep(interval)
+            report(self)
+
+    async def _run_analyzer(self, stats):
+        analyzer_id = stats.analyzer_id
+        settings = self.engine.endpoint_settings(analyzer_id)
+        session = AnalyzerSession(stats.name, open_transport(settings, trace=self.trace, name=stats.name),
+                                  log=self.log)
+        numbers = [f"{self.prefix}{analyzer_id:03d}-{number:08d}" for number in range(1, self.samples + 1)]
+        self.engine.store_samples((number, "", "") for number in numbers)
+        pipeline = ResultPipeline(self.engine, analyzer_id, session, settings.result_delay_seconds,
+                                  self.message_results, stats=stats, log=self.log)
+
+        try:
+            await session.open()
+            sender = asyncio.create_task(pipeline.run())
+            try:
+                await self.engine.run_analysis(analyzer_id, numbers, self.speed,
+                                               lambda batch, results: pipeline.submit(batch), **self.options)
+                pipeline.close()
+                await sender
+            finally:
+                sender.cancel()
+        except Exception as error:
+            stats.error = str(error) or type(error).__name__
+            self.log(f"{stats.name}: {stats.error}")
+        finally:
+            await session.close()
+        failed = self.engine.outbox.depth(analyzer_id)[FAILED]
+        if failed and not stats.error:
+            stats.error = f"{failed} results failed to send"
+
+    def summary(self):
+        """Aggregate figures: totals, rates, latency percentiles and backlog."""
+        elapsed = (time.perf_counter() - self.started) if self.started and not self.elapsed else self.elapsed
+        latencies = sorted(latency for stats in self.stats.values() for latency in stats.latencies)
+        messages = sum(stats.messages for stats in self.stats.values())
+        results = sum(stats.results for stats in self.stats.values())
+        return {
+            "analyzers": len(self.stats),
+            "elapsed": elapsed,
+            "messages": messages,
+            "results": results,
+            "messages_per_second": messages / elapsed if elapsed else 0.0,
+            "results_per_second": results / elapsed if elapsed else 0.0,
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_p99": percentile(latencies, 0.99),
+            "backlog": {stats.name: stats.backlog for stats in self.stats.values()},
+            "errors": {stats.name: stats.error for stats in self.stats.values() if stats.error},
+        }
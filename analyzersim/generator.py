@@ -0,0 +1,87 @@
+"""Vectorized result generation.
+
+A ``ResultGenerator`` holds one analyzer's test panel as NumPy arrays and
+draws the results for a whole batch of samples as a samples x tests matrix
+in a single call.
+"""
+import numpy as np
+
+
+def uniform(rng, lower, upper, size):
+    """Values spread evenly over the normal range."""
+    return rng.uniform(lower, upper, size)
+
+
+def normal(rng, lower, upper, size):
+    """Values clustered around mid-range; the range spans six standard deviations."""
+    return rng.normal((lower + upper) / 2, (upper - lower) / 6, size)
+
+
+# Distributions selectable by name; any callable with the same signature works too
+DISTRIBUTIONS = {
+    "uniform": uniform,
+    "normal": normal,
+}
+
+
+class ResultGenerator:
+    """Draws results for one test panel.
+
+    ``tests`` is a sequence of (test_id, lower_range, upper_range) rows.
+    ``out_of_range_rate`` is the fraction of results pushed outside the normal
+    range so that they come out flagged. The same ``seed`` reproduces the same
+    results for the same sequence of calls.
+    """
+
+    def __init__(self, tests, distribution="uniform", out_of_range_rate=0.0, seed=None, decimals=3):
+        if isinstance(distribution, str):
+            try:
+                distribution = DISTRIBUTIONS[distribution]
+            except KeyError:
+                raise ValueError(f"Unknown result distribution: {distribution}") from None
+        if not 0.0 <= out_of_range_rate <= 1.0:
+            raise ValueError("out_of_range_rate must be between 0 and 1")
+
+        panel = np.array([(test[1], test[2]) for test in tests], dtype=np.float64).reshape(-1, 2)
+        self.test_ids = np.array([test[0] for test in tests], dtype=np.int64)
+        self.lower = panel[:, 0]
+        self.upper = panel[:, 1]
+        self.distribution = distribution
+        self.out_of_range_rate = out_of_range_rate
+        self.decimals = decimals
+        self.rng = np.random.default_rng(seed)
+
+    def generate(self, sample_count):
+        """Return a (sample_count, tests) matrix of rounded result values."""
+        size = (sample_count, len(self.test_ids))
+        values = self.distribution(self.rng, self.lower, self.upper, size)
+        values = np.clip(values, self.lower, self.upper)
+
+        if self.out_of_range_rate:
+            flagged = self.rng.random(size) < self.out_of_range_rate
+            # Go below the range only where it leaves room above zero
+            below = (self.rng.random(size) < 0.5) & (self.lower > 0)
+            span = self.upper - self.lower
+            distance = self.rng.uniform(0.1, 1.0, size)
+            low_values = self.lower - distance * np.minimum(span / 2, self.lower)
+            high_values = self.upper + distance * np.maximum(span / 2, 10.0 ** -self.decimals)
+            values = np.where(flagged, np.where(below, low_values, high_values), values)
+
+        return np.round(values, self.decimals)
+
+    def rows(self, sample_db_ids, requested=None):
+        """Generate results for ``sample_db_ids`` as (sample_id, test_id, value) rows.
+
+        ``requested``, a samples x tests matrix of booleans, keeps only the
+        results of the tests each sample was ordered for. The whole matrix is
+        drawn either way, so a seed gives a test the same value with or
+        without it.
+        """
+        sample_db_ids = np.asarray(sample_db_ids, dtype=np.int64)
+        values = self.generate(len(sample_db_ids)).ravel()
+        sample_column = np.repeat(sample_db_ids, len(self.test_ids))
+        test_column = np.tile(self.test_ids, len(sample_db_ids))
+        if requested is not None:
+            keep = np.asarray(requested, dtype=bool).ravel()
+            sample_column, test_column, values = sample_column[keep], test_column[keep], values[keep]
+        return zip(sample_column.tolist(), test_column.tolist(), values.tolist())
@@ -0,0 +1,318 @@
+"""ASTM E1381 low-level link layer as a non-blocking state machine.
+
+``LinkLayer`` does no I/O. Feed it received bytes with ``data_received()``
+and call ``poll()`` once ``deadline`` has passed. Collect bytes to transmit
+with ``take_output()`` and outcomes from ``events``. One instance per
+connection covers both directions: establishment with ENQ, contention,
+NAK-triggered retransmission, the 15 s / 30 s timers and EOT termination.
+
+The "Read: <ACK>" steps of a template script are the replies this machine
+waits for after the ENQ and after each frame.
+"""
+import enum
+import time
+from collections import deque, namedtuple
+
+from .astm import ACK, ENQ, EOT, LF, NAK, STX, decode_frame
+from .parser import RecordAssembler
+
+# Timers and limits of E1381 section 6
+REPLY_TIMEOUT = 15.0
+RECEIVE_TIMEOUT = 30.0
+BUSY_RETRY_DELAY = 10.0
+CONTENTION_DELAY = {"instrument": 1.0, "computer": 20.0}
+MAX_ATTEMPTS = 6
+
+# A message left the link; ``retransmits`` counts NAKed frames sent again
+MessageSent = namedtuple("MessageSent", "token frames retransmits elapsed")
+MessageFailed = namedtuple("MessageFailed", "token reason")
+# A complete message arrived; ``records`` holds the bytes of each record,
+# reassembled from ETB frames (see parser.parse_records)
+MessageReceived = namedtuple("MessageReceived", "records")
+
+
+class LinkMetrics:
+    """The metrics one link reports to a metrics.Registry, labelled with its session."""
+
+    def __init__(self, registry, session):
+        self.frames_sent = registry.counter(
+            "analyzersim_frames_sent_total", "Frames written, retransmissions included", session=session)
+        self.frames_received = registry.counter(
+            "analyzersim_frames_received_total", "Frames received and acknowledged", session=session)
+        self.frames_rejected = registry.counter(
+            "analyzersim_frames_rejected_total", "Frames received and answered with NAK", session=session)
+        self.retransmits = registry.counter(
+            "analyzersim_retransmits_total", "Frames sent again after a NAK", session=session)
+        self.messages_sent = registry.counter(
+            "analyzersim_messages_sent_total", "Messages the receiver acknowledged in full", session=session)
+        self.messages_failed = registry.counter(
+            "analyzersim_messages_failed_total", "Messages given up on", session=session)
+        self.messages_received = registry.counter(
+            "analyzersim_messages_received_total", "Messages received up to their EOT", session=session)
+        self.ack_latency = registry.histogram(
+            "analyzersim_ack_latency_seconds", "Time from writing an ENQ or frame to its ACK", session=session)
+        self.receive_time = registry.histogram(
+            "analyzersim_receive_seconds", "Time from a received ENQ to its EOT", session=session)
+
+
+class State(enum.Enum):
+    NEUTRAL = "neutral"
+    BACKOFF = "backoff"
+    ESTABLISHING = "establishing"
+    TRANSFER = "transfer"
+    RECEIVING = "receiving"
+
+
+class _Outgoing:
+    __slots__ = ("frames", "token", "index", "attempts", "retransmits", "started")
+
+    def __init__(self, frames, token):
+        self.frames = frames
+        self.token = token
+        self.index = 0
+        self.attempts = 0
+        self.retransmits = 0
+        self.started = None
+
+
+class LinkLayer:
+    """Link state of one connection.
+
+    ``role`` is "instrument" for the analyzer side and "computer" for the
+    LIS side; it only decides who yields on line contention. With
+    ``metrics`` (a LinkMetrics) frames, messages and ACK latency are counted.
+
+    ``reject``, when set, is called with every received frame that passed
+    its checks; returning True answers it with NAK all the same, which is
+    how a test peer injects faults.
+    """
+
+    def __init__(self, role="instrument", clock=time.monotonic, metrics=None):
+        if role not in CONTENTION_DELAY:
+            raise ValueError(f"Unknown link role: {role}")
+        self.role = role
+        self.clock = clock
+        self.metrics = metrics
+        self.state = State.NEUTRAL
+        self.deadline = None
+        self.events = deque()
+        self.accepting = True
+        self.reject = None
+        self._queue = deque()
+        self._current = None
+        self._output = bytearray()
+        self._frame = bytearray()
+        self._in_frame = False
+        self._received = []
+        self._assembler = RecordAssembler()
+        self._expected_number = 1
+        self._last_number = None
+        # When the ENQ or frame waiting for its ACK was written
+        self._written_at = None
+        # When the ENQ of the message being received arrived
+        self._receive_started = None
+
+    # Outbound
+
+    def send(self, frames, token=None):
+        """Queue a message (a list of encoded frames) for transmission."""
+        self._queue.append(_Outgoing(frames, token))
+        if self.state == State.NEUTRAL:
+            self._establish()
+
+    @property
+    def pending(self):
+        """Messages queued or in transfer."""
+        return len(self._queue) + (self._current is not None)
+
+    def take_output(self):
+        """Return and clear the bytes waiting to be written."""
+        data = bytes(self._output)
+        self._output.clear()
+        return data
+
+    def _write(self, data):
+        self._output += data
+
+    def _establish(self):
+        if not self._queue:
+            self._neutral()
+            return
+        self._current = self._queue.popleft()
+        if self._current.started is None:
+            self._current.started = self.clock()
+        self._write(ENQ)
+        self.state = State.ESTABLISHING
+        self._written_at = self.clock()
+        self.deadline = self._written_at + REPLY_TIMEOUT
+
+    def _send_frame(self):
+        self._write(self._current.frames[self._current.index])
+        self._written_at = self.clock()
+        self.deadline = self._written_at + REPLY_TIMEOUT
+        if self.metrics is not None:
+            self.metrics.frames_sent.inc()
+
+    def _finish(self, reason=None):
+        message, self._current = self._current, None
+        self._write(EOT)
+        if reason is None:
+            self.events.append(MessageSent(
+                message.token, len(message.frames), message.retransmits, self.clock() - message.started
+            ))
+        else:
+            self.events.append(MessageFailed(message.token, reason))
+        if self.metrics is not None:
+            (self.metrics.messages_sent if reason is None else self.metrics.messages_failed).inc()
+        # Pipeline the next message straight after the EOT
+        self._establish()
+
+    def _neutral(self):
+        self.state = State.NEUTRAL
+        self.deadline = None
+
+    def _backoff(self, delay):
+        self._queue.appendleft(self._current)
+        self._current = None
+        self.state = State.BACKOFF
+        self.deadline = self.clock() + delay
+
+    # Inbound
+
+    def data_received(self, data):
+        index = 0
+        size = len(data)
+        while index < size:
+            if self._in_frame or (data[index] == STX[0] and self.state == State.RECEIVING):
+                # Take everything up to the frame's LF in one slice
+                end = data.find(LF, index)
+                if end < 0:
+                    self._frame += data[index:]
+                    self._in_frame = True
+                    return
+                self._frame += data[index:end + 1]
+                self._in_frame = False
+                self._frame_received(bytes(self._frame))
+                self._frame.clear()
+                index = end + 1
+                continue
+            byte = data[index]
+            index += 1
+            if byte == ENQ[0]:
+                self._on_enq()
+            elif byte == ACK[0] or (byte == EOT[0] and self.state == State.TRANSFER):
+                self._on_ack()
+            elif byte == NAK[0]:
+                self._on_nak()
+            elif byte == EOT[0] and self.state == State.RECEIVING:
+                self._on_eot()
+
+    def _on_enq(self):
+        if self.state == State.ESTABLISHING:
+            # Line contention: the computer system yields and waits to receive,
+            # the instrument retries after a pause
+            self._backoff(CONTENTION_DELAY[self.role])
+            return
+        if self.state not in (State.NEUTRAL, State.BACKOFF):
+            return
+        if not self.accepting:
+            self._write(NAK)
+            return
+        self._write(ACK)
+        self._received = []
+        self._assembler.reset()
+        self._expected_number = 1
+        self._last_number = None
+        self.state = State.RECEIVING
+        self._receive_started = self.clock()
+        self.deadline = self._receive_started + RECEIVE_TIMEOUT
+
+    def _on_ack(self):
+        if self.metrics is not None and self.state in (State.ESTABLISHING, State.TRANSFER):
+            self.metrics.ack_latency.record(self.clock() - self._written_at)
+        if self.state == State.ESTABLISHING:
+            self.state = State.TRANSFER
+            self._send_frame()
+        elif self.state == State.TRANSFER:
+            message = self._current
+            message.index += 1
+            message.attempts = 0
+            if message.index == len(message.frames):
+                self._finish()
+            else:
+                self._send_frame()
+
+    def _on_nak(self):
+        if self.state == State.ESTABLISHING:
+            # The receiver is busy
+            self._backoff(BUSY_RETRY_DELAY)
+        elif self.state == State.TRANSFER:
+            message = self._current
+            message.attempts += 1
+            if message.attempts >= MAX_ATTEMPTS:
+                self._finish(f"frame {message.index + 1} rejected {MAX_ATTEMPTS} times")
+            else:
+                message.retransmits += 1
+                if self.metrics is not None:
+                    self.metrics.retransmits.inc()
+                self._send_frame()
+
+    def _frame_received(self, raw):
+        number, text, final, valid = decode_frame(raw)
+        self.deadline = self.clock() + RECEIVE_TIMEOUT
+        if valid and number == self._last_number:
+            # Our ACK got lost and the sender repeated the frame
+            self._write(ACK)
+        elif valid and number == self._expected_number and not (self.reject and self.reject(raw)):
+            record = self._assembler.add(text, final)
+            if record is not None:
+                self._received.append(record)
+            self._last_number = number
+            self._expected_number = (number + 1) & 7
+            self._write(ACK)
+            if self.metrics is not None:
+                self.metrics.frames_received.inc()
+        else:
+            self._write(NAK)
+            if self.metrics is not None:
+                self.metrics.frames_rejected.inc()
+
+    def _on_eot(self):
+        self.events.append(MessageReceived(self._received))
+        if self.metrics is not None:
+            self.metrics.messages_received.inc()
+            self.metrics.receive_time.record(self.clock() - self._receive_started)
+        self._received = []
+        self._after_receive()
+
+    def _after_receive(self):
+        self._neutral()
+        if self._queue:
+            self._establish()
+
+    # Timers
+
+    def poll(self):
+        """Handle an expired timer; call whenever ``deadline`` has passed."""
+        if self.deadline is None or self.clock() < self.deadline:
+            return
+        if self.state == State.BACKOFF:
+            self._establish()
+        elif self.state in (State.ESTABLISHING, State.TRANSFER):
+            self._finish("no reply within %g s" % REPLY_TIMEOUT)
+        elif self.state == State.RECEIVING:
+            # Sender went silent: drop the partial message
+            self._received = []
+            self._frame.clear()
+            self._in_frame = False
+            self._after_receive()
+
+    def connection_lost(self, reason="connection lost"):
+        """Fail every queued message."""
+        messages = ([self._current] if self._current else []) + list(self._queue)
+        self._current = None
+        self._queue.clear()
+        self._output.clear()
+        self._neutral()
+        for message in messages:
+            self.events.append(MessageFailed(message.token, reason))
@@ -0,0 +1,159 @@
+"""Bounded in-memory log with optional JSON-lines files on disk.
+
+``LogBuffer`` keeps the last ``capacity`` records in a ring buffer, so
+memory stays flat however long the simulator runs. Any thread may append;
+a view polls ``take_new()`` on a timer and draws everything that arrived
+since its last poll in one go instead of repainting per line. Records can
+also be written to a ``JsonLinesLog``, one JSON object per line, rotated
+by size.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+DEBUG = "debug"
+INFO = "info"
+WARNING = "warning"
+ERROR = "error"
+# Lowest first
+LEVELS = (DEBUG, INFO, WARNING, ERROR)
+_RANKS = {level: rank for rank, level in enumerate(LEVELS)}
+
+# Records kept in memory
+DEFAULT_CAPACITY = 10000
+# Log file size at which it is rotated, and rotated files kept
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+# ``time`` is a time.time() timestamp; ``source`` names the analyzer or session
+LogRecord = namedtuple("LogRecord", "time level source message")
+
+
+def matches(record, level=None, source=None, text=None):
+    """Whether ``record`` is at ``level`` or above, from ``source`` and contains ``text``."""
+    if level is not None and _RANKS[record.level] < _RANKS[level]:
+        return False
+    if source is not None and record.source != source:
+        return False
+    return text is None or text.lower() in record.message.lower()
+
+
+def format_record(record):
+    moment = datetime.fromtimestamp(record.time).strftime("%H:%M:%S.%f")[:-3]
+    level = "" if record.level == INFO else f" {record.level.upper()}"
+    source = f" [{record.source}]" if record.source else ""
+    return f"{moment}{level}{source} {record.message}"
+
+
+class JsonLinesLog:
+    """Appends records to ``path`` as JSON lines.
+
+    Once the file reaches ``max_bytes`` it becomes ``path.1``, the previous
+    ``path.1`` becomes ``path.2`` and so on; files past ``backups`` are
+    deleted. Writes are buffered until ``flush()``.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = open(path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+
+    def write(self, record):
+        line = json.dumps({
+            "time": datetime.fromtimestamp(record.time).isoformat(timespec="milliseconds"),
+            "level": record.level,
+            "source": record.source,
+            "message": record.message,
+        }, ensure_ascii=False) + "\n"
+        if self._size and self._size + len(line) > self.max_bytes:
+            self.rotate()
+        self._file.write(line)
+        self._size += len(line)
+
+    def rotate(self):
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{index}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{index + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._size = 0
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class LogBuffer:
+    """Thread-safe ring buffer of the last ``capacity`` LogRecords."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, clock=time.time):
+        self.capacity = capacity
+        self.clock = clock
+        self.sources = set()
+        # Records pushed out of the new list before a view took them
+        self.dropped = 0
+        self._records = deque(maxlen=capacity)
+        self._new = deque(maxlen=capacity)
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, message, level=INFO, source=""):
+        record = LogRecord(self.clock(), level, source, message)
+        with self._lock:
+            self._records.append(record)
+            if len(self._new) == self.capacity:
+                self.dropped += 1
+            self._new.append(record)
+            if source not in self.sources:
+                self.sources = self.sources | {source}
+            if self._file is not None:
+                self._file.write(record)
+        return record
+
+    def take_new(self):
+        """Records appended since the last call, oldest first; flushes the log file."""
+        with self._lock:
+            records = list(self._new)
+            self._new.clear()
+            if self._file is not None:
+                self._file.flush()
+        return records
+
+    def records(self, level=None, source=None, text=None):
+        """The records kept in memory that pass ``matches()``, oldest first."""
+        with self._lock:
+            records = list(self._records)
+        if level is None and source is None and text is None:
+            return records
+        return [record for record in records if matches(record, level, source, text)]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._new.clear()
+
+    def open_file(self, path, max_bytes=DEFAULT_MAX_BYTES, backups=DEFAULT_BACKUPS):
+        """Also write every record appended from now on to a JsonLinesLog at ``path``."""
+        log = JsonLinesLog(path, max_bytes, backups)
+        with self._lock:
+            previous, self._file = self._file, log
+        if previous is not None:
+            previous.close()
+
+    def close_file(self):
+        with self._lock:
+            log, self._file = self._file, None
+        if log is not None:
+            log.close()
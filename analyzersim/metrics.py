@@ -0,0 +1,338 @@
+"""In-process metrics: counters, gauges and latency histograms.
+
+Metrics live in a ``Registry`` under a name and a set of labels; asking for
+the same name and labels again returns the same metric, so hot paths can
+look them up once and keep them. ``REGISTRY`` is the registry the simulator
+reports to unless it is given another one.
+
+Updates are plain attribute arithmetic without locks. Under the GIL an
+update racing another thread's can very rarely be lost, which is accepted
+for monitoring counts in exchange for near-zero cost.
+
+Histograms record durations the way HdrHistogram does: integer
+microseconds into log-linear buckets, exact below 32 us and within 1/16
+(about 6%) of the value above, with no upper limit. Percentiles, count,
+sum, min and max come from the buckets.
+
+``MetricsServer`` serves a registry in the Prometheus text format, with
+histograms as summaries (quantiles plus _sum and _count).
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Port of the Prometheus endpoint unless another is given
+DEFAULT_PORT = 9464
+
+# Quantiles exported for every histogram
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Sub-buckets per power of two in a histogram, as a bit count
+SUB_BUCKET_BITS = 4
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_LINEAR_LIMIT = _SUB_BUCKETS * 2
+
+
+class Counter:
+    """A count that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    """A value that goes up and down, or is read from ``function`` when given."""
+
+    kind = "gauge"
+
+    def __init__(self, function=None):
+        self._value = 0
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self._value
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    def dec(self, amount=1):
+        self._value -= amount
+
+
+def _bucket(units):
+    if units < _LINEAR_LIMIT:
+        return units
+    shift = units.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * _SUB_BUCKETS + (units >> shift)
+
+
+def _bucket_bounds(index):
+    """Lowest and highest microsecond value counted in bucket ``index``."""
+    if index < _LINEAR_LIMIT:
+        return index, index
+    shift = index // _SUB_BUCKETS - 1
+    mantissa = index - shift * _SUB_BUCKETS
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Histogram:
+    """Distribution of durations in seconds, kept in log-linear microsecond buckets."""
+
+    kind = "histogram"
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = _bucket(max(0, int(seconds * 1_000_000)))
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    @contextmanager
+    def time(self):
+        """Record how long the block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter() - start)
+
+    def percentile(self, fraction):
+        """Seconds at or below which ``fraction`` of the values fall; 0.0 when empty.
+
+        As in HdrHistogram the result is the highest value of the bucket it
+        falls in, capped at the largest value recorded.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_bucket_bounds(index)[1] / 1_000_000, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def reset(self):
+        self.__init__()
+
+    def copy(self):
+        copy = Histogram()
+        copy.counts = list(self.counts)
+        copy.count, copy.sum, copy.min, copy.max = self.count, self.sum, self.min, self.max
+        return copy
+
+    def since(self, earlier):
+        """A histogram of the values recorded after ``earlier``, a copy() of this one.
+
+        Its min and max are only known to bucket precision.
+        """
+        delta = Histogram()
+        delta.counts = [count - (earlier.counts[index] if index < len(earlier.counts) else 0)
+                        for index, count in enumerate(self.counts)]
+        delta.count = self.count - earlier.count
+        delta.sum = self.sum - earlier.sum
+        filled = [index for index, count in enumerate(delta.counts) if count]
+        if filled:
+            delta.min = max(_bucket_bounds(filled[0])[0] / 1_000_000, self.min)
+            delta.max = min(_bucket_bounds(filled[-1])[1] / 1_000_000, self.max)
+        return delta
+
+
+_KINDS = {"counter": Counter, "gauge": Gauge, "histogram": Histogram}
+
+
+class Family:
+    """All metrics of one name, one per label set."""
+
+    def __init__(self, name, kind, help):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        # {((label, value), ...): metric}
+        self.metrics = {}
+
+
+class Registry:
+    """Named metrics, plus collectors that refresh gauges before each read."""
+
+    def __init__(self):
+        self._families = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _metric(self, kind, name, help, labels, **options):
+        key = tuple(sorted((label, str(value)) for label, value in labels.items()))
+        family = self._families.get(name)
+        metric = family.metrics.get(key) if family is not None and family.kind == kind else None
+        if metric is not None:
+            return metric
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(name, kind, help)
+            elif family.kind != kind:
+                raise ValueError(f"Metric {name} is a {family.kind}, not a {kind}")
+            metric = family.metrics.get(key)
+            if metric is None:
+                metric = family.metrics[key] = _KINDS[kind](**options)
+            return metric
+
+    def counter(self, name, help, **labels):
+        return self._metric("counter", name, help, labels)
+
+    def gauge(self, name, help, function=None, **labels):
+        gauge = self._metric("gauge", name, help, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help, **labels):
+        return self._metric("histogram", name, help, labels)
+
+    def add_collector(self, collector):
+        """Call ``collector(registry)`` before every read, to bring gauges up to date."""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def collect(self):
+        """Run the collectors; return the families sorted by name."""
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            collector(self)
+        with self._lock:
+            return [self._families[name] for name in sorted(self._families)]
+
+    def samples(self):
+        """Yield (name, kind, labels, metric) for every metric, after collecting."""
+        for family in self.collect():
+            for key, metric in list(family.metrics.items()):
+                yield family.name, family.kind, dict(key), metric
+
+    def prometheus(self):
+        """The registry in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for family in self.collect():
+            kind = "summary" if family.kind == "histogram" else family.kind
+            lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+            lines.append(f"# TYPE {family.name} {kind}")
+            for key, metric in sorted(family.metrics.items()):
+                if family.kind == "histogram":
+                    for quantile in QUANTILES:
+                        labels = _labels(key + (("quantile", str(quantile)),))
+                        lines.append(f"{family.name}{labels} {_number(metric.percentile(quantile))}")
+                    lines.append(f"{family.name}_sum{_labels(key)} {_number(metric.sum)}")
+                    lines.append(f"{family.name}_count{_labels(key)} {metric.count}")
+                else:
+                    lines.append(f"{family.name}{_labels(key)} {_number(metric.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{label}="{_escape_label(value)}"' for label, value in key) + "}"
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+
+def _handler(registry):
+    """A request handler class serving ``registry``."""
+    # http.server is only loaded once an endpoint is started
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class MetricsServer:
+    """Serves ``registry`` at http://host:port/metrics from a daemon thread.
+
+    Port 0 picks a free port; ``address`` tells which.
+    """
+
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=DEFAULT_PORT):
+        from http.server import ThreadingHTTPServer
+
+        self._server = ThreadingHTTPServer((host, port), _handler(registry))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="analyzersim-metrics", daemon=True)
+
+    @property
+    def address(self):
+        return self._server.server_address[:2]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread.is_alive():
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
@@ -0,0 +1,198 @@
+"""Schema migrations for analyzersim.db.
+
+The schema version lives in ``PRAGMA user_version``. Each entry in
+``MIGRATIONS`` upgrades the schema by one version and runs in its own
+transaction together with the version bump, so an interrupted upgrade
+resumes where it stopped. Append new migrations; never edit applied ones.
+"""
+
+# Tables as created by the first releases of the simulator (schema version 0)
+BASE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS analyzers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS connection_settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        analyzer_id INTEGER,
+        connection_type TEXT,
+        socket_type TEXT,
+        analyzer_address TEXT,
+        analyzer_port TEXT,
+        lis_address TEXT,
+        lis_port TEXT,
+        serial_port TEXT,
+        baud_rate TEXT,
+        data_bits TEXT,
+        stop_bits TEXT,
+        parity TEXT,
+        auto_result_sending INTEGER,
+        request_sample_info INTEGER,
+        sample_id_delay INTEGER,
+        result_sending_delay INTEGER,
+        FOREIGN KEY (analyzer_id) REFERENCES analyzers(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS astm_templates (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        analyzer_id INTEGER,
+        template_type TEXT,
+        template_content TEXT,
+        FOREIGN KEY (analyzer_id) REFERENCES analyzers(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        analyzer_id INTEGER,
+        test_code TEXT,
+        unit TEXT,
+        lower_range REAL,
+        upper_range REAL,
+        FOREIGN KEY (analyzer_id) REFERENCES analyzers(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS samples (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sample_number TEXT,
+        patient_id TEXT,
+        patient_name TEXT,
+        date_time TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sample_id INTEGER,
+        test_id INTEGER,
+        result_value REAL,
+        sent INTEGER DEFAULT 0,
+        FOREIGN KEY (sample_id) REFERENCES samples(id),
+        FOREIGN KEY (test_id) REFERENCES tests(id)
+    )
+    """,
+)
+
+
+def _unique_keys(cursor):
+    # Fold duplicate sample numbers into the oldest sample row and keep the
+    # newest result per sample/test pair, then add the keys the bulk upserts use
+    cursor.execute("""
+        UPDATE results SET sample_id = (
+            SELECT MIN(keep.id) FROM samples keep
+            JOIN samples dup ON dup.sample_number = keep.sample_number
+            WHERE dup.id = results.sample_id
+        )
+        WHERE sample_id IN (
+            SELECT id FROM samples
+            WHERE sample_number IS NOT NULL
+              AND id NOT IN (SELECT MIN(id) FROM samples GROUP BY sample_number)
+        )
+    """)
+    cursor.execute("""
+        DELETE FROM samples
+        WHERE sample_number IS NOT NULL
+          AND id NOT IN (SELECT MIN(id) FROM samples GROUP BY sample_number)
+    """)
+    cursor.execute("""
+        DELETE FROM results
+        WHERE id NOT IN (SELECT MAX(id) FROM results GROUP BY sample_id, test_id)
+    """)
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_samples_sample_number ON samples (sample_number)"
+    )
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_results_sample_test ON results (sample_id, test_id)"
+    )
+
+
+def _lookup_indexes(cursor):
+    # results.sample_id and samples.sample_number are served by the unique keys above
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_results_test_id ON results (test_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_tests_analyzer_id ON tests (analyzer_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_samples_date_time ON samples (date_time)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_connection_settings_analyzer_id "
+        "ON connection_settings (analyzer_id)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS ix_astm_templates_analyzer_id "
+        "ON astm_templates (analyzer_id, template_type)"
+    )
+    cursor.execute("ANALYZE")
+
+
+def _requested_tests(cursor):
+    # Tests the LIS ordered for a sample, comma separated; NULL when entered locally
+    cursor.execute("ALTER TABLE samples ADD COLUMN requested_tests TEXT")
+
+
+def _throughput(cursor):
+    # Seconds a test occupies a channel, and each analyzer's parallel channels
+    # and optional tests-per-hour rating (see scheduler.ThroughputModel)
+    cursor.execute("ALTER TABLE tests ADD COLUMN cycle_time REAL NOT NULL DEFAULT 60")
+    cursor.execute("ALTER TABLE analyzers ADD COLUMN channels INTEGER NOT NULL DEFAULT 1")
+    cursor.execute("ALTER TABLE analyzers ADD COLUMN tests_per_hour INTEGER")
+
+
+def _outbox(cursor):
+    # Durable queue of results waiting for the LIS (see outbox.Outbox)
+    cursor.execute("""
+        CREATE TABLE outbox (
+            id INTEGER PRIMARY KEY,
+            result_id INTEGER NOT NULL UNIQUE,
+            analyzer_id INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            queued_at REAL NOT NULL,
+            not_before REAL NOT NULL,
+            claimed_at REAL,
+            acked_at REAL,
+            last_error TEXT,
+            FOREIGN KEY (result_id) REFERENCES results(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX ix_outbox_queue ON outbox (analyzer_id, state, not_before)")
+    cursor.execute("CREATE INDEX ix_outbox_acked_at ON outbox (state, acked_at)")
+
+
+# MIGRATIONS[n] upgrades the schema from version n to n + 1
+MIGRATIONS = [
+    _unique_keys,
+    _lookup_indexes,
+    _requested_tests,
+    _throughput,
+    _outbox,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db):
+    return db.fetchone("PRAGMA user_version")[0]
+
+
+def migrate(db, target=SCHEMA_VERSION):
+    """Apply pending migrations to ``db`` up to ``target``; return the new version."""
+    version = schema_version(db)
+    if version == 0:
+        with db.transaction() as cursor:
+            for statement in BASE_SCHEMA:
+                cursor.execute(statement)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"{db.path} has schema version {version}, newer than this simulator "
+            f"supports ({SCHEMA_VERSION})"
+        )
+    for number in range(version, target):
+        with db.transaction() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            MIGRATIONS[number](cursor)
+            cursor.execute(f"PRAGMA user_version = {number + 1}")
+        version = number + 1
+    return version
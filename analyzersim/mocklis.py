@@ -0,0 +1,338 @@
+"""A mock LIS to run the simulator against on one machine.
+
+``MockLIS`` serves any number of analyzer connections on one event loop.
+It listens for analyzers whose socket type is Client and connects out to
+analyzers that are Servers, following their connection settings. Every
+connection is an AnalyzerSession in the computer role, so frames are
+checked and acknowledged by the same LinkLayer the analyzers use.
+
+A ``Faults`` schedule makes the LIS misbehave: NAK frames, answer late or
+hang up mid-message. Host queries (Q records) are answered with the orders
+of a worklist fixture. Frames, messages and receive times are counted in
+the metrics registry under the mock's name, and ``summary()`` sums them up.
+"""
+import asyncio
+import random
+import time
+
+from .astm import ACK, NAK, astm_timestamp
+from .link import LinkMetrics
+from .metrics import REGISTRY
+from .templates import escape
+from .transport import AnalyzerSession, TransportError
+from .worklist import WorklistFile
+
+# Seconds between attempts to reach an analyzer that listens for the LIS
+CONNECT_RETRY = 0.1
+
+
+def load_orders(path, format=None):
+    """Read a worklist fixture into {sample_number: (patient_id, patient_name, tests)}."""
+    with WorklistFile(path, format) as worklist:
+        return {
+            number: (patient_id, patient_name, tests.split(",") if tests else [])
+            for number, patient_id, patient_name, tests in worklist
+        }
+
+
+class Faults:
+    """When the mock LIS misbehaves.
+
+    ``nak_every`` NAKs every Nth good frame of a connection and ``nak_rate``
+    a random fraction of them. ``delay`` holds every ``delay_every``th reply
+    (ACK or NAK) back by that many seconds. ``disconnect_every`` hangs up
+    instead of answering every Nth frame. Random choices come from a
+    generator seeded with ``seed`` per connection, so a schedule plays out
+    the same way every run.
+    """
+
+    def __init__(self, nak_every=0, nak_rate=0.0, delay=0.0, delay_every=1, disconnect_every=0, seed=None):
+        self.nak_every = nak_every
+        self.nak_rate = nak_rate
+        self.delay = delay
+        self.delay_every = max(1, delay_every)
+        self.disconnect_every = disconnect_every
+        self.seed = seed
+
+    def __str__(self):
+        parts = []
+        if self.nak_every:
+            parts.append(f"NAK every {self.nak_every} frames")
+        if self.nak_rate:
+            parts.append(f"NAK {self.nak_rate:.1%} of frames")
+        if self.delay:
+            every = f" every {self.delay_every} replies" if self.delay_every > 1 else ""
+            parts.append(f"{self.delay * 1000:g} ms delay{every}")
+        if self.disconnect_every:
+            parts.append(f"hang up every {self.disconnect_every} frames")
+        return ", ".join(parts) or "no faults"
+
+
+class _Connection:
+    """Transport of one accepted or dialled connection, applying the fault schedule."""
+
+    def __init__(self, lis, reader, writer):
+        self.lis = lis
+        self.faults = lis.faults
+        host, port = writer.get_extra_info("peername")[:2]
+        self.peer = f"{host}:{port}"
+        self._reader = reader
+        self._writer = writer
+        self._random = random.Random(self.faults.seed)
+        self._frames = 0
+        self._replies = 0
+        self._hang_up = False
+
+    def __str__(self):
+        return f"TCP connection with {self.peer}"
+
+    async def open(self):
+        pass
+
+    @property
+    def is_open(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def read(self, size=4096):
+        return await self._reader.read(size)
+
+    async def write(self, data):
+        if self._hang_up:
+            self.lis.disconnects.inc()
+            await self.close()
+            return
+        faults = self.faults
+        if faults.delay and data[-1:] in (ACK, NAK):
+            self._replies += 1
+            if self._replies % faults.delay_every == 0:
+                self.lis.delays.inc()
+                await asyncio.sleep(faults.delay)
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+
+    def reject(self, raw):
+        """LinkLayer.reject hook: NAK or hang up on a good frame when the schedule says so."""
+        self._frames += 1
+        faults = self.faults
+        if faults.disconnect_every and self._frames % faults.disconnect_every == 0:
+            # The reply to this frame is never written; see write()
+            self._hang_up = True
+            return True
+        if (faults.nak_every and self._frames % faults.nak_every == 0) \
+                or (faults.nak_rate and self._random.random() < faults.nak_rate):
+            self.lis.naks.inc()
+            return True
+        return False
+
+
+class MockLIS:
+    """A LIS that acknowledges what analyzers send and answers their host queries.
+
+    ``orders`` maps sample numbers to (patient_id, patient_name, tests), see
+    ``load_orders()``. Counts go to ``metrics`` labelled with ``name``; all
+    connections share them. ``summary()`` only covers what happened since
+    ``start()``, so mocks of the same name, one after the other or side by
+    side, each report their own figures.
+    """
+
+    def __init__(self, orders=None, faults=None, name="mock-lis", metrics=REGISTRY, log=None):
+        self.orders = orders or {}
+        self.faults = faults or Faults()
+        self.name = name
+        self.metrics = metrics
+        self.log = log or (lambda message: None)
+        self.sessions = set()
+        self.link = LinkMetrics(metrics, name)
+        self.connections = metrics.counter(
+            "analyzersim_mocklis_connections_total", "Analyzer connections served", session=name)
+        self.results = metrics.counter(
+            "analyzersim_mocklis_results_total", "R records received", session=name)
+        self.queries = metrics.counter(
+            "analyzersim_mocklis_queries_total", "Host queries answered", session=name)
+        self.naks = metrics.counter(
+            "analyzersim_mocklis_injected_naks_total", "Good frames answered with NAK by the fault schedule",
+            session=name)
+        self.delays = metrics.counter(
+            "analyzersim_mocklis_injected_delays_total", "Replies delayed by the fault schedule", session=name)
+        self.disconnects = metrics.counter(
+            "analyzersim_mocklis_injected_disconnects_total", "Connections dropped by the fault schedule",
+            session=name)
+        self.started = None
+        self.stopped = None
+        self._baseline = None
+        self._servers = []
+        self._tasks = set()
+
+    def _counters(self):
+        return {
+            "connections": self.connections,
+            "messages": self.link.messages_received,
+            "frames": self.link.frames_received,
+            "results": self.results,
+            "queries": self.queries,
+            "naks": self.naks,
+            "delays": self.delays,
+            "disconnects": self.disconnects,
+        }
+
+    def start(self):
+        """Count ``summary()`` from now on; the first serve() or listen() calls it."""
+        self.started = time.monotonic()
+        self.stopped = None
+        self._baseline = (
+            {key: counter.value for key, counter in self._counters().items()},
+            self.link.receive_time.copy(),
+        )
+
+    async def serve(self, settings, port_offset=0):
+        """Listen or connect for the analyzer with ConnectionSettings ``settings``.
+
+        Returns the address listened on or dialled.
+        """
+        if self.started is None:
+            self.start()
+        if not settings.is_tcp:
+            raise TransportError("The mock LIS only serves TCP/IP connections")
+        if settings.is_server:
+            address = settings.analyzer_address, settings.analyzer_port + port_offset
+            task = asyncio.get_running_loop().create_task(self._dial(*address))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return address
+        return await self.listen(settings.lis_address, settings.lis_port + port_offset)
+
+    async def listen(self, host, port):
+        """Accept analyzers on ``host:port``; port 0 picks a free port. Returns the address."""
+        if self.started is None:
+            self.start()
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        self._servers.append(server)
+        address = server.sockets[0].getsockname()[:2]
+        self.log(f"{self.name}: listening on {address[0]}:{address[1]}")
+        return address
+
+    async def _dial(self, host, port):
+        # An analyzer in Server mode accepts one LIS per session, so dial
+        # again whenever the connection ends
+        self.log(f"{self.name}: connecting to {host}:{port}")
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                await asyncio.sleep(CONNECT_RETRY)
+                continue
+            await self._serve_connection(reader, writer)
+            await asyncio.sleep(CONNECT_RETRY)
+
+    async def _serve_connection(self, reader, writer):
+        connection = _Connection(self, reader, writer)
+        session = AnalyzerSession(self.name, connection, role="computer", log=self.log, metrics=self.metrics)
+        session.on_message = lambda records: self._message_received(session, records)
+        await session.open()
+        session.link.reject = connection.reject
+        self.sessions.add(session)
+        self.connections.inc()
+        try:
+            await session.wait_closed()
+        finally:
+            # close() may have got to it first
+            if session in self.sessions:
+                self.sessions.discard(session)
+                await session.close()
+
+    def _message_received(self, session, records):
+        self.results.inc(sum(record.type == "R" for record in records))
+        queried = [record.field(2, 1) or record.field(2, 0) for record in records if record.type == "Q"]
+        if queried:
+            task = asyncio.get_running_loop().create_task(self._send_answer(session, queried))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def answer(self, sample_numbers):
+        """Records of the reply to a host query; L|1|I when no sample is known."""
+        records = [f"H|\\^&|||{escape(self.name)}|||||||P|1|{astm_timestamp()}"]
+        patient = 0
+        for number in sample_numbers:
+            order = self.orders.get(number)
+            if order is None:
+                continue
+            patient_id, patient_name, tests = order
+            patient += 1
+            tests = "\\".join(f"^^^{escape(test)}" for test in tests)
+            records.append(f"P|{patient}||{escape(patient_id)}||{escape(patient_name)}")
+            records.append(f"O|1|{escape(number)}||{tests}|R||||||A||||||||||||||O")
+        records.append("L|1|N" if patient else "L|1|I")
+        return records
+
+    async def _send_answer(self, session, sample_numbers):
+        try:
+            await session.send_message(self.answer(sample_numbers))
+            self.queries.inc()
+        except TransportError as error:
+            self.log(f"{self.name}: query reply not sent: {error}")
+
+    def summary(self):
+        """Totals since ``start()`` and message receive time percentiles in seconds.
+
+        Rates are over the time from ``start()`` to ``close()``, or to now.
+        """
+        if self.started is None:
+            self.start()
+        counts, receive_time = self._baseline
+        summary = {key: counter.value - counts[key] for key, counter in self._counters().items()}
+        receive_time = self.link.receive_time.since(receive_time)
+        elapsed = (self.stopped or time.monotonic()) - self.started
+        summary.update({
+            "elapsed": elapsed,
+            "messages_per_second": summary["messages"] / elapsed if elapsed else 0.0,
+            "results_per_second": summary["results"] / elapsed if elapsed else 0.0,
+            "receive_p50": receive_time.percentile(0.5),
+            "receive_p99": receive_time.percentile(0.99),
+            "receive_max": receive_time.max,
+        })
+        return summary
+
+    async def close(self):
+        if self.started is not None and self.stopped is None:
+            self.stopped = time.monotonic()
+        for server in self._servers:
+            server.close()
+        self._servers = []
+        for task in list(self._tasks):
+            task.cancel()
+        sessions, self.sessions = self.sessions, set()
+        for session in sessions:
+            await session.close()
+
+
+async def serve_analyzers(lis, engine, analyzer_ids):
+    """Have ``lis`` serve every analyzer as its saved connection settings ask.
+
+    Analyzers sharing a LIS address share one listening socket. Serial
+    analyzers are skipped. Returns (analyzer name, what the LIS does) pairs.
+    """
+    listening = {}
+    served = []
+    for analyzer_id in analyzer_ids:
+        name = engine.analyzer_name(analyzer_id)
+        settings = engine.endpoint_settings(analyzer_id)
+        if not settings.is_tcp:
+            served.append((name, "skipped, serial connection"))
+        elif settings.is_server:
+            host, port = await lis.serve(settings)
+            served.append((name, f"connecting to {host}:{port}"))
+        else:
+            address = settings.lis_address, settings.lis_port
+            if address not in listening:
+                listening[address] = await lis.serve(settings)
+            served.append((name, "listening on %s:%s" % listening[address]))
+    return served
@@ -0,0 +1,237 @@
+"""Durable queue of results waiting to be sent to the LIS.
+
+Every queued result has one row in the ``outbox`` table that moves through
+
+    pending -> in_flight -> acked
+                         -> pending again after a failed attempt
+                         -> failed once MAX_ATTEMPTS attempts have failed
+
+Senders claim pending rows in batches, send them, and ack or fail the whole
+batch; a batch that never reached the LIS because the connection was down
+is released without using up an attempt. Rows still in flight when the
+simulator stopped are put back to pending by ``recover()``, so they are
+sent again rather than lost: delivery is at least once, and ``attempts``
+shows which results may have reached the LIS twice.
+"""
+import time
+from collections import namedtuple
+
+from .database import MAX_VARIABLES, chunked
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+ACKED = "acked"
+FAILED = "failed"
+STATES = (PENDING, IN_FLIGHT, ACKED, FAILED)
+
+# Attempts per result before it is left failed
+MAX_ATTEMPTS = 3
+# Seconds before a failed attempt is retried
+RETRY_DELAY = 5.0
+
+# One claimed row; ``queued_at`` is a time.time() timestamp
+QueuedResult = namedtuple("QueuedResult", "id result_id sample_id queued_at attempts")
+
+
+class Outbox:
+    """Queue operations on the ``outbox`` table of ``db``.
+
+    Timestamps are time.time() seconds so that they survive a restart.
+    """
+
+    def __init__(self, db, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, clock=time.time):
+        self.db = db
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.clock = clock
+
+    def enqueue_samples(self, analyzer_id, sample_numbers, delay=0.0):
+        """Queue the unsent results of ``sample_numbers``, due ``delay`` seconds from now.
+
+        Results queued before are queued again from scratch. Returns the
+        number of rows queued.
+        """
+        now = self.clock()
+        count = 0
+        with self.db.transaction() as cursor:
+            for chunk in chunked(sample_numbers, MAX_VARIABLES - 3):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"""
+                    INSERT INTO outbox (result_id, analyzer_id, queued_at, not_before)
+                    SELECT r.id, t.analyzer_id, ?, ?
+                    FROM samples s
+                    JOIN results r ON r.sample_id = s.id
+                    JOIN tests t ON r.test_id = t.id
+                    WHERE s.sample_number IN ({placeholders}) AND t.analyzer_id = ? AND r.sent = 0
+                    ORDER BY r.sample_id, r.id
+                    ON CONFLICT (result_id) DO UPDATE SET
+                        state = 'pending',
+                        attempts = 0,
+                        queued_at = excluded.queued_at,
+                        not_before = excluded.not_before,
+                        claimed_at = NULL,
+                        acked_at = NULL,
+                        last_error = NULL
+                """, (now, now + delay, *chunk, analyzer_id))
+                count += cursor.rowcount
+        return count
+
+    def enqueue_results(self, analyzer_id, result_ids, delay=0.0):
+        """Queue ``result_ids``, sent or not, due ``delay`` seconds from now; return how many."""
+        now = self.clock()
+        count = 0
+        with self.db.transaction() as cursor:
+            for chunk in chunked(result_ids, MAX_VARIABLES - 3):
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"""
+                    INSERT INTO outbox (result_id, analyzer_id, queued_at, not_before)
+                    SELECT r.id, t.analyzer_id, ?, ?
+                    FROM results r
+                    JOIN tests t ON r.test_id = t.id
+                    WHERE r.id IN ({placeholders}) AND t.analyzer_id = ?
+                    ORDER BY r.sample_id, r.id
+                    ON CONFLICT (result_id) DO UPDATE SET
+                        state = 'pending',
+                        attempts = 0,
+                        queued_at = excluded.queued_at,
+                        not_before = excluded.not_before,
+                        claimed_at = NULL,
+                        acked_at = NULL,
+                        last_error = NULL
+                """, (now, now + delay, *chunk, analyzer_id))
+                count += cursor.rowcount
+        return count
+
+    def claim(self, analyzer_id, limit, result_ids=None):
+        """Move up to ``limit`` due rows of the analyzer to in flight; return them in queue order.
+
+        ``result_ids`` restricts the claim to the rows of those results.
+        """
+        now = self.clock()
+        with self.db.transaction() as cursor:
+            # Take the write lock first so that two senders never claim the same rows
+            cursor.execute("BEGIN IMMEDIATE")
+            rows = []
+            for chunk in (chunked(result_ids, MAX_VARIABLES - 3) if result_ids is not None else [None]):
+                where = f" AND o.result_id IN ({', '.join('?' * len(chunk))})" if chunk else ""
+                rows.extend(cursor.execute(f"""
+                    SELECT o.id, o.result_id, r.sample_id, o.queued_at, o.attempts
+                    FROM outbox o
+                    LEFT JOIN results r ON r.id = o.result_id
+                    WHERE o.analyzer_id = ? AND o.state = 'pending' AND o.not_before <= ?{where}
+                    ORDER BY o.id
+                    LIMIT ?
+                """, (analyzer_id, now, *(chunk or ()), limit - len(rows))).fetchall())
+                if len(rows) >= limit:
+                    break
+            claimed = [QueuedResult(*row[:4], row[4] + 1) for row in rows if row[2] is not None]
+            # Results deleted since they were queued can never be sent
+            cursor.executemany(
+                "UPDATE outbox SET state = 'failed', last_error = 'result deleted' WHERE id = ?",
+                ((row[0],) for row in rows if row[2] is None),
+            )
+            cursor.executemany(
+                "UPDATE outbox SET state = 'in_flight', attempts = attempts + 1, claimed_at = ? WHERE id = ?",
+                ((now, row.id) for row in claimed),
+            )
+        return claimed
+
+    def ack(self, claimed):
+        """Mark claimed rows acked and their results sent."""
+        now = self.clock()
+        with self.db.transaction() as cursor:
+            for chunk in chunked([row.id for row in claimed], MAX_VARIABLES - 1):
+                placeholders = ", ".join("?" * len(chunk))
+                # Rows queued again while in flight stay pending for the newer value
+                cursor.execute(f"""
+                    UPDATE results SET sent = 1 WHERE id IN (
+                        SELECT result_id FROM outbox WHERE id IN ({placeholders}) AND state = 'in_flight'
+                    )
+                """, chunk)
+                cursor.execute(f"""
+                    UPDATE outbox SET state = 'acked', acked_at = ?
+                    WHERE id IN ({placeholders}) AND state = 'in_flight'
+                """, (now, *chunk))
+
+    def fail(self, claimed, error):
+        """Return claimed rows for a retry, or leave them failed after ``max_attempts``."""
+        now = self.clock()
+        with self.db.transaction() as cursor:
+            cursor.executemany("""
+                UPDATE outbox SET
+                    state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    not_before = ?,
+                    last_error = ?
+                WHERE id = ? AND state = 'in_flight'
+            """, ((self.max_attempts, now + self.retry_delay, error, row.id) for row in claimed))
+
+    def release(self, claimed):
+        """Return claimed rows to pending without counting the attempt, for batches never sent."""
+        with self.db.transaction() as cursor:
+            cursor.executemany("""
+                UPDATE outbox SET state = 'pending', attempts = MAX(attempts - 1, 0)
+                WHERE id = ? AND state = 'in_flight'
+            """, ((row.id,) for row in claimed))
+
+    def recover(self, analyzer_id=None):
+        """Put rows left in flight by a stopped sender back to pending; return how many."""
+        where, params = _analyzer_filter(analyzer_id)
+        with self.db.transaction() as cursor:
+            cursor.execute(f"UPDATE outbox SET state = 'pending' WHERE state = 'in_flight'{where}", params)
+            return cursor.rowcount
+
+    def retry_failed(self, analyzer_id=None):
+        """Queue failed rows again with fresh attempts; return how many."""
+        where, params = _analyzer_filter(analyzer_id)
+        with self.db.transaction() as cursor:
+            cursor.execute(f"""
+                UPDATE outbox SET state = 'pending', attempts = 0, not_before = ?
+                WHERE state = 'failed'{where}
+            """, (self.clock(), *params))
+            return cursor.rowcount
+
+    def prune(self, older_than):
+        """Delete rows acked more than ``older_than`` seconds ago; return how many."""
+        with self.db.transaction() as cursor:
+            cursor.execute("DELETE FROM outbox WHERE state = 'acked' AND acked_at < ?",
+                           (self.clock() - older_than,))
+            return cursor.rowcount
+
+    def next_due(self, analyzer_id):
+        """Time the next pending row of the analyzer comes due, or None when there is none."""
+        row = self.db.fetchone(
+            "SELECT MIN(not_before) FROM outbox WHERE analyzer_id = ? AND state = 'pending'",
+            (analyzer_id,),
+        )
+        return row[0]
+
+    def depth(self, analyzer_id=None):
+        """Row count per state."""
+        where, params = _analyzer_filter(analyzer_id, "WHERE")
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.db.fetchall(f"SELECT state, COUNT(*) FROM outbox{where} GROUP BY state", params))
+        return counts
+
+    def unfinished(self):
+        """Row count per (analyzer_id, state) of the rows not acked yet."""
+        rows = self.db.fetchall(f"""
+            SELECT analyzer_id, state, COUNT(*) FROM outbox
+            WHERE state IN ('{PENDING}', '{IN_FLIGHT}', '{FAILED}')
+            GROUP BY analyzer_id, state
+        """)
+        return {(analyzer_id, state): count for analyzer_id, state, count in rows}
+
+    def drain_rate(self, window=60.0, analyzer_id=None):
+        """Results acked per second over the last ``window`` seconds."""
+        where, params = _analyzer_filter(analyzer_id)
+        row = self.db.fetchone(
+            f"SELECT COUNT(*) FROM outbox WHERE state = 'acked' AND acked_at >= ?{where}",
+            (self.clock() - window, *params),
+        )
+        return row[0] / window
+
+
+def _analyzer_filter(analyzer_id, keyword="AND"):
+    if analyzer_id is None:
+        return "", ()
+    return f" {keyword} analyzer_id = ?", (analyzer_id,)
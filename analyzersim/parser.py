@@ -0,0 +1,139 @@
+"""Incremental parser for ASTM data received from the LIS.
+
+``StreamParser`` takes raw link-layer bytes in chunks of any size and yields
+``Record`` objects as soon as their last frame is complete. Frames are
+located and checksummed in place through a memoryview over one growing
+bytearray; only the text of a valid frame is copied out. Records split
+over ETB frames are joined by a ``RecordAssembler``, which the link layer
+uses as well.
+"""
+from collections import namedtuple
+
+from .astm import CR, ENCODING, ETB, ETX, LF, STX, checksum
+
+_UNESCAPES = (("&F&", "|"), ("&S&", "^"), ("&R&", "\\"), ("&E&", "&"))
+
+
+def unescape(value):
+    """Undo ``templates.escape`` (E1394 section 7.1.4)."""
+    if "&" not in value:
+        return value
+    for escaped, delimiter in _UNESCAPES:
+        value = value.replace(escaped, delimiter)
+    return value
+
+
+class Record(namedtuple("Record", "type fields")):
+    """One E1394 record; ``fields`` are the raw "|"-separated fields."""
+
+    __slots__ = ()
+
+    def field(self, index, component=None):
+        """Unescaped field ``index``, or one "^" component of it; "" if absent."""
+        if index >= len(self.fields):
+            return ""
+        value = self.fields[index]
+        if component is not None:
+            components = value.split("^")
+            value = components[component] if component < len(components) else ""
+        return unescape(value)
+
+    def repeats(self, index, component=None):
+        """Unescaped values of a "\\"-repeated field (or of one component of each)."""
+        if index >= len(self.fields) or not self.fields[index]:
+            return []
+        values = []
+        for value in self.fields[index].split("\\"):
+            if component is not None:
+                components = value.split("^")
+                value = components[component] if component < len(components) else ""
+            values.append(unescape(value))
+        return values
+
+
+def parse_record(data):
+    """Parse record bytes (with or without the trailing CR) into a Record."""
+    text = bytes(data).decode(ENCODING)
+    if text.endswith("\r"):
+        text = text[:-1]
+    fields = tuple(text.split("|"))
+    return Record(fields[0][:1].upper(), fields)
+
+
+class RecordAssembler:
+    """Joins the text of consecutive frames into whole records."""
+
+    def __init__(self):
+        self._partial = bytearray()
+
+    def add(self, text, final):
+        """Add one frame's text; return the complete record bytes or None."""
+        if not final:
+            self._partial += text
+            return None
+        if self._partial:
+            self._partial += text
+            record = bytes(self._partial)
+            self._partial.clear()
+            return record
+        return bytes(text)
+
+    def reset(self):
+        self._partial.clear()
+
+
+class StreamParser:
+    """Turns received bytes into records, whatever the chunk boundaries.
+
+    Control characters between frames are skipped. Frames with a bad
+    checksum or terminator are counted in ``bad_frames`` and dropped; the
+    sender retransmits those after the receiver's NAK.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._assembler = RecordAssembler()
+        self.frames = 0
+        self.bad_frames = 0
+
+    def feed(self, data):
+        """Add received bytes; return a generator of the records they complete.
+
+        Exhaust the generator before feeding more data.
+        """
+        self._buffer += data
+        return self._records()
+
+    def _records(self):
+        buffer = self._buffer
+        view = memoryview(buffer)
+        position = 0
+        try:
+            while True:
+                start = buffer.find(STX, position)
+                if start < 0:
+                    position = len(buffer)
+                    break
+                end = buffer.find(LF, start)
+                if end < 0:
+                    position = start
+                    break
+                position = end + 1
+                with view[start:position] as frame:
+                    # STX FN text ETX/ETB C1 C2 CR LF
+                    if len(frame) < 7 or frame[-2] != CR[0] or frame[-5] not in (ETX[0], ETB[0]) \
+                            or checksum(frame[1:-4]) != bytes(frame[-4:-2]).upper():
+                        self.bad_frames += 1
+                        continue
+                    self.frames += 1
+                    record = self._assembler.add(frame[2:-5], frame[-5] == ETX[0])
+                if record is not None:
+                    yield parse_record(record)
+        finally:
+            view.release()
+            del buffer[:position]
+
+
+def parse_records(records):
+    """Parse reassembled record bytes, e.g. ``MessageReceived.records``."""
+    return [parse_record(record) for record in records]
@@ -0,0 +1,165 @@
+"""Automatic result sending.
+
+``ResultPipeline`` is fed sample numbers as their results are generated and
+queues their results in the outbox, due after the analyzer's result sending
+delay. Its ``run()`` task claims due results in batches and sends them in as
+few ASTM sessions as possible: one message carries many samples whenever the
+result template has a P or O record to separate them. Results are acked in
+the outbox, and marked sent, once the LIS has acknowledged the message;
+failed messages are retried by the outbox. When the connection drops the
+pipeline opens the session again, backing off between tries, and results
+that could not be sent meanwhile go back to the outbox without using up an
+attempt.
+"""
+import time
+
+from .outbox import ACKED, FAILED
+
+# Results per message; larger batches are split over several messages
+MESSAGE_RESULTS = 500
+
+# Seconds before the first attempt to reopen a lost session, doubled after
+# every failed attempt up to the maximum
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30.0
+
+
+class PipelineStats:
+    """Counters kept by a ResultPipeline."""
+
+    def __init__(self):
+        self.messages = 0
+        self.results = 0
+        self.failures = 0
+        self.backlog = 0
+        # Results found in flight at startup and sent again
+        self.recovered = 0
+        # Times the session was opened again after losing its connection
+        self.reconnects = 0
+        # Seconds from queueing a sample to the LIS acknowledging its message
+        self.latencies = []
+
+
+class ResultPipeline:
+    """Sends the results of submitted samples over ``session`` after ``delay`` seconds.
+
+    ``run()`` is the sending task; ``submit()`` never waits. ``on_sent(result_ids,
+    error)`` is called after every message, with an error text on failure.
+    Only one pipeline should run per analyzer, as ``run()`` takes over the
+    results any earlier one left in flight.
+    """
+
+    def __init__(self, engine, analyzer_id, session, delay=0.0, message_results=MESSAGE_RESULTS,
+                 on_sent=None, stats=None, template_text=None, log=None):
+        # Not imported at module level: the engine imports this module, and
+        # loading asyncio would double its import time
+        import asyncio
+
+        self.engine = engine
+        self.outbox = engine.outbox
+        self.analyzer_id = analyzer_id
+        self.session = session
+        self.delay = delay
+        self.message_results = message_results
+        self.on_sent = on_sent
+        self.stats = stats or PipelineStats()
+        self.log = log or (lambda message: None)
+        self.template = engine.template(analyzer_id, "result_send", template_text)
+        self._wakeup = asyncio.Event()
+        self._closing = False
+
+    @property
+    def batches_samples(self):
+        # Without P or O records the LIS could not tell the samples apart
+        return self.template.patient is not None or self.template.order is not None
+
+    def submit(self, sample_numbers):
+        """Queue the unsent results of samples whose results were just stored."""
+        self.stats.backlog += self.outbox.enqueue_samples(self.analyzer_id, sample_numbers, self.delay)
+        self._wakeup.set()
+
+    def close(self):
+        """Let ``run()`` return once nothing queued is pending any more."""
+        self._closing = True
+        self._wakeup.set()
+
+    async def run(self):
+        import asyncio
+
+        outbox = self.outbox
+        recovered = outbox.recover(self.analyzer_id)
+        if recovered:
+            self.stats.recovered += recovered
+            self.log(f"{self.session.name}: sending {recovered} results again that were in flight when sending stopped")
+        depth = outbox.depth(self.analyzer_id)
+        self.stats.backlog = sum(count for state, count in depth.items() if state not in (ACKED, FAILED))
+        while True:
+            if not self.session.connected and outbox.next_due(self.analyzer_id) is not None:
+                await self._reconnect()
+            claimed = outbox.claim(self.analyzer_id, self.message_results)
+            if claimed:
+                await self._send(claimed)
+                continue
+            due = outbox.next_due(self.analyzer_id)
+            if due is None and self._closing:
+                return
+            self._wakeup.clear()
+            timeout = None if due is None else max(0.0, due - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _reconnect(self):
+        import asyncio
+
+        self.log(f"{self.session.name}: connection lost, reconnecting")
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                await self.session.close()
+                await self.session.open()
+            except Exception as error:
+                error = str(error) or type(error).__name__
+                self.log(f"{self.session.name}: reconnecting failed ({error}), next try in {delay:g} s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            self.stats.reconnects += 1
+            return
+
+    async def _send(self, claimed):
+        if self.batches_samples:
+            messages = [claimed]
+        else:
+            by_sample = {}
+            for row in claimed:
+                by_sample.setdefault(row.sample_id, []).append(row)
+            messages = list(by_sample.values())
+        stats = self.stats
+        for index, rows in enumerate(messages):
+            try:
+                await self.engine.send_results(self.session, self.analyzer_id, [row.result_id for row in rows],
+                                               template=self.template, mark_sent=False)
+            except Exception as error:
+                error = str(error) or type(error).__name__
+                if not self.session.connected:
+                    # Not the LIS refusing the results: send them again once reconnected
+                    self.outbox.release([row for rows in messages[index:] for row in rows])
+                    return
+                self.outbox.fail(rows, error)
+                stats.failures += 1
+                if self.on_sent is not None:
+                    self.on_sent([], error)
+                continue
+            self.outbox.ack(rows)
+            acknowledged = time.time()
+            queued = {}
+            for row in rows:
+                queued[row.sample_id] = min(row.queued_at, queued.get(row.sample_id, row.queued_at))
+            stats.latencies.extend(acknowledged - queued_at for queued_at in queued.values())
+            stats.messages += 1
+            stats.results += len(rows)
+            stats.backlog = max(0, stats.backlog - len(rows))
+            if self.on_sent is not None:
+                self.on_sent([row.result_id for row in rows], "")
@@ -0,0 +1,167 @@
+"""Replay recorded analyzer sessions against a LIS.
+
+``TraceReplayer`` opens one connection for every session of a trace (see
+``trace``), to the endpoint in the saved connection settings of the
+analyzer the session belonged to, and writes the recorded bytes again at
+their recorded times divided by ``speed``, or as fast as possible. Before
+each write it waits until the LIS has sent as many bytes as it had at that
+point of the recording, so replies keep their place in the conversation
+however far the timing is compressed. Every session reports whether the
+LIS answered with exactly the bytes recorded.
+"""
+import asyncio
+import hashlib
+import time
+
+from .link import REPLY_TIMEOUT
+from .trace import CLOSE, RECEIVED, SENT
+from .transport import open_transport
+
+
+class SessionReplay:
+    """Progress of one replayed session."""
+
+    def __init__(self, session, analyzer_id):
+        self.number = session.number
+        self.name = session.name
+        self.analyzer_id = analyzer_id
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Bytes the LIS had sent at the point of the recording reached so far
+        self.expected = 0
+        # Writes that went ahead after waiting REPLY_TIMEOUT for the LIS
+        self.late = 0
+        self.error = ""
+        self._recorded = hashlib.blake2b()
+        self._live = hashlib.blake2b()
+        self._progress = asyncio.Event()
+
+    @property
+    def identical(self):
+        """Whether the LIS sent exactly the bytes it sent when the trace was recorded."""
+        return self.bytes_received == self.expected and self._live.digest() == self._recorded.digest()
+
+
+class TraceReplayer:
+    """Drives the sessions of a TraceReader against the LIS.
+
+    ``speed`` divides the recorded times (None for as fast as possible).
+    Sessions are matched to analyzers by name, a " #N" instance suffix
+    ignored, unless ``analyzer_id`` puts them all on one analyzer.
+    """
+
+    def __init__(self, engine, reader, speed=1.0, analyzer_id=None, log=None):
+        self.engine = engine
+        self.reader = reader
+        self.speed = speed
+        self.analyzer_id = analyzer_id
+        self.log = log or (lambda message: None)
+        self.sessions = {}
+        self.elapsed = 0.0
+
+    def analyzer_for(self, name):
+        if self.analyzer_id is not None:
+            return self.analyzer_id
+        analyzers = {analyzer_name: analyzer_id for analyzer_id, analyzer_name in self.engine.analyzers()}
+        return analyzers.get(name, analyzers.get(name.rsplit(" #", 1)[0]))
+
+    async def run(self):
+        """Replay every session at once; return ``summary()``."""
+        index = self.reader.index()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        started = time.perf_counter()
+        tasks = []
+        for number, session in self.reader.sessions.items():
+            stats = self.sessions[number] = SessionReplay(session, self.analyzer_for(session.name))
+            tasks.append(self._replay(stats, session, index[number], start))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.elapsed = time.perf_counter() - started
+        return self.summary()
+
+    async def _wait_until(self, start, moment):
+        if self.speed is None:
+            return
+        delay = start + moment / self.speed - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _wait_for_lis(self, stats):
+        """Wait until the LIS caught up with the recording; False after REPLY_TIMEOUT."""
+        deadline = asyncio.get_running_loop().time() + REPLY_TIMEOUT
+        while stats.bytes_received < stats.expected:
+            stats._progress.clear()
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(stats._progress.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _read(self, stats, transport):
+        try:
+            while True:
+                data = await transport.read()
+                if not data:
+                    break
+                stats.bytes_received += len(data)
+                stats._live.update(data)
+                stats._progress.set()
+        except OSError:
+            pass
+        stats._progress.set()
+
+    async def _replay(self, stats, session, offsets, start):
+        if stats.analyzer_id is None:
+            stats.error = f"no analyzer named {session.name}"
+            self.log(f"{session.name}: skipped, {stats.error}")
+            return
+        settings = self.engine.endpoint_settings(stats.analyzer_id)
+        transport = open_transport(settings, session.port_offset)
+        # The first event is the session's OPEN
+        await self._wait_until(start, session.opened)
+        reader = None
+        try:
+            self.log(f"{session.name}: {transport}")
+            await transport.open()
+            reader = asyncio.get_running_loop().create_task(self._read(stats, transport))
+            for offset in offsets[1:]:
+                event = self.reader.event_at(offset)
+                if event.kind == RECEIVED:
+                    stats.expected += len(event.data)
+                    stats._recorded.update(event.data)
+                elif event.kind == SENT:
+                    await self._wait_until(start, event.time)
+                    if not await self._wait_for_lis(stats):
+                        stats.late += 1
+                    await transport.write(event.data)
+                    stats.bytes_sent += len(event.data)
+                elif event.kind == CLOSE:
+                    break
+            # Let the LIS send the replies to what was written last
+            await self._wait_for_lis(stats)
+        except Exception as error:
+            stats.error = str(error) or type(error).__name__
+            self.log(f"{session.name}: {stats.error}")
+        finally:
+            if reader is not None:
+                reader.cancel()
+            await transport.close()
+
+    def summary(self):
+        """Totals over all sessions; ``identical`` counts sessions the LIS answered byte for byte."""
+        sessions = self.sessions.values()
+        return {
+            "sessions": len(self.sessions),
+            "elapsed": self.elapsed,
+            "recorded": self.reader.duration,
+            "bytes_sent": sum(stats.bytes_sent for stats in sessions),
+            "bytes_received": sum(stats.bytes_received for stats in sessions),
+            "identical": sum(stats.identical for stats in sessions if not stats.error),
+            "late": sum(stats.late for stats in sessions),
+            "errors": {stats.name: stats.error for stats in sessions if stats.error},
+        }
@@ -0,0 +1,113 @@
+"""Discrete-event model of an analyzer's throughput.
+
+Every test occupies one of the analyzer's parallel channels (cuvettes,
+modules) for its cycle time. Tests are loaded in sample order onto the
+channel that frees up first, no faster than the tests-per-hour rating
+allows, and a sample is complete when its last test finishes. The
+schedule is computed up front in simulated seconds; ``Timeline`` then plays
+it back against the wall clock at any speed, or as fast as possible.
+"""
+import heapq
+import time
+from collections import namedtuple
+
+DEFAULT_CYCLE_TIME = 60.0
+DEFAULT_CHANNELS = 1
+
+# ``finish`` is in simulated seconds from the start of the run
+Completion = namedtuple("Completion", "finish sample_number")
+
+
+class ThroughputModel:
+    """Timing of one analyzer.
+
+    ``cycle_times`` maps test ids to seconds. ``tests_per_hour`` caps the
+    rate at which tests are started; None leaves only the channels as limit.
+    """
+
+    def __init__(self, cycle_times, channels=DEFAULT_CHANNELS, tests_per_hour=None):
+        if channels < 1:
+            raise ValueError(f"Invalid channel count: {channels!r}")
+        self.cycle_times = cycle_times
+        self.channels = channels
+        self.tests_per_hour = tests_per_hour or None
+        self.interval = 3600.0 / self.tests_per_hour if self.tests_per_hour else 0.0
+
+    @property
+    def capacity(self):
+        """Sustained tests per hour with an even mix of the panel's tests."""
+        if not self.cycle_times:
+            return 0.0
+        mean_cycle = sum(self.cycle_times.values()) / len(self.cycle_times)
+        rate = self.channels * 3600.0 / mean_cycle if mean_cycle > 0 else float("inf")
+        return min(rate, self.tests_per_hour or rate)
+
+    def schedule(self, samples):
+        """Completion of every sample, in order of completion.
+
+        ``samples`` holds (sample_number, test_ids) pairs in loading order.
+        """
+        free = [0.0] * self.channels
+        next_start = 0.0
+        completions = []
+        for sample_number, test_ids in samples:
+            finish = next_start
+            for test_id in test_ids:
+                start = max(free[0], next_start)
+                end = start + self.cycle_times.get(test_id, DEFAULT_CYCLE_TIME)
+                heapq.heapreplace(free, end)
+                next_start = start + self.interval
+                finish = max(finish, end)
+            completions.append(Completion(finish, sample_number))
+        completions.sort()
+        return completions
+
+
+class Timeline:
+    """Plays completions back in time order.
+
+    ``speed`` is simulated seconds per wall-clock second; None means as fast
+    as possible. Completions due at the same moment come out together.
+    """
+
+    def __init__(self, completions, speed=1.0, batch_size=5000, clock=time.monotonic):
+        if speed is not None and speed <= 0:
+            raise ValueError(f"Invalid speed: {speed!r}")
+        self.completions = completions
+        self.speed = speed
+        self.batch_size = batch_size
+        self.clock = clock
+
+    def batches(self):
+        """Yield (due, [sample_number, ...]); ``due`` is the simulated time."""
+        completions = self.completions
+        index = 0
+        while index < len(completions):
+            due = completions[index].finish
+            end = index + 1
+            if self.speed is None:
+                end = min(index + self.batch_size, len(completions))
+                due = completions[end - 1].finish
+            else:
+                while end < len(completions) and completions[end].finish <= due \
+                        and end - index < self.batch_size:
+                    end += 1
+            yield due, [completion.sample_number for completion in completions[index:end]]
+            index = end
+
+    async def play(self):
+        """Async iterator over ``batches()``, each released at its due time."""
+        # asyncio is only loaded by code that runs on an event loop, so that
+        # importing the engine stays fast
+        import asyncio
+
+        started = self.clock()
+        for due, sample_numbers in self.batches():
+            if self.speed is not None:
+                delay = started + due / self.speed - self.clock()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                # Let other sessions on the loop run between batches
+                await asyncio.sleep(0)
+            yield due, sample_numbers
@@ -0,0 +1,246 @@
+"""Compiler for the Send/Read ASTM template scripts edited in the LIS tab.
+
+A script is a list of lines such as ``Send: <ENQ>``, ``Read: <ACK>`` or
+``Send: <STX>1H|\\^&|||...<CR><ETX>A1``. Compiling it once yields the
+ordered steps plus one precompiled format string per record type, so
+rendering a message is only string formatting. Frame numbers and
+checksums written in the script are ignored; the encoder recomputes them.
+"""
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+from .astm import ACK, ENQ, EOT, NAK, abnormal_flag, astm_timestamp
+
+DEFAULT_TEMPLATES = {
+    "sample_info": (
+        "Send: <ENQ>\nRead: <ACK>\n\n"
+        "Send: <STX>1H|\\^&|||1^Analyzer_1^|||||||||P||20101118101825<CR><ETX>A1\nRead: <ACK>\n\n"
+        "Send: <STX>2Q|1|^SampleID_03^^||^^^ALL^||||||O<CR><ETX>FF\n\nRead: <ACK>\n\n"
+        "Send: <STX>3L|1|N<CR><ETX>06\n\nRead: <ACK>\n\n"
+        "Send: < EOT >"
+    ),
+    "result_send": (
+        "send: <ENQ>\nread: <ACK>\n"
+        "send: <STX>1H|\\^&|||1 Analyzer 1^7.0|||||||||P||20190801124640<CR><ETX>E4\nread: <ACK>\n\n"
+        "send: <STX>2P|1|PatientID_07|||Patient Name_7|||U|||||||||||||||||||<CR><ETX>67\nread: <ACK>\n\n"
+        "send: <STX>3O|1|SampleID_07^0.0^5^1|||^^^Test_1^0.0|R||||||X|||3|||||||1|F<CR><ETX>2C\nread: <ACK>\n\n"
+        "send: <STX>4R|1|^^^Test_1^0.0|2.4|mmol/l||N||F||<root user>||20190801124608|Analyzer 1<CR><ETX>3F\n"
+        "read: <ACK>\n\n"
+        "send: <STX>5O|2|SampleID_07^0.0^5^1|||^^^Photo_reflex_test^0.0|R||||||X|||3|||||||1|F<CR><ETX>0D\n"
+        "read: <ACK>\n\n"
+        "send: <STX>6R|1|^^^Photo_reflex_test^0.0|3.205|mmol/l||N||F||<root user>||20190801124606|Analyzer 1"
+        "<CR><ETX>81\nread: <ACK>\n\n"
+        "send: <STX>7O|3|SampleID_07^0.0^5^1|||^^^Photometric_test^0.0|R||||||X|||3|||||||1|F<CR><ETX>AF\n"
+        "read: <ACK>\n\n"
+        "send: <STX>0R|1|^^^Photometric_test^0.0|0.06|mmol/l||N||F||<root user>||20190801124607|Analyzer 1"
+        "<CR><ETX>E7\nread: <ACK>\n\n"
+        "send: <STX>1L|1|N<CR><ETX>04\nread: <ACK>\n\n"
+        "send: <EOT>"
+    ),
+}
+
+CONTROLS = {"ENQ": ENQ, "ACK": ACK, "NAK": NAK, "EOT": EOT}
+RECORD_TYPES = "HPOQRLCM"
+
+_LINE = re.compile(r"^\s*(send|read)\b\s*:?\s*(.*?)\s*$", re.IGNORECASE)
+_CONTROL = re.compile(r"^<\s*([A-Za-z]{3})\s*>$")
+_FRAMED = re.compile(
+    r"^(?:<STX>)?[0-7]?(?P<text>.*?)(?:<CR>)?"
+    r"(?:<(?:ETX|EXT|ETB)>(?:[0-9A-Fa-f]{2})?)?(?:<CR>)?(?:<LF>)?$",
+    re.IGNORECASE,
+)
+_TIMESTAMP = re.compile(r"^\d{14}$")
+_SPECIAL = re.compile(r"[|\\^&\r\n]")
+_ESCAPES = str.maketrans({"&": "&E&", "|": "&F&", "\\": "&R&", "^": "&S&", "\r": " ", "\n": " "})
+
+# send/read, "control" or "record", control bytes or RecordTemplate
+Step = namedtuple("Step", "direction kind value")
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def escape(value):
+    """Escape delimiters inside a field value (E1394 section 7.1.4)."""
+    value = str(value)
+    return value.translate(_ESCAPES) if _SPECIAL.search(value) else value
+
+
+class RecordTemplate:
+    """One record of a script, precompiled into a format string.
+
+    Fields that carry data (sequence number, sample, patient, test, result,
+    timestamps) become named slots; every other field is kept verbatim.
+    """
+
+    def __init__(self, text):
+        fields = text.split("|")
+        self.record_type = fields[0][:1].upper()
+        if self.record_type not in RECORD_TYPES:
+            raise TemplateError(f"Unknown ASTM record type in template: {text!r}")
+        fields[0] = self.record_type
+        self.text = text
+
+        slots = {}
+        if self.record_type != "H":
+            slots[1] = "{seq}"
+        if self.record_type == "P":
+            slots[2] = "{patient_id}"
+            slots[5] = "{patient_name}"
+        elif self.record_type == "O":
+            slots[2] = ("{sample}", 0)
+            slots[self._test_field(fields, 4)] = ("{test}", 3)
+        elif self.record_type == "R":
+            slots[self._test_field(fields, 2)] = ("{test}", 3)
+            slots.update({3: "{value}", 4: "{unit}", 5: "{range}", 6: "{flag}"})
+        elif self.record_type == "Q":
+            slots[2] = ("{sample}", 1)
+        for index, field in enumerate(fields):
+            if _TIMESTAMP.match(field):
+                slots[index] = "{timestamp}"
+
+        if slots:
+            fields.extend([""] * (max(slots) + 1 - len(fields)))
+        fields = [field.replace("{", "{{").replace("}", "}}") for field in fields]
+        for index, slot in slots.items():
+            if isinstance(slot, tuple):
+                slot, position = slot
+                components = fields[index].split("^")
+                components.extend([""] * (position + 1 - len(components)))
+                components[position] = slot
+                fields[index] = "^".join(components)
+            else:
+                fields[index] = slot
+        self.format = "|".join(fields)
+
+    @staticmethod
+    def _test_field(fields, default):
+        # The universal test ID is the field that starts with "^^^"
+        for index, field in enumerate(fields[1:], start=1):
+            if field.startswith("^^^"):
+                return index
+        return default
+
+    def render(self, values):
+        return self.format.format_map(values)
+
+
+STANDARD_HEADER = RecordTemplate("H|\\^&|||Analyzer|||||||P|1|00000000000000")
+STANDARD_TERMINATOR = RecordTemplate("L|1|N")
+
+
+def _parse_record(content):
+    match = _FRAMED.match(content)
+    text = match.group("text") if match else content
+    # Lines written by the "Add Field" helper look like "H |\^&|||..."
+    short = re.match(r"^([A-Za-z]) +(.*)$", text)
+    if short:
+        rest = short.group(2)
+        text = short.group(1) + ("" if rest.startswith("|") else "|") + rest
+    return RecordTemplate(text)
+
+
+class CompiledTemplate:
+    """Executable form of a template script."""
+
+    def __init__(self, text):
+        steps = []
+        records = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            match = _LINE.match(line)
+            if not match:
+                raise TemplateError(f"Line {number}: expected 'Send:' or 'Read:', got {line.strip()!r}")
+            direction = match.group(1).lower()
+            content = match.group(2)
+            if not content:
+                if direction == "read":
+                    steps.append(Step("read", "control", ACK))
+                continue
+            control = _CONTROL.match(content)
+            if control:
+                name = control.group(1).upper()
+                if name not in CONTROLS:
+                    raise TemplateError(f"Line {number}: unsupported control character <{name}>")
+                steps.append(Step(direction, "control", CONTROLS[name]))
+            elif direction == "send":
+                record = _parse_record(content)
+                steps.append(Step("send", "record", record))
+                records.append(record)
+            else:
+                raise TemplateError(f"Line {number}: only control characters can be read")
+        self.steps = tuple(steps)
+        self.records = tuple(records)
+
+        first = {}
+        counts = {}
+        for record in records:
+            first.setdefault(record.record_type, record)
+            counts[record.record_type] = counts.get(record.record_type, 0) + 1
+        self.header = first.get("H", STANDARD_HEADER)
+        self.patient = first.get("P")
+        self.order = first.get("O")
+        self.result = first.get("R")
+        self.query = first.get("Q")
+        self.terminator = first.get("L", STANDARD_TERMINATOR)
+        # O, R, O, R ... sends one order per result; O, R, R ... one per sample
+        self.order_per_result = counts.get("O", 0) > 1
+
+    def render_results(self, samples, moment=None):
+        """Records of one result message.
+
+        ``samples`` holds (sample_number, patient_id, patient_name, results)
+        tuples, where ``results`` holds (test_code, value, unit, lower, upper).
+        """
+        if self.result is None:
+            raise TemplateError("The result template has no R record")
+        values = {"timestamp": astm_timestamp(moment)}
+        records = [self.header.render(values)]
+        for patient_seq, (sample_number, patient_id, patient_name, results) in enumerate(samples, start=1):
+            values["sample"] = escape(sample_number)
+            if self.patient is not None:
+                values.update(seq=patient_seq, patient_id=escape(patient_id), patient_name=escape(patient_name))
+                records.append(self.patient.render(values))
+            if self.order is not None and not self.order_per_result:
+                values.update(seq=1, test="\\^^^".join(escape(result[0]) for result in results))
+                records.append(self.order.render(values))
+            for seq, (test_code, value, unit, lower, upper) in enumerate(results, start=1):
+                values["test"] = escape(test_code)
+                if self.order is not None and self.order_per_result:
+                    values["seq"] = seq
+                    records.append(self.order.render(values))
+                    values["seq"] = 1
+                else:
+                    values["seq"] = seq
+                values.update(
+                    value=value,
+                    unit=escape(unit),
+                    range=f"{lower}-{upper}",
+                    flag=abnormal_flag(value, lower, upper),
+                )
+                records.append(self.result.render(values))
+        values["seq"] = 1
+        records.append(self.terminator.render(values))
+        return records
+
+    def render_query(self, sample_numbers, moment=None):
+        """Records of one host query for ``sample_numbers``."""
+        if self.query is None:
+            raise TemplateError("The sample info template has no Q record")
+        values = {"timestamp": astm_timestamp(moment)}
+        records = [self.header.render(values)]
+        for seq, sample_number in enumerate(sample_numbers, start=1):
+            values.update(seq=seq, sample=escape(sample_number))
+            records.append(self.query.render(values))
+        values["seq"] = 1
+        records.append(self.terminator.render(values))
+        return records
+
+
+@lru_cache(maxsize=256)
+def compile_template(text):
+    """Compile a template script; identical scripts share one compiled plan."""
+    return CompiledTemplate(text)
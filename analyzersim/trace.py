@@ -0,0 +1,251 @@
+"""Binary traces of every byte an analyzer session exchanges.
+
+A trace file starts with a 16-byte header (magic, format version, the
+wall clock time the trace started in nanoseconds) followed by events. Each
+event is a 15-byte little-endian header (kind, session number, monotonic
+nanoseconds since the trace started, payload length) and its payload:
+
+    OPEN      JSON with the session name, transport and port offset
+    SENT      bytes written to the LIS
+    RECEIVED  bytes read from the LIS
+    CLOSE     empty
+
+``TraceWriter`` appends events through a large write buffer, from any
+thread. ``TraceReader`` memory-maps a trace and reads events in place, so
+traces of any size are replayed without loading them; a trace cut short by
+a crash reads up to its last complete event. ``replay.TraceReplayer``
+drives the recorded sessions against a LIS again.
+"""
+import json
+import mmap
+import struct
+import threading
+import time
+from array import array
+from collections import namedtuple
+
+MAGIC = b"ASTMTRC"
+VERSION = 1
+
+OPEN = 1
+SENT = 2
+RECEIVED = 3
+CLOSE = 4
+
+# magic, version, wall clock start (ns)
+_HEADER = struct.Struct("<7sBq")
+# kind, session, nanoseconds since the start, payload length
+_EVENT = struct.Struct("<BHQI")
+MAX_SESSIONS = 0xFFFF
+
+# Bytes buffered before the writer touches the file
+WRITE_BUFFER = 1 << 20
+
+# ``time`` is in seconds since the trace started
+TraceEvent = namedtuple("TraceEvent", "kind session time data")
+
+
+class TraceError(ValueError):
+    pass
+
+
+class TraceSession:
+    """What a trace says about one session: its OPEN details and extent."""
+
+    def __init__(self, number, name, transport, port_offset, opened):
+        self.number = number
+        self.name = name
+        self.transport = transport
+        self.port_offset = port_offset
+        self.opened = opened
+        self.closed = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class TraceWriter:
+    """Appends events to a new trace file at ``path``."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb", buffering=WRITE_BUFFER)
+        self._start = time.monotonic_ns()
+        self._file.write(_HEADER.pack(MAGIC, VERSION, time.time_ns()))
+        self._sessions = 0
+        self._lock = threading.Lock()
+
+    def open_session(self, name, transport="", port_offset=0):
+        """Record a session opening; return its number for ``record()``."""
+        payload = json.dumps({"name": name, "transport": transport, "port_offset": port_offset}).encode("utf-8")
+        with self._lock:
+            if self._sessions == MAX_SESSIONS:
+                raise TraceError(f"A trace holds at most {MAX_SESSIONS} sessions")
+            self._sessions += 1
+            self._write(OPEN, self._sessions, payload)
+            return self._sessions
+
+    def record(self, session, kind, data=b""):
+        with self._lock:
+            self._write(kind, session, data)
+
+    def _write(self, kind, session, data):
+        if self._file is None:
+            return
+        self._file.write(_EVENT.pack(kind, session, time.monotonic_ns() - self._start, len(data)))
+        self._file.write(data)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RecordingTransport:
+    """Wraps a transport and records everything it reads and writes in a TraceWriter."""
+
+    def __init__(self, transport, trace, name):
+        self.transport = transport
+        self.trace = trace
+        self.name = name
+        self._session = None
+
+    def __str__(self):
+        return str(self.transport)
+
+    @property
+    def address(self):
+        return self.transport.address
+
+    @property
+    def is_open(self):
+        return self.transport.is_open
+
+    async def open(self):
+        await self.transport.open()
+        self._session = self.trace.open_session(
+            self.name, str(self.transport), getattr(self.transport, "port_offset", 0))
+
+    async def read(self, size=4096):
+        data = await self.transport.read(size)
+        if data and self._session is not None:
+            self.trace.record(self._session, RECEIVED, data)
+        return data
+
+    async def write(self, data):
+        if self._session is not None:
+            self.trace.record(self._session, SENT, data)
+        await self.transport.write(data)
+
+    async def close(self):
+        await self.transport.close()
+        if self._session is not None:
+            self.trace.record(self._session, CLOSE)
+            self._session = None
+
+
+class TraceReader:
+    """A trace file mapped into memory; iterate ``events()`` or index it by session."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            try:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise TraceError(f"{path} is empty") from None
+        if len(self._map) < _HEADER.size:
+            self.close()
+            raise TraceError(f"{path} is not a trace file")
+        magic, version, started = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise TraceError(f"{path} is not a trace file")
+        if version != VERSION:
+            self.close()
+            raise TraceError(f"{path} has trace format {version}, expected {VERSION}")
+        # Wall clock time the trace started, in seconds since the epoch
+        self.started = started / 1e9
+        self._sessions = None
+
+    def offsets(self):
+        """Yield the file offset of every complete event."""
+        data = self._map
+        size = len(data)
+        offset = _HEADER.size
+        unpack = _EVENT.unpack_from
+        while offset + _EVENT.size <= size:
+            length = unpack(data, offset)[3]
+            if offset + _EVENT.size + length > size:
+                break
+            yield offset
+            offset += _EVENT.size + length
+
+    def event_at(self, offset):
+        # Slicing copies the payload. A memoryview would spare that, but the
+        # map cannot be closed while any view of it is alive, such as one a
+        # transport still holds in its write buffer.
+        kind, session, nanoseconds, length = _EVENT.unpack_from(self._map, offset)
+        start = offset + _EVENT.size
+        return TraceEvent(kind, session, nanoseconds / 1e9, self._map[start:start + length])
+
+    def events(self):
+        for offset in self.offsets():
+            yield self.event_at(offset)
+
+    def index(self):
+        """Map each session number to an array of its event offsets, in order."""
+        index = {}
+        for offset in self.offsets():
+            session = _EVENT.unpack_from(self._map, offset)[1]
+            offsets = index.get(session)
+            if offsets is None:
+                offsets = index[session] = array("Q")
+            offsets.append(offset)
+        return index
+
+    @property
+    def sessions(self):
+        """{number: TraceSession} of every session in the trace."""
+        if self._sessions is None:
+            sessions = {}
+            for offset in self.offsets():
+                kind, number, nanoseconds, length = _EVENT.unpack_from(self._map, offset)
+                if kind == OPEN:
+                    details = json.loads(self.event_at(offset).data)
+                    sessions[number] = TraceSession(
+                        number, details["name"], details.get("transport", ""),
+                        details.get("port_offset", 0), nanoseconds / 1e9,
+                    )
+                elif number in sessions:
+                    session = sessions[number]
+                    if kind == SENT:
+                        session.bytes_sent += length
+                    elif kind == RECEIVED:
+                        session.bytes_received += length
+                    elif kind == CLOSE:
+                        session.closed = nanoseconds / 1e9
+            self._sessions = sessions
+        return self._sessions
+
+    @property
+    def duration(self):
+        """Seconds from the start of the trace to its last event."""
+        last = None
+        for last in self.offsets():
+            pass
+        return 0.0 if last is None else _EVENT.unpack_from(self._map, last)[2] / 1e9
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
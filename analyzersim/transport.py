@@ -0,0 +1,441 @@
+"""Asyncio transports between a simulated analyzer and the LIS.
+
+Every session is a coroutine-driven object, so any number of simulated
+analyzers can share one event loop. Synchronous callers such as the Qt
+window run that loop in an ``EventLoopThread``.
+"""
+import asyncio
+import os
+import sys
+import threading
+from dataclasses import replace
+
+try:
+    import termios
+except ImportError:  # Windows
+    termios = None
+
+from .astm import FrameEncoder
+from .link import RECEIVE_TIMEOUT, LinkLayer, LinkMetrics, MessageFailed, MessageSent
+from .metrics import REGISTRY
+from .parser import parse_records
+from .trace import RecordingTransport
+
+
+class TransportError(Exception):
+    pass
+
+
+class TcpTransport:
+    """Byte stream to the LIS over TCP.
+
+    As a Client the analyzer connects to ``lis_address:lis_port``. As a Server
+    it listens on ``analyzer_address:analyzer_port`` and talks to the first LIS
+    that connects.
+    """
+
+    def __init__(self, settings, port_offset=0):
+        self.settings = settings
+        self.port_offset = port_offset
+        self._reader = None
+        self._writer = None
+
+    @property
+    def address(self):
+        if self.settings.is_server:
+            return self.settings.analyzer_address, self.settings.analyzer_port + self.port_offset
+        return self.settings.lis_address, self.settings.lis_port + self.port_offset
+
+    def __str__(self):
+        host, port = self.address
+        mode = "listening on" if self.settings.is_server else "connecting to"
+        return f"TCP {mode} {host}:{port}"
+
+    async def open(self):
+        host, port = self.address
+        if not self.settings.is_server:
+            self._reader, self._writer = await asyncio.open_connection(host, port)
+            return
+        accepted = asyncio.get_running_loop().create_future()
+
+        def on_connect(reader, writer):
+            if accepted.done():
+                writer.close()
+            else:
+                accepted.set_result((reader, writer))
+
+        server = await asyncio.start_server(on_connect, host, port)
+        try:
+            self._reader, self._writer = await accepted
+        finally:
+            server.close()
+
+    @property
+    def is_open(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def read(self, size=4096):
+        """Return the next bytes received; ``b""`` once the peer closed."""
+        return await self._reader.read(size)
+
+    async def write(self, data):
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+
+
+# CMSPAR (sticky parity, for Mark and Space) is missing from the termios module
+CMSPAR = getattr(termios, "CMSPAR", 0o10000000000 if sys.platform.startswith("linux") else 0)
+PARITIES = ("No", "Even", "Odd", "Space", "Mark")
+
+
+def serial_device(name):
+    """Map a port name from the settings to a device path; "COM1" is /dev/ttyS0."""
+    if name.upper().startswith("COM") and name[3:].isdigit():
+        return f"/dev/ttyS{int(name[3:]) - 1}"
+    return name
+
+
+def character_bits(settings):
+    """Bits on the wire per character: start, data, parity and stop bits."""
+    return 1 + settings.data_bits + (settings.parity != "No") + settings.stop_bits
+
+
+class SerialTransport:
+    """Byte stream to the LIS over RS-232, using the stored line settings.
+
+    The port is opened non-blocking and serviced by the event loop's reader
+    callbacks. Every write also waits for the time the bytes need on the line
+    at the configured baud rate, so a pseudo-terminal stand-in runs at the
+    speed of the real cable. ``fd`` wraps an already open descriptor, such as
+    the LIS end of a ``PtyLoopback``, instead of opening ``serial_port``.
+    """
+
+    def __init__(self, settings, fd=None):
+        if settings.parity not in PARITIES:
+            raise ValueError(f"Invalid parity: {settings.parity!r}")
+        if not 5 <= settings.data_bits <= 8:
+            raise ValueError(f"Invalid data bits: {settings.data_bits!r}")
+        if settings.stop_bits not in (1, 2):
+            raise ValueError(f"Invalid stop bits: {settings.stop_bits!r}")
+        self.settings = settings
+        self.device = serial_device(settings.serial_port)
+        self.char_time = character_bits(settings) / settings.baud_rate
+        self._fd = fd
+        self._configure = fd is None
+        self._received = None
+        self._writing = None
+        self._line_free = 0.0
+
+    @property
+    def address(self):
+        return self.device
+
+    def __str__(self):
+        s = self.settings
+        return f"Serial {self.device} {s.baud_rate} {s.data_bits}{s.parity[0]}{s.stop_bits}"
+
+    async def open(self):
+        if termios is None:
+            raise TransportError("Serial ports are only supported on POSIX systems")
+        if self._configure:
+            try:
+                self._fd = os.open(self.device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+            except OSError as error:
+                raise TransportError(f"Cannot open {self.device}: {error.strerror}") from None
+            try:
+                self._apply_settings()
+            except BaseException:
+                os.close(self._fd)
+                self._fd = None
+                raise
+        else:
+            os.set_blocking(self._fd, False)
+        self._received = asyncio.Queue()
+        self._writing = asyncio.Lock()
+        asyncio.get_running_loop().add_reader(self._fd, self._on_readable)
+
+    def _apply_settings(self):
+        settings = self.settings
+        speed = getattr(termios, f"B{settings.baud_rate}", None)
+        if speed is None:
+            raise ValueError(f"Unsupported baud rate: {settings.baud_rate}")
+        iflag, oflag, cflag, lflag, _, _, cc = termios.tcgetattr(self._fd)
+        # Raw mode: no echo, no line editing, no CR/LF translation
+        iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR
+                   | termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.INPCK)
+        oflag &= ~termios.OPOST
+        lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+        cflag &= ~(termios.CSIZE | termios.CSTOPB | termios.PARENB | termios.PARODD | CMSPAR)
+        cflag |= termios.CREAD | termios.CLOCAL
+        cflag |= {5: termios.CS5, 6: termios.CS6, 7: termios.CS7, 8: termios.CS8}[settings.data_bits]
+        if settings.stop_bits == 2:
+            cflag |= termios.CSTOPB
+        if settings.parity != "No":
+            cflag |= termios.PARENB
+            if settings.parity in ("Odd", "Mark"):
+                cflag |= termios.PARODD
+            if settings.parity in ("Space", "Mark"):
+                if not CMSPAR:
+                    raise ValueError(f"{settings.parity} parity is not supported on this system")
+                cflag |= CMSPAR
+        cc[termios.VMIN] = 1
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(self._fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            # EIO: the other end of a pseudo-terminal was closed
+            data = b""
+        if not data:
+            asyncio.get_running_loop().remove_reader(self._fd)
+        self._received.put_nowait(data)
+
+    @property
+    def is_open(self):
+        return self._fd is not None
+
+    async def read(self, size=4096):
+        """Return the next bytes received; ``b""`` once the port is gone."""
+        return await self._received.get()
+
+    async def write(self, data):
+        loop = asyncio.get_running_loop()
+        view = memoryview(data)
+        # One write at a time, or a partial write would let another's bytes in
+        async with self._writing:
+            while view:
+                try:
+                    written = os.write(self._fd, view)
+                except BlockingIOError:
+                    writable = loop.create_future()
+                    loop.add_writer(self._fd, writable.set_result, None)
+                    try:
+                        await writable
+                    finally:
+                        loop.remove_writer(self._fd)
+                    continue
+                view = view[written:]
+        # Hold the caller until the line would have shifted the bytes out
+        now = loop.time()
+        self._line_free = max(now, self._line_free) + len(data) * self.char_time
+        await asyncio.sleep(self._line_free - now)
+
+    async def close(self):
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+            if self._received is not None:
+                self._received.put_nowait(b"")
+
+
+class PtyLoopback:
+    """A pseudo-terminal standing in for a serial cable between analyzer and LIS.
+
+    The analyzer opens ``device`` like any serial port (its ``serial_port``
+    setting is replaced); ``lis_transport()`` is the other end of the cable.
+    """
+
+    def __init__(self):
+        self._master, self._slave = os.openpty()
+        self.device = os.ttyname(self._slave)
+
+    def analyzer_settings(self, settings):
+        """Copy of ``settings`` that points the serial port at the loopback."""
+        return replace(settings, connection_type="Serial", serial_port=self.device)
+
+    def lis_transport(self, settings):
+        return SerialTransport(settings, fd=self._master)
+
+    def close(self):
+        # The master descriptor belongs to the LIS transport once it is open
+        if self._slave is not None:
+            os.close(self._slave)
+            self._slave = None
+
+
+def open_transport(settings, port_offset=0, trace=None, name=""):
+    """The transport ``settings`` ask for.
+
+    With ``trace`` (a trace.TraceWriter) every byte it reads and writes is
+    recorded under the session ``name``.
+    """
+    transport = TcpTransport(settings, port_offset) if settings.is_tcp else SerialTransport(settings)
+    if trace is not None:
+        transport = RecordingTransport(transport, trace, name)
+    return transport
+
+
+class AnalyzerSession:
+    """One simulated analyzer talking ASTM over a transport.
+
+    The session only moves bytes: a reader task feeds everything received
+    into a ``LinkLayer``, one timer handle tracks the link's deadline, and
+    whatever the link wants to transmit is written straight away. Sends
+    queue on the link, so several messages can be in flight per session.
+    Messages received from the LIS are parsed into lists of ``Record`` and
+    handed to ``on_message``, or queued for ``receive_message()`` when no
+    callback is set. Link metrics go to ``metrics`` under the session name;
+    pass None to keep none.
+    """
+
+    def __init__(self, name, transport, role="instrument", log=None, on_message=None, metrics=REGISTRY):
+        self.name = name
+        self.metrics = metrics
+        self.transport = transport
+        self.role = role
+        self.log = log or (lambda message: None)
+        self.on_message = on_message
+        self.encoder = FrameEncoder()
+        self.messages = asyncio.Queue()
+        self.link = None
+        self._reader_task = None
+        self._timer = None
+        # Why the connection ended; later sends fail at once with it
+        self._lost = None
+
+    async def open(self):
+        self.log(f"{self.name}: {self.transport}")
+        await self.transport.open()
+        loop = asyncio.get_running_loop()
+        self.link = LinkLayer(
+            self.role, clock=loop.time,
+            metrics=LinkMetrics(self.metrics, self.name) if self.metrics is not None else None,
+        )
+        self._lost = None
+        self._reader_task = loop.create_task(self._read_loop())
+        self.log(f"{self.name}: connected")
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        await self.transport.close()
+        self._lost = "session closed"
+        if self.link is not None:
+            self.link.connection_lost("session closed")
+            await self._flush()
+        self.log(f"{self.name}: disconnected")
+
+    @property
+    def connected(self):
+        """Whether the session is open and has not lost its connection."""
+        return self.link is not None and self._lost is None
+
+    async def wait_closed(self):
+        """Wait until the peer ends the connection or the session is closed."""
+        if self._reader_task is not None:
+            await asyncio.wait([self._reader_task])
+
+    async def send_message(self, records):
+        """Send one message (a list of record strings); return the frame count."""
+        if self.link is None:
+            raise TransportError(f"{self.name}: session is not open")
+        if self._lost:
+            raise TransportError(f"{self.name}: {self._lost}")
+        sent = asyncio.get_running_loop().create_future()
+        self.link.send(self.encoder.frames(records), sent)
+        await self._flush()
+        return await sent
+
+    async def receive_message(self, timeout=RECEIVE_TIMEOUT):
+        """Wait for the next message from the LIS; return its records."""
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            raise TransportError(f"{self.name}: nothing received within {timeout:g} s") from None
+
+    async def _read_loop(self):
+        reason = "LIS closed the connection"
+        try:
+            while True:
+                data = await self.transport.read()
+                if not data:
+                    break
+                self.link.data_received(data)
+                await self._flush()
+        except OSError as error:
+            reason = f"connection error: {error}"
+        self._lost = reason
+        self.link.connection_lost(reason)
+        await self._flush()
+
+    async def _flush(self):
+        link = self.link
+        data = link.take_output()
+        while link.events:
+            self._dispatch(link.events.popleft())
+        self._schedule()
+        if data and self.transport.is_open:
+            try:
+                await self.transport.write(data)
+            except OSError as error:
+                self._lost = f"connection error: {error}"
+                link.connection_lost(self._lost)
+                await self._flush()
+
+    def _dispatch(self, event):
+        if isinstance(event, MessageSent):
+            if event.retransmits:
+                self.log(f"{self.name}: {event.retransmits} frames retransmitted after NAK")
+            if not event.token.done():
+                event.token.set_result(event.frames)
+        elif isinstance(event, MessageFailed):
+            self.log(f"{self.name}: {event.reason}")
+            if not event.token.done():
+                event.token.set_exception(TransportError(f"{self.name}: {event.reason}"))
+        elif self.on_message is not None:
+            self.on_message(parse_records(event.records))
+        else:
+            self.messages.put_nowait(parse_records(event.records))
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.link.deadline is not None:
+            self._timer = asyncio.get_running_loop().call_at(self.link.deadline, self._expired)
+
+    def _expired(self):
+        self._timer = None
+        self.link.poll()
+        asyncio.ensure_future(self._flush())
+
+
+class EventLoopThread:
+    """Runs an asyncio event loop in a daemon thread for synchronous callers."""
+
+    def __init__(self, name="analyzersim-io"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, coro):
+        """Schedule ``coro`` on the loop; return a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        if self._thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
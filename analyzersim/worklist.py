@@ -0,0 +1,167 @@
+"""Streaming reader for sample worklists.
+
+A worklist names the samples to load, one per line, as CSV, tab separated
+text or JSON lines. Rows are read lazily, so a worklist of any length is
+imported in constant memory. Columns are matched by header name; CSV and TSV
+files without a header give them in the order sample number, patient ID,
+patient name, requested tests. Requested tests may be separated by commas,
+semicolons, carets or repeat delimiters (``\\``) and are stored comma
+separated, as for orders received from the LIS.
+"""
+import csv
+import io
+import json
+import os
+import re
+
+FORMATS = ("csv", "tsv", "jsonl")
+
+# File extensions and the format they imply
+EXTENSIONS = {
+    ".csv": "csv",
+    ".tsv": "tsv",
+    ".tab": "tsv",
+    ".txt": "tsv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+}
+
+# Accepted header names for each column, compared lower case without spaces or underscores
+COLUMNS = {
+    "sample_number": ("samplenumber", "sample", "sampleid", "sampleno", "specimen", "specimenid", "barcode"),
+    "patient_id": ("patientid", "patient", "pid"),
+    "patient_name": ("patientname", "name"),
+    "requested_tests": ("requestedtests", "tests", "testcodes", "orders"),
+}
+FIELDS = tuple(COLUMNS)
+
+TEST_SEPARATORS = re.compile(r"[,;^\\|]")
+
+
+class WorklistError(ValueError):
+    pass
+
+
+def worklist_format(path):
+    """Format implied by the file extension of ``path``."""
+    extension = os.path.splitext(str(path))[1].lower()
+    if extension not in EXTENSIONS:
+        raise WorklistError(f"Unknown worklist type {extension or path!r}, expected one of {', '.join(FORMATS)}")
+    return EXTENSIONS[extension]
+
+
+def _normalize(name):
+    return re.sub(r"[\s_\-]", "", str(name)).lower()
+
+
+def _header_columns(row):
+    """Map field names to column indexes if ``row`` is a header, else return None."""
+    names = {alias: field for field, aliases in COLUMNS.items() for alias in aliases}
+    columns = {}
+    for index, cell in enumerate(row):
+        field = names.get(_normalize(cell))
+        if field is not None and field not in columns:
+            columns[field] = index
+    return columns if "sample_number" in columns else None
+
+
+def _tests(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        tests = [str(test).strip() for test in value]
+    else:
+        tests = [test.strip() for test in TEST_SEPARATORS.split(str(value))]
+    tests = [test for test in tests if test]
+    return ",".join(dict.fromkeys(tests)) or None
+
+
+def _row(line_number, sample_number, patient_id, patient_name, requested_tests):
+    sample_number = str(sample_number or "").strip()
+    if not sample_number:
+        raise WorklistError(f"Line {line_number}: no sample number")
+    return (
+        sample_number,
+        str(patient_id or "").strip(),
+        str(patient_name or "").strip(),
+        _tests(requested_tests),
+    )
+
+
+def _delimited_rows(text, delimiter):
+    columns = None
+    for line_number, row in enumerate(csv.reader(text, delimiter=delimiter), 1):
+        if not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            columns = _header_columns(row)
+            if columns is not None:
+                continue
+            columns = {field: index for index, field in enumerate(FIELDS)}
+        yield _row(line_number, *(
+            row[columns[field]] if field in columns and columns[field] < len(row) else None
+            for field in FIELDS
+        ))
+
+
+def _json_rows(text):
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as error:
+            raise WorklistError(f"Line {line_number}: {error}") from None
+        if not isinstance(item, dict):
+            raise WorklistError(f"Line {line_number}: expected a JSON object")
+        values = {}
+        for key, value in item.items():
+            for field, aliases in COLUMNS.items():
+                if _normalize(key) in aliases:
+                    values.setdefault(field, value)
+        yield _row(line_number, *(values.get(field) for field in FIELDS))
+
+
+def read_worklist(stream, format):
+    """Yield (sample_number, patient_id, patient_name, requested_tests) from a text stream.
+
+    ``requested_tests`` is None when the worklist does not name any.
+    """
+    if format == "csv":
+        return _delimited_rows(stream, ",")
+    if format == "tsv":
+        return _delimited_rows(stream, "\t")
+    if format == "jsonl":
+        return _json_rows(stream)
+    raise WorklistError(f"Unknown worklist format {format!r}, expected one of {', '.join(FORMATS)}")
+
+
+class WorklistFile:
+    """A worklist file opened for streaming; iterate it for rows.
+
+    ``position`` and ``size`` are in bytes, for progress reporting.
+    """
+
+    def __init__(self, path, format=None):
+        self.path = path
+        self.format = format or worklist_format(path)
+        self.size = os.path.getsize(path)
+        self._raw = open(path, "rb")
+        # utf-8-sig drops the byte order mark spreadsheet programs like to write
+        self._text = io.TextIOWrapper(self._raw, encoding="utf-8-sig", newline="")
+
+    @property
+    def position(self):
+        return self._raw.tell()
+
+    def __iter__(self):
+        return read_worklist(self._text, self.format)
+
+    def close(self):
+        self._text.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
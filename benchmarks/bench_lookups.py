@@ -0,0 +1,119 @@
+"""Lookup latency as the results table grows, with and without the schema indexes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_lookups --sizes 10000 100000 1000000
+
+Two scratch databases are grown side by side: one left at schema version 0
+(tables only) and one fully migrated. After each growth step the median time
+of the lookups behind generate_results, load_sample_list and
+load_sample_results is printed for both.
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from analyzersim.database import Database
+from analyzersim.migrations import BASE_SCHEMA, migrate
+
+TESTS_PER_SAMPLE = 50
+
+LOOKUPS = {
+    "tests by analyzer": (
+        "SELECT id, test_code, lower_range, upper_range FROM tests WHERE analyzer_id = ?",
+        lambda samples: (1,),
+    ),
+    "sample by number": (
+        "SELECT id FROM samples WHERE sample_number = ?",
+        lambda samples: (f"S{random.randrange(samples):09d}",),
+    ),
+    "newest samples": (
+        "SELECT id, sample_number, patient_id, patient_name FROM samples "
+        "ORDER BY date_time DESC LIMIT 100",
+        lambda samples: (),
+    ),
+    "results of sample": (
+        "SELECT r.id, t.test_code, r.result_value, t.unit, t.lower_range, t.upper_range, r.sent "
+        "FROM results r JOIN tests t ON r.test_id = t.id WHERE r.sample_id = ?",
+        lambda samples: (random.randrange(1, samples + 1),),
+    ),
+}
+
+
+def open_database(path, indexed):
+    db = Database(path)
+    if indexed:
+        migrate(db)
+    else:
+        with db.transaction() as cursor:
+            for statement in BASE_SCHEMA:
+                cursor.execute(statement)
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO analyzers (name) VALUES ('Benchmark')")
+        cursor.executemany(
+            "INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range) "
+            "VALUES (1, ?, 'mmol/l', 1.0, 5.0)",
+            ((f"T{i}",) for i in range(TESTS_PER_SAMPLE)),
+        )
+    return db
+
+
+def grow(db, start, stop):
+    """Add samples ``start`` .. ``stop - 1`` with a full panel of results each."""
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO samples (id, sample_number, patient_id, patient_name, date_time) "
+            "VALUES (?, ?, 'P', 'Name', ?)",
+            ((i + 1, f"S{i:09d}", f"2024-01-01 00:00:{i:09d}") for i in range(start, stop)),
+        )
+        cursor.executemany(
+            "INSERT INTO results (sample_id, test_id, result_value, sent) VALUES (?, ?, 2.5, 0)",
+            ((i + 1, t + 1) for i in range(start, stop) for t in range(TESTS_PER_SAMPLE)),
+        )
+
+
+def time_lookup(db, sql, params, samples, repeat):
+    timings = []
+    for _ in range(repeat):
+        args = params(samples)
+        start = time.perf_counter()
+        db.fetchall(sql, args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="results table sizes to measure at")
+    parser.add_argument("--repeat", type=int, default=25, help="lookups per measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        databases = {
+            "baseline": open_database(os.path.join(tmp, "baseline.db"), indexed=False),
+            "indexed": open_database(os.path.join(tmp, "indexed.db"), indexed=True),
+        }
+        samples = 0
+        print(f"{'results':>10}  {'lookup':<18}  {'baseline ms':>12}  {'indexed ms':>12}")
+        for size in sorted(args.sizes):
+            target = max(size // TESTS_PER_SAMPLE, 1)
+            for db in databases.values():
+                grow(db, samples, target)
+            samples = target
+            for name, (sql, params) in LOOKUPS.items():
+                timings = [
+                    time_lookup(db, sql, params, samples, args.repeat) * 1000
+                    for db in databases.values()
+                ]
+                print(f"{samples * TESTS_PER_SAMPLE:>10}  {name:<18}  "
+                      f"{timings[0]:>12.3f}  {timings[1]:>12.3f}")
+        for db in databases.values():
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
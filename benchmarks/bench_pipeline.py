@@ -0,0 +1,122 @@
+"""Result sending throughput: one session per result against the batching pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --samples 200
+
+Results of ``--samples`` synthetic samples are sent to an in-process LIS (a
+link layer in the computer role, acknowledging every frame over loopback
+TCP) in three ways:
+
+    connection  a new TCP connection and ASTM session for every result
+    message     one connection, one ASTM message per result
+    pipeline    one connection, ResultPipeline batching up to --message-results
+                results into each message
+
+Every mode starts from the same unsent results in a scratch database and the
+results are marked sent as the LIS acknowledges them, exactly as in the
+simulator.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from analyzersim.config import ConnectionSettings
+from analyzersim.engine import SimulatorEngine
+from analyzersim.pipeline import MESSAGE_RESULTS, ResultPipeline
+from analyzersim.transport import AnalyzerSession, TcpTransport
+
+
+async def open_sessions(port):
+    lis = AnalyzerSession("lis", TcpTransport(ConnectionSettings(
+        socket_type="Server", analyzer_address="127.0.0.1", analyzer_port=port)), role="computer")
+    analyzer = AnalyzerSession("analyzer", TcpTransport(ConnectionSettings(
+        socket_type="Client", lis_address="127.0.0.1", lis_port=port)))
+    listening = asyncio.create_task(lis.open())
+    # Give the server a moment to listen before connecting
+    while True:
+        try:
+            await analyzer.open()
+            break
+        except OSError:
+            await asyncio.sleep(0.001)
+    await listening
+    return analyzer, lis
+
+
+async def close_sessions(*sessions):
+    for session in sessions:
+        await session.close()
+
+
+async def per_connection(engine, port):
+    for result_id in engine.unsent_result_ids(1):
+        analyzer, lis = await open_sessions(port)
+        try:
+            await engine.send_results(analyzer, 1, [result_id])
+        finally:
+            await close_sessions(analyzer, lis)
+
+
+async def per_message(engine, port):
+    analyzer, lis = await open_sessions(port)
+    try:
+        for result_id in engine.unsent_result_ids(1):
+            await engine.send_results(analyzer, 1, [result_id])
+    finally:
+        await close_sessions(analyzer, lis)
+
+
+async def pipelined(engine, port, sample_numbers, message_results=MESSAGE_RESULTS):
+    analyzer, lis = await open_sessions(port)
+    try:
+        pipeline = ResultPipeline(engine, 1, analyzer, message_results=message_results)
+        sender = asyncio.create_task(pipeline.run())
+        for start in range(0, len(sample_numbers), 100):
+            pipeline.submit(sample_numbers[start:start + 100])
+        pipeline.close()
+        await sender
+    finally:
+        await close_sessions(analyzer, lis)
+    return pipeline.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--message-results", type=int, default=MESSAGE_RESULTS)
+    parser.add_argument("--port", type=int, default=14700)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    engine = SimulatorEngine(os.path.join(directory, "bench.db")).open()
+    sample_numbers = [f"B{number:08d}" for number in range(args.samples)]
+    results = engine.analyze(1, [(number, "", "") for number in sample_numbers])
+
+    modes = [
+        ("connection", lambda: per_connection(engine, args.port)),
+        ("message", lambda: per_message(engine, args.port)),
+        ("pipeline", lambda: pipelined(engine, args.port, sample_numbers, args.message_results)),
+    ]
+    print(f"{results} results of {args.samples} samples")
+    print(f"{'mode':>10}  {'seconds':>8}  {'results/s':>10}  {'speedup':>8}")
+    baseline = None
+    try:
+        for name, run in modes:
+            engine.db.execute("UPDATE results SET sent = 0")
+            start = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            unsent = len(engine.unsent_result_ids(1))
+            if unsent:
+                raise SystemExit(f"{name}: {unsent} results were not acknowledged")
+            baseline = baseline or elapsed
+            print(f"{name:>10}  {elapsed:>8.2f}  {results / elapsed:>10.0f}  {baseline / elapsed:>7.1f}x")
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
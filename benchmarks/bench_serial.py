@@ -0,0 +1,75 @@
+"""ASTM result throughput over a paced serial line, using a pseudo-terminal.
+
+Run from the repository root (Linux or macOS):
+
+    python -m benchmarks.bench_serial --bauds 9600 115200 --messages 20
+
+For each baud rate an analyzer session and a LIS session are connected
+through a PtyLoopback. The analyzer sends messages of synthetic results and
+the LIS acknowledges every frame through its own link layer. The achieved
+byte rate is printed next to the rate the line allows, so link-layer
+turnaround overhead (ENQ, ACK per frame, EOT) shows up as lost utilization.
+"""
+import argparse
+import asyncio
+import time
+
+from analyzersim.config import ConnectionSettings
+from analyzersim.templates import DEFAULT_TEMPLATES, compile_template
+from analyzersim.transport import AnalyzerSession, PtyLoopback, SerialTransport, character_bits
+
+
+def synthetic_message(samples, tests):
+    template = compile_template(DEFAULT_TEMPLATES["result_send"])
+    return template.render_results([
+        (f"S{number:08d}", f"P{number:08d}", f"Patient {number}",
+         [(f"Test_{test}", 2.5, "mmol/l", 1.0, 5.0) for test in range(tests)])
+        for number in range(samples)
+    ])
+
+
+async def measure(settings, records, messages):
+    loopback = PtyLoopback()
+    analyzer = AnalyzerSession("analyzer", SerialTransport(loopback.analyzer_settings(settings)))
+    lis = AnalyzerSession("lis", loopback.lis_transport(settings), role="computer")
+    await analyzer.open()
+    loopback.close()
+    await lis.open()
+    try:
+        start = time.perf_counter()
+        frames = 0
+        for _ in range(messages):
+            frames += await analyzer.send_message(records)
+        elapsed = time.perf_counter() - start
+    finally:
+        await analyzer.close()
+        await lis.close()
+    sent = sum(len(frame) for frame in analyzer.encoder.frames(records)) * messages
+    return frames, sent, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bauds", type=int, nargs="+", default=[9600, 38400, 115200])
+    parser.add_argument("--messages", type=int, default=10, help="messages per baud rate")
+    parser.add_argument("--samples", type=int, default=5, help="samples per message")
+    parser.add_argument("--tests", type=int, default=10, help="results per sample")
+    parser.add_argument("--framing", default="8N1", help="data bits, parity and stop bits (default: %(default)s)")
+    args = parser.parse_args()
+
+    parity = {"N": "No", "E": "Even", "O": "Odd", "S": "Space", "M": "Mark"}[args.framing[1].upper()]
+    records = synthetic_message(args.samples, args.tests)
+    print(f"{'baud':>8}  {'frames':>7}  {'seconds':>8}  {'frames/s':>9}  {'bytes/s':>9}  {'line max':>9}  {'use':>5}")
+    for baud in args.bauds:
+        settings = ConnectionSettings(
+            connection_type="Serial", baud_rate=baud,
+            data_bits=args.framing[0], parity=parity, stop_bits=args.framing[2],
+        )
+        frames, sent, elapsed = asyncio.run(measure(settings, records, args.messages))
+        line_max = baud / character_bits(settings)
+        print(f"{baud:>8}  {frames:>7}  {elapsed:>8.2f}  {frames / elapsed:>9.1f}  "
+              f"{sent / elapsed:>9.0f}  {line_max:>9.0f}  {sent / elapsed / line_max:>5.0%}")
+
+
+if __name__ == "__main__":
+    main()
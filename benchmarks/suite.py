@@ -0,0 +1,407 @@
+"""Benchmark suite for the simulator's hot paths, with JSON results.
+
+Run from the repository root:
+
+    python -m benchmarks.suite --sizes 1k 100k --output run.json
+    python -m benchmarks.suite --sizes 1M --compare run.json --fail-above 20
+
+Every size is a synthetic analyzersim.db of that many samples, analyzed on
+the three-test panel of a new database with a fixed seed. Fixtures are
+built once into --fixtures and reused while the schema version matches.
+
+Benchmarks per size:
+
+    store_samples        store 1000 new samples
+    generate_results     generate results for 1000 stored samples
+    load_sample_list     first page of the sample list, plus up to 10 pages of scrolling
+    load_sample_results  patient and results of 100 random samples
+    send_results         send one 150-result message to a loopback LIS
+    ui_sample_list       SampleListModel reload and 10 fetchMore() pages (needs PyQt6)
+    ui_result_table      ResultTableModel load and read of every cell, 100 samples (needs PyQt6)
+
+and once, independent of size:
+
+    astm_encode          frame a rendered 150-result message
+    template_render      render a 150-result message from the result template
+    lis_round_trip       send a one-result message and wait for the LIS acknowledgements
+    import_engine        import analyzersim.engine in a new interpreter, as timed by -X importtime
+
+The suite fails when import_engine takes longer than IMPORT_LIMIT, since
+the command line and the window both pay for it on every start.
+
+Every benchmark runs --repeat times after one warm-up run; setup and clean-up
+(for example deleting the samples a run stored) happen outside the timing.
+The JSON holds the machine and commit next to min, median, mean and
+standard deviation per benchmark, so runs can be compared over time with
+--compare.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from analyzersim.astm import FrameEncoder
+from analyzersim.engine import SimulatorEngine
+from analyzersim.migrations import MIGRATIONS
+from analyzersim.templates import DEFAULT_TEMPLATES, compile_template
+
+from .bench_pipeline import close_sessions, open_sessions
+
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(__file__), "fixtures")
+FIXTURE_SEED = 42
+# Samples analyzed per call while a fixture is built
+FIXTURE_BATCH = 50_000
+
+BATCH_SAMPLES = 1000
+LOOKUPS = 100
+PAGES = 10
+MESSAGE_RESULTS = 150
+# Seconds the engine may take to import
+IMPORT_LIMIT = 0.1
+
+
+def fixture_path(size, directory=FIXTURE_DIRECTORY):
+    """Database of ``size`` analyzed samples, built on first use."""
+    path = os.path.join(directory, f"analyzersim-{size}-v{len(MIGRATIONS)}.db")
+    if os.path.exists(path):
+        return path
+    os.makedirs(directory, exist_ok=True)
+    partial = path + ".partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+    print(f"Building {SIZES[size]} sample fixture {path}", file=sys.stderr)
+    engine = SimulatorEngine(partial).open()
+    try:
+        generator_seed = FIXTURE_SEED
+        for start in range(0, SIZES[size], FIXTURE_BATCH):
+            stop = min(start + FIXTURE_BATCH, SIZES[size])
+            engine.analyze(1, [
+                (f"S{number:09d}", f"P{number % 50000:07d}", f"Patient {number % 50000}")
+                for number in range(start, stop)
+            ], seed=generator_seed)
+            generator_seed += 1
+        engine.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        engine.close()
+    os.replace(partial, path)
+    return path
+
+
+class Benchmark:
+    """``run(state)`` is timed; ``setup()`` makes its state and ``cleanup(state)`` undoes it.
+
+    ``items`` is how many samples, results or messages one run handles, for
+    the per-second rate in the report.
+    """
+
+    def __init__(self, name, run, setup=None, cleanup=None, items=1):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+        self.cleanup = cleanup or (lambda state: None)
+        self.items = items
+
+    def measure(self, repeat):
+        timings = []
+        for index in range(repeat + 1):
+            state = self.setup()
+            try:
+                elapsed = self.time(state)
+            finally:
+                self.cleanup(state)
+            # The first run only warms caches
+            if index:
+                timings.append(elapsed)
+        return timings
+
+    def time(self, state):
+        start = time.perf_counter()
+        self.run(state)
+        return time.perf_counter() - start
+
+
+class ImportBenchmark(Benchmark):
+    """Import ``module`` in a new interpreter; the time is what -X importtime reports for it."""
+
+    def __init__(self, name, module):
+        super().__init__(name, None)
+        self.module = module
+
+    def time(self, state):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {self.module}"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        ).stderr
+        for line in output.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = [field.strip() for field in line.removeprefix("import time:").split("|")]
+            if len(fields) == 3 and fields[2] == self.module:
+                return int(fields[1]) / 1e6
+        raise RuntimeError(f"-X importtime did not report {self.module}")
+
+
+def summary(name, size, items, timings):
+    median = statistics.median(timings)
+    return {
+        "benchmark": name,
+        "size": size,
+        "repeat": len(timings),
+        "items": items,
+        "min": min(timings),
+        "median": median,
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "items_per_second": items / median if median else None,
+    }
+
+
+class Fixture:
+    """An engine over one fixture database, with the loopback LIS and fresh sample numbers."""
+
+    def __init__(self, path):
+        self.engine = SimulatorEngine(path).open()
+        # Samples a run stored are numbered B..., the fixture's own S...
+        self.delete_samples()
+        self.sample_count = self.engine.db.fetchone("SELECT COUNT(*) FROM samples")[0]
+        self.loop = asyncio.new_event_loop()
+        self.sessions = None
+        self.serial = 0
+        self.random = random.Random(FIXTURE_SEED)
+
+    def session(self, port):
+        if self.sessions is None:
+            self.sessions = self.loop.run_until_complete(open_sessions(port))
+        return self.sessions[0]
+
+    def close(self):
+        if self.sessions is not None:
+            self.loop.run_until_complete(close_sessions(*self.sessions))
+        self.loop.close()
+        self.engine.close()
+
+    def new_samples(self, count):
+        self.serial += 1
+        return [(f"B{self.serial:06d}-{number:05d}", "", "") for number in range(count)]
+
+    def delete_samples(self, state=None):
+        stored = "SELECT id FROM samples WHERE sample_number >= 'B' AND sample_number < 'C'"
+        with self.engine.db.transaction() as cursor:
+            cursor.execute(f"DELETE FROM results WHERE sample_id IN ({stored})")
+            cursor.execute(f"DELETE FROM samples WHERE id IN ({stored})")
+
+    def random_sample_ids(self, count):
+        return [self.random.randrange(1, self.sample_count + 1) for _ in range(count)]
+
+    def unsend(self, result_ids):
+        self.engine.db.execute(
+            "UPDATE results SET sent = 0 WHERE id BETWEEN ? AND ?", (min(result_ids), max(result_ids))
+        )
+
+
+def engine_benchmarks(fixture, port):
+    engine = fixture.engine
+
+    def stored_samples():
+        samples = fixture.new_samples(BATCH_SAMPLES)
+        engine.store_samples(samples)
+        return samples
+
+    def scroll(state):
+        page = engine.sample_page()
+        for _ in range(PAGES):
+            if not page:
+                break
+            last = page[-1]
+            page = engine.sample_page(after=(last[4], last[0]))
+
+    def look_up(sample_ids):
+        for sample_id in sample_ids:
+            engine.sample_patient(sample_id)
+            engine.sample_results(sample_id)
+
+    def message_results():
+        start = fixture.random.randrange(1, max(2, fixture.sample_count * 3 - MESSAGE_RESULTS))
+        return list(range(start, start + MESSAGE_RESULTS))
+
+    def send(result_ids):
+        fixture.loop.run_until_complete(engine.send_results(fixture.session(port), 1, result_ids))
+
+    return [
+        Benchmark("store_samples", engine.store_samples, lambda: fixture.new_samples(BATCH_SAMPLES),
+                  fixture.delete_samples, BATCH_SAMPLES),
+        Benchmark("generate_results",
+                  lambda samples: engine.generate_results(1, [sample[0] for sample in samples], seed=1),
+                  stored_samples, fixture.delete_samples, BATCH_SAMPLES * 3),
+        Benchmark("load_sample_list", scroll, items=PAGES + 1),
+        Benchmark("load_sample_results", look_up, lambda: fixture.random_sample_ids(LOOKUPS), items=LOOKUPS),
+        Benchmark("send_results", send, message_results, fixture.unsend, MESSAGE_RESULTS),
+    ]
+
+
+def ui_benchmarks(fixture):
+    """Benchmarks of the Qt item models, or none when PyQt6 is not installed."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt6.QtWidgets import QApplication
+        import original
+    except ImportError:
+        return []
+    application = QApplication.instance() or QApplication([])
+    sample_model = original.SampleListModel(fixture.engine)
+    result_model = original.ResultTableModel(fixture.engine)
+
+    def scroll(state):
+        sample_model.reload()
+        for _ in range(PAGES):
+            sample_model.fetchMore()
+        application.processEvents()
+
+    def show_results(sample_ids):
+        for sample_id in sample_ids:
+            result_model.load(sample_id)
+            for row in range(result_model.rowCount()):
+                for column in range(result_model.columnCount()):
+                    result_model.data(result_model.index(row, column))
+        application.processEvents()
+
+    return [
+        Benchmark("ui_sample_list", scroll, items=PAGES + 1),
+        Benchmark("ui_result_table", show_results, lambda: fixture.random_sample_ids(LOOKUPS), items=LOOKUPS),
+    ]
+
+
+def message_samples(results=MESSAGE_RESULTS, tests=3):
+    return [
+        (f"S{number:09d}", f"P{number:07d}", f"Patient {number}",
+         [(f"Test_{test}", 2.5 + test, "mmol/l", 1.0, 5.0) for test in range(tests)])
+        for number in range(results // tests)
+    ]
+
+
+def fixed_benchmarks(fixture, port):
+    template = compile_template(DEFAULT_TEMPLATES["result_send"])
+    samples = message_samples()
+    records = template.render_results(samples)
+    encoder = FrameEncoder()
+    single = template.render_results(message_samples(1, 1))
+    session = fixture.session(port)
+    return [
+        Benchmark("astm_encode", lambda state: encoder.frames(records), items=len(records)),
+        Benchmark("template_render", lambda state: template.render_results(samples), items=MESSAGE_RESULTS),
+        Benchmark("lis_round_trip", lambda state: fixture.loop.run_until_complete(session.send_message(single))),
+        ImportBenchmark("import_engine", "analyzersim.engine"),
+    ]
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine():
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def compare(results, baseline_path):
+    """Print the change of every median against ``baseline_path``; return the worst slowdown in percent."""
+    with open(baseline_path, encoding="utf-8") as stream:
+        baseline = {(row["benchmark"], row["size"]): row for row in json.load(stream)["results"]}
+    worst = 0.0
+    print(f"\n{'benchmark':<22}{'size':>6}  {'before':>10}  {'after':>10}  {'change':>8}")
+    for row in results:
+        before = baseline.get((row["benchmark"], row["size"]))
+        if before is None:
+            continue
+        change = (row["median"] / before["median"] - 1) * 100
+        worst = max(worst, change)
+        print(f"{row['benchmark']:<22}{row['size'] or '-':>6}  {before['median'] * 1000:>8.2f}ms"
+              f"  {row['median'] * 1000:>8.2f}ms  {change:>+7.1f}%")
+    return worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=["1k", "100k"])
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per benchmark (default: %(default)s)")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    parser.add_argument("--fixtures", default=FIXTURE_DIRECTORY, help="directory of the fixture databases")
+    parser.add_argument("--output", help="write the results as JSON to this file, or - for standard output")
+    parser.add_argument("--compare", metavar="JSON", help="print the change against an earlier --output file")
+    parser.add_argument("--fail-above", type=float, metavar="PERCENT",
+                        help="exit with status 1 when a median is this much slower than in --compare")
+    parser.add_argument("--port", type=int, default=14750)
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    results = []
+    print(f"{'benchmark':<22}{'size':>6}  {'median':>10}  {'min':>10}  {'stdev':>9}  {'items/s':>10}",
+          file=sys.stderr)
+    for index, size in enumerate(args.sizes):
+        fixture = Fixture(fixture_path(size, args.fixtures))
+        try:
+            benchmarks = [(size, benchmark) for benchmark in engine_benchmarks(fixture, args.port)
+                          + ui_benchmarks(fixture)]
+            if index == 0:
+                benchmarks += [(None, benchmark) for benchmark in fixed_benchmarks(fixture, args.port)]
+            for benchmark_size, benchmark in benchmarks:
+                if args.only and benchmark.name not in args.only:
+                    continue
+                row = summary(benchmark.name, benchmark_size, benchmark.items, benchmark.measure(args.repeat))
+                results.append(row)
+                print(f"{row['benchmark']:<22}{row['size'] or '-':>6}  {row['median'] * 1000:>8.3f}ms"
+                      f"  {row['min'] * 1000:>8.3f}ms  {row['stdev'] * 1000:>7.3f}ms"
+                      f"  {row['items_per_second']:>10.0f}", file=sys.stderr)
+        finally:
+            fixture.close()
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit(),
+        "machine": machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, indent=2)
+            stream.write("\n")
+
+    for row in results:
+        if row["benchmark"] == "import_engine" and row["median"] > IMPORT_LIMIT:
+            raise SystemExit(f"Importing analyzersim.engine takes {row['median'] * 1000:.0f} ms, "
+                             f"more than {IMPORT_LIMIT * 1000:.0f} ms")
+
+    if args.compare:
+        worst = compare(results, args.compare)
+        if args.fail_above is not None and worst > args.fail_above:
+            raise SystemExit(f"Slowest benchmark is {worst:.1f}% slower than {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
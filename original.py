@@ -1,25 +1,242 @@
+import asyncio
 import sys
-import random
 import time
-import sqlite3
-from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                             QLabel, QComboBox, QPushButton, QTabWidget, QRadioButton,
-                            QLineEdit, QCheckBox, QTextEdit, QProgressBar, QGroupBox,
+                            QLineEdit, QCheckBox, QTextEdit, QPlainTextEdit, QProgressBar, QGroupBox,
                             QFormLayout, QTableWidget, QTableWidgetItem, QHeaderView,
                             QSplitter, QMessageBox, QScrollArea, QSpacerItem, QSizePolicy,
-                            QStackedWidget, QFrame, QListWidget, QListWidgetItem, QToolButton)
-from PyQt6.QtCore import Qt, QTimer, QThread, pyqtSignal, QDateTime, QSize
+                            QStackedWidget, QFrame, QListWidget, QListWidgetItem, QToolButton,
+                            QTableView, QStyledItemDelegate, QAbstractItemView, QFileDialog)
+from PyQt6.QtCore import (Qt, QTimer, QThread, pyqtSignal, QDateTime, QSize, QObject,
+                          QAbstractTableModel, QModelIndex, QRunnable, QThreadPool)
 from PyQt6.QtGui import QFont, QIcon, QColor, QPalette
 
+from analyzersim.config import ConnectionSettings
+from analyzersim.engine import SimulatorEngine
+from analyzersim.export import export_results
+from analyzersim.logbuffer import ERROR, INFO, LEVELS, WARNING, LogBuffer, format_record, matches
+from analyzersim.metrics import DEFAULT_PORT as DEFAULT_METRICS_PORT, REGISTRY, MetricsServer
+from analyzersim.mocklis import MockLIS
+from analyzersim.pipeline import ResultPipeline
+from analyzersim.templates import DEFAULT_TEMPLATES
+from analyzersim.trace import TraceWriter
+from analyzersim.transport import AnalyzerSession, EventLoopThread, TransportError, open_transport
+
+# Milliseconds between log view updates
+LOG_REFRESH_INTERVAL = 100
+# Where "Write JSON Lines" writes the log
+LOG_FILE_PATH = "analyzersim-log.jsonl"
+
+def future_error(future):
+    """Error text of a finished concurrent future, or "" if it succeeded."""
+    if future.cancelled():
+        return "cancelled"
+    error = future.exception()
+    if error is None:
+        return ""
+    return str(error) or type(error).__name__
+
+class SessionSignals(QObject):
+    # Emitted from the I/O thread, delivered on the GUI thread
+    connected = pyqtSignal(str)
+    sent = pyqtSignal(list, str)
+    auto_sent = pyqtSignal(list, str)
+    sample_info = pyqtSignal(int, str)
+    samples_completed = pyqtSignal(list, int)
+    analysis_done = pyqtSignal(int, float, str)
+
+class JobCancelled(Exception):
+    pass
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+class Job(QRunnable):
+    """Runs ``function(job, *args)`` on a thread pool and reports back through signals.
+
+    The function calls ``job.progress(done, total)`` as it goes. Once
+    ``cancel()`` was called that raises JobCancelled, so the work stops at
+    its next progress report.
+    """
+    def __init__(self, description, function, *args):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.description = description
+        self.function = function
+        self.args = args
+        self.signals = JobSignals()
+        self.is_cancelled = False
+    
+    def cancel(self):
+        self.is_cancelled = True
+    
+    def progress(self, done, total):
+        if self.is_cancelled:
+            raise JobCancelled()
+        self.signals.progress.emit(done, total)
+    
+    def run(self):
+        try:
+            if self.is_cancelled:
+                raise JobCancelled()
+            result = self.function(self, *self.args)
+        except JobCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e) or type(e).__name__)
+        else:
+            self.signals.finished.emit(result)
+
+# Set on result cells whose value lies outside the normal range
+OUT_OF_RANGE_ROLE = Qt.ItemDataRole.UserRole + 1
+
+class SampleListModel(QAbstractTableModel):
+    """Samples, newest first, fetched from the engine one page at a time.
+
+    Views call canFetchMore/fetchMore as they scroll, so only the rows that
+    have been scrolled into view are ever loaded.
+    """
+    HEADERS = ["Sample No.", "Patient ID", "Patient Name"]
+    
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.rows = []
+        self.exhausted = False
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and index.isValid():
+            return self.rows[index.row()][index.column() + 1]
+        if role == Qt.ItemDataRole.UserRole and index.isValid():
+            return self.rows[index.row()][0]
+        return None
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        last = self.rows[-1] if self.rows else None
+        page = self.engine.sample_page(after=(last[4], last[0]) if last else None)
+        if not page:
+            self.exhausted = True
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+    
+    def reload(self, first_page=None):
+        """Start over, optionally with a first page fetched in the background."""
+        self.beginResetModel()
+        self.rows = list(first_page or [])
+        self.exhausted = False
+        self.endResetModel()
+        if first_page is None:
+            self.fetchMore()
+    
+    def sample_id(self, row):
+        return self.rows[row][0]
+
+class ResultTableModel(QAbstractTableModel):
+    """Results of one sample."""
+    HEADERS = ["Test Code", "Result", "Unit", "Normal Range", "Sent"]
+    
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.sample_id = None
+        self.rows = []
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        result_id, test_code, result_value, unit, lower_range, upper_range, sent = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return (test_code, str(result_value), unit, f"{lower_range} - {upper_range}",
+                    "Yes" if sent else "No")[index.column()]
+        if role == Qt.ItemDataRole.UserRole:
+            return result_id
+        if role == OUT_OF_RANGE_ROLE:
+            return result_value < lower_range or result_value > upper_range
+        return None
+    
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+    
+    def load(self, sample_id):
+        self.beginResetModel()
+        self.sample_id = sample_id
+        self.rows = self.engine.sample_results(sample_id) if sample_id is not None else []
+        self.endResetModel()
+    
+    def result_ids(self, rows=None):
+        return [self.rows[row][0] for row in (range(len(self.rows)) if rows is None else rows)]
+    
+    def mark_sent(self, result_ids):
+        """Flag shown results as sent, repainting only their Sent cells."""
+        result_ids = set(result_ids)
+        changed = [row for row, values in enumerate(self.rows) if values[0] in result_ids and not values[6]]
+        for row in changed:
+            self.rows[row] = (*self.rows[row][:6], 1)
+        if changed:
+            column = self.HEADERS.index("Sent")
+            self.dataChanged.emit(self.index(changed[0], column), self.index(changed[-1], column),
+                                  [Qt.ItemDataRole.DisplayRole])
+
+class OutOfRangeDelegate(QStyledItemDelegate):
+    """Paints cells flagged with OUT_OF_RANGE_ROLE on a dark red background."""
+    BACKGROUND = QColor(80, 0, 0)
+    
+    def initStyleOption(self, option, index):
+        super().initStyleOption(option, index)
+        if index.data(OUT_OF_RANGE_ROLE):
+            option.backgroundBrush = self.BACKGROUND
+
 class LabSimulator(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Laboratory Analyzer Simulator")
         self.setMinimumSize(1000, 700)
         
-        # Setup the database
-        self.create_database()
+        # Setup the engine and its database
+        self.engine = SimulatorEngine().open()
+        
+        # LIS sessions run on an asyncio loop in a background thread
+        self.io_thread = EventLoopThread().start()
+        self.session = None
+        self.session_signals = SessionSignals()
+        self.analysis_future = None
+        self.pipeline = None
+        self.pipeline_future = None
+        
+        # Database and generation work runs on a thread pool
+        self.job_pool = QThreadPool(self)
+        self.job_pool.setMaxThreadCount(2)
+        self.jobs = []
         
         # Setup the UI
         self.setup_ui()
@@ -27,112 +244,32 @@ class LabSimulator(QMainWindow):
         # Load analyzer list
         self.load_analyzers()
         
-    def create_database(self):
-        conn = sqlite3.connect('analyzersim.db')
-        cursor = conn.cursor()
-        
-        # Create analyzer table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS analyzers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE
-        )
-        ''')
-        
-        # Create connection settings table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS connection_settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            analyzer_id INTEGER,
-            connection_type TEXT,
-            socket_type TEXT,
-            analyzer_address TEXT,
-            analyzer_port TEXT,
-            lis_address TEXT,
-            lis_port TEXT,
-            serial_port TEXT,
-            baud_rate TEXT,
-            data_bits TEXT,
-            stop_bits TEXT,
-            parity TEXT,
-            auto_result_sending INTEGER,
-            request_sample_info INTEGER,
-            sample_id_delay INTEGER,
-            result_sending_delay INTEGER,
-            FOREIGN KEY (analyzer_id) REFERENCES analyzers(id)
-        )
-        ''')
-        
-        # Create ASTM message templates table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS astm_templates (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            analyzer_id INTEGER,
-            template_type TEXT,
-            template_content TEXT,
-            FOREIGN KEY (analyzer_id) REFERENCES analyzers(id)
-        )
-        ''')
-        
-        # Create tests table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            analyzer_id INTEGER,
-            test_code TEXT,
-            unit TEXT,
-            lower_range REAL,
-            upper_range REAL,
-            FOREIGN KEY (analyzer_id) REFERENCES analyzers(id)
-        )
-        ''')
-        
-        # Create samples table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS samples (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sample_number TEXT,
-            patient_id TEXT,
-            patient_name TEXT,
-            date_time TEXT
-        )
-        ''')
-        
-        # Create results table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sample_id INTEGER,
-            test_id INTEGER,
-            result_value REAL,
-            sent INTEGER DEFAULT 0,
-            FOREIGN KEY (sample_id) REFERENCES samples(id),
-            FOREIGN KEY (test_id) REFERENCES tests(id)
-        )
-        ''')
-        
-        # Insert some initial data if needed
-        cursor.execute("SELECT COUNT(*) FROM analyzers")
-        count = cursor.fetchone()[0]
-        if count == 0:
-            cursor.execute("INSERT INTO analyzers (name) VALUES ('Analyzer 1')")
-            cursor.execute("INSERT INTO analyzers (name) VALUES ('Analyzer 2')")
-            
-            # Insert some test examples
-            analyzer_id = 1
-            tests = [
-                ('Test_1', 'mmol/l', 0.5, 5.0),
-                ('Photo_reflex_test', 'mmol/l', 1.0, 5.5),
-                ('Photometric_test', 'mmol/l', 0.05, 1.2)
-            ]
-            for test in tests:
-                cursor.execute('''
-                INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range)
-                VALUES (?, ?, ?, ?, ?)
-                ''', (analyzer_id, test[0], test[1], test[2], test[3]))
-        
-        conn.commit()
-        conn.close()
+    def closeEvent(self, event):
+        for job in self.jobs:
+            job.cancel()
+        self.job_pool.waitForDone()
+        if self.analysis_future:
+            self.analysis_future.cancel()
+        self.stop_pipeline()
+        if self.session:
+            try:
+                self.io_thread.submit(self.session.close()).result(timeout=5)
+            except Exception:
+                pass
+        if self.mock_lis is not None:
+            try:
+                self.io_thread.submit(self.mock_lis.close()).result(timeout=5)
+            except Exception:
+                pass
+        if self.trace is not None:
+            self.trace.close()
+        self.io_thread.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.engine.close()
+        self.log_timer.stop()
+        self.log_buffer.close_file()
+        super().closeEvent(event)
     
     def setup_ui(self):
         # Set up main widget and layout
@@ -198,7 +335,7 @@ class LabSimulator(QMainWindow):
                 background-color: #333333;
                 border-bottom: 1px solid #333333;
             }
-            QLineEdit, QComboBox, QTableWidget, QTextEdit {
+            QLineEdit, QComboBox, QTableView, QTextEdit {
                 border: 1px solid #404040;
                 border-radius: 4px;
                 padding: 3px;
@@ -229,7 +366,7 @@ class LabSimulator(QMainWindow):
                 border: 1px solid #555555;
                 color: #ffffff;
             }
-            QTableWidget {
+            QTableView {
                 gridline-color: #555555;
             }
             QRadioButton {
@@ -255,15 +392,15 @@ class LabSimulator(QMainWindow):
         set_button.setFixedWidth(80)
         set_button.clicked.connect(self.set_analyzer)
         
-        connection_status = QLabel("LIS Connection Not Established")
-        connection_status.setFont(QFont("Arial", 8, QFont.Weight.Bold))
-        connection_status.setStyleSheet("color: #ff4444;")
+        self.connection_status = QLabel("LIS Connection Not Established")
+        self.connection_status.setFont(QFont("Arial", 8, QFont.Weight.Bold))
+        self.connection_status.setStyleSheet("color: #ff4444;")
         
         top_layout.addWidget(analyzer_label)
         top_layout.addWidget(self.analyzer_combo)
         top_layout.addWidget(set_button)
         top_layout.addStretch()
-        top_layout.addWidget(connection_status)
+        top_layout.addWidget(self.connection_status)
         
         self.main_layout.addWidget(top_widget)
         
@@ -271,14 +408,16 @@ class LabSimulator(QMainWindow):
         self.tab_widget = QTabWidget()
         self.main_layout.addWidget(self.tab_widget)
         
-        # Create the three tabs
+        # Create the tabs
         self.lis_tab = QWidget()
         self.sample_tab = QWidget()
         self.result_tab = QWidget()
+        self.metrics_tab = QWidget()
         
         self.tab_widget.addTab(self.lis_tab, "LIS")
         self.tab_widget.addTab(self.sample_tab, "Sample/Analyze")
         self.tab_widget.addTab(self.result_tab, "Results")
+        self.tab_widget.addTab(self.metrics_tab, "Metrics")
         
         # Setup LIS Tab
         self.setup_lis_tab()
@@ -289,20 +428,122 @@ class LabSimulator(QMainWindow):
         # Setup Results Tab
         self.setup_result_tab()
         
+        # Setup Metrics Tab
+        self.setup_metrics_tab()
+        
         # Add status bar for logs
         self.statusBar().showMessage("Ready")
         
+        # Progress of background jobs, shown only while one is running
+        self.job_label = QLabel()
+        self.job_progress = QProgressBar()
+        self.job_progress.setMaximumWidth(200)
+        self.job_cancel_button = QPushButton("Cancel")
+        self.job_cancel_button.clicked.connect(self.cancel_jobs)
+        for widget in (self.job_label, self.job_progress, self.job_cancel_button):
+            widget.setVisible(False)
+            self.statusBar().addPermanentWidget(widget)
+        
         # Add a log viewer at the bottom
         log_group = QGroupBox("Connection Logs")
         log_layout = QVBoxLayout(log_group)
         
-        self.log_text = QTextEdit()
+        log_filter_layout = QHBoxLayout()
+        log_filter_layout.addWidget(QLabel("Level:"))
+        self.log_level_combo = QComboBox()
+        for level in LEVELS:
+            self.log_level_combo.addItem(level.capitalize(), level)
+        self.log_level_combo.setCurrentIndex(LEVELS.index(INFO))
+        self.log_level_combo.currentIndexChanged.connect(self.refilter_log)
+        log_filter_layout.addWidget(self.log_level_combo)
+        log_filter_layout.addWidget(QLabel("Analyzer:"))
+        self.log_source_combo = QComboBox()
+        self.log_source_combo.addItem("All", None)
+        self.log_source_combo.addItem("Simulator", "")
+        self.log_source_combo.currentIndexChanged.connect(self.refilter_log)
+        log_filter_layout.addWidget(self.log_source_combo)
+        self.log_search = QLineEdit()
+        self.log_search.setPlaceholderText("Filter text")
+        self.log_search.textChanged.connect(self.refilter_log)
+        log_filter_layout.addWidget(self.log_search)
+        self.log_file_check = QCheckBox("Write JSON Lines")
+        self.log_file_check.setToolTip(f"Also write the log to {LOG_FILE_PATH}, rotated at 10 MB")
+        self.log_file_check.toggled.connect(self.toggle_log_file)
+        log_filter_layout.addWidget(self.log_file_check)
+        log_layout.addLayout(log_filter_layout)
+        
+        # Any thread appends to the buffer; the timer draws what arrived since
+        # its last tick in one go, and the view drops lines past the buffer size
+        self.log_buffer = LogBuffer()
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setMaximumHeight(150)
+        self.log_text.setMaximumBlockCount(self.log_buffer.capacity)
+        self.log_text.setUndoRedoEnabled(False)
         log_layout.addWidget(self.log_text)
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_REFRESH_INTERVAL)
         
         self.main_layout.addWidget(log_group)
         
+        # Always queued, so these arrive in order even when emitted on the GUI thread
+        queued = Qt.ConnectionType.QueuedConnection
+        self.session_signals.connected.connect(self.on_lis_connected, queued)
+        self.session_signals.sent.connect(self.on_results_sent, queued)
+        self.session_signals.auto_sent.connect(self.on_results_auto_sent, queued)
+        self.session_signals.sample_info.connect(self.on_sample_info_received, queued)
+        self.session_signals.samples_completed.connect(self.update_progress, queued)
+        self.session_signals.analysis_done.connect(self.on_analysis_done, queued)
+        
+    def log(self, message, level=INFO, source=""):
+        """Add a line to the connection log; safe to call from any thread."""
+        self.log_buffer.append(message, level, source)
+    
+    def log_filter(self):
+        text = self.log_search.text().strip()
+        return {
+            "level": self.log_level_combo.currentData(),
+            "source": self.log_source_combo.currentData(),
+            "text": text or None,
+        }
+    
+    def flush_log(self):
+        records = self.log_buffer.take_new()
+        if not records:
+            return
+        self.update_log_sources()
+        log_filter = self.log_filter()
+        records = [record for record in records if matches(record, **log_filter)]
+        if records:
+            self.log_text.appendPlainText("\n".join(format_record(record) for record in records))
+    
+    def refilter_log(self):
+        # Redraw everything kept, the lines not drawn yet included
+        self.log_buffer.take_new()
+        self.update_log_sources()
+        records = self.log_buffer.records(**self.log_filter())
+        self.log_text.setPlainText("\n".join(format_record(record) for record in records))
+        scroll_bar = self.log_text.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
+    
+    def update_log_sources(self):
+        known = {self.log_source_combo.itemData(index) for index in range(self.log_source_combo.count())}
+        for source in sorted(self.log_buffer.sources - known):
+            self.log_source_combo.addItem(source, source)
+    
+    def toggle_log_file(self, enabled):
+        if not enabled:
+            self.log_buffer.close_file()
+            return
+        try:
+            self.log_buffer.open_file(LOG_FILE_PATH)
+        except OSError as e:
+            self.log_file_check.setChecked(False)
+            QMessageBox.critical(self, "Error", f"Failed to open {LOG_FILE_PATH}: {str(e)}")
+            return
+        self.log(f"Writing the log to {LOG_FILE_PATH}")
+    
     def setup_lis_tab(self):
         lis_layout = QHBoxLayout(self.lis_tab)
         
@@ -364,6 +605,7 @@ class LabSimulator(QMainWindow):
         # Serial port
         self.serial_port = QComboBox()
         self.serial_port.addItems(["COM1", "COM2", "COM3"])
+        self.serial_port.setEditable(True)  # Device paths such as /dev/ttyUSB0
         serial_layout.addRow("Serial Port:", self.serial_port)
         
         # Baud rate
@@ -421,6 +663,17 @@ class LabSimulator(QMainWindow):
         connect_button.clicked.connect(self.connect_to_lis)
         left_layout.addWidget(connect_button)
         
+        # A local stand-in LIS on the endpoint of the settings above
+        self.mock_lis = None
+        self.mock_lis_button = QPushButton("Start Mock LIS")
+        self.mock_lis_button.clicked.connect(self.toggle_mock_lis)
+        left_layout.addWidget(self.mock_lis_button)
+        
+        # Record the bytes of each connection for "python -m analyzersim replay"
+        self.trace = None
+        self.record_trace_check = QCheckBox("Record Session Trace")
+        left_layout.addWidget(self.record_trace_check)
+        
         left_layout.addStretch()
         
         # Right side - ASTM Message Templates
@@ -434,9 +687,9 @@ class LabSimulator(QMainWindow):
         sample_info_tab = QWidget()
         sample_info_layout = QVBoxLayout(sample_info_tab)
         
-        sample_info_text = QTextEdit()
-        sample_info_text.setPlaceholderText("Enter ASTM message template for sample info request...")
-        sample_info_text.setText("Send: <ENQ>\nRead: <ACK>\n\nSend: <STX>1H|\\^&|||1^Analyzer_1^|||||||||P||20101118101825<CR><ETX>A1\nRead: <ACK>\n\nSend: <STX>2Q|1|^SampleID_03^^||^^^ALL^||||||O<CR><ETX>FF\n\nRead: <ACK>\n\nSend: <STX>3L|1|N<CR><ETX>06\n\nRead: <ACK>\n\nSend: < EOT >")
+        self.sample_info_text = QTextEdit()
+        self.sample_info_text.setPlaceholderText("Enter ASTM message template for sample info request...")
+        self.sample_info_text.setText(DEFAULT_TEMPLATES["sample_info"])
         
         # Field selector UI for sample info
         field_group = QGroupBox("Add Field")
@@ -456,16 +709,16 @@ class LabSimulator(QMainWindow):
         add_field_button = QPushButton("Add")
         field_layout.addWidget(add_field_button)
         
-        sample_info_layout.addWidget(sample_info_text)
+        sample_info_layout.addWidget(self.sample_info_text)
         sample_info_layout.addWidget(field_group)
         
         # Result Sending Template Tab
         result_send_tab = QWidget()
         result_send_layout = QVBoxLayout(result_send_tab)
         
-        result_send_text = QTextEdit()
-        result_send_text.setPlaceholderText("Enter ASTM message template for result sending...")
-        result_send_text.setText("send: <ENQ>\nread: <ACK>\nsend: <STX>1H]\\Aé|[]1 Analyzer 1^7.0]||||||||P|]20190801124640<CR><EXT>E4\nread: <ACK>\n\nsend: <STX>2P|1|PatientID_07|||Patient Name_7|||U|||||||||||||||||||<CR><EXT>67\nread: <ACK>\n\nsend: <STX>3O|1|SampleID_07^0.0^5^1|||^^^Test_1^0.0|R||||||X|||3|||||||1|F<CR><EXT>2C\nread: <ACK>\n\nsend: <STX>4R|1|^^^Test_1^0.0|2.4|mmol/l||N||F||<root user>||20190801124608|Analyzer 1<CR><EXT>3F\nread: <ACK>\n\nsend: <STX>5O|2|SampleID_07^0.0^5^1|||^^^Photo_reflex_test^0.0|R||||||X|||3|||||||1|F<CR><EXT>0D\nread: <ACK>\n\nsend: <STX>6R|1|^^^Photo_reflex_test^0.0|3.205|mmol/l||N||F||<root user>||20190801124606|Analyzer 1<CR><EXT>81\nread: <ACK>\n\nsend: <STX>7O|3|SampleID_07^0.0^5^1|||^^^Photometric_test^0.0|R||||||X|||3|||||||1|F<CR><EXT>AF\nread: <ACK>\n\nsend: <STX>0R|1|^^^Photometric_test^0.0|0.06|mmol/l||N||F||<root user>||20190801124607|Analyzer 1<CR><EXT>E7\nread: <ACK>\n\nsend: <STX>1L|1|N<CR><EXT>04\nread")
+        self.result_send_text = QTextEdit()
+        self.result_send_text.setPlaceholderText("Enter ASTM message template for result sending...")
+        self.result_send_text.setText(DEFAULT_TEMPLATES["result_send"])
         
         # Field selector UI for result sending
         result_field_group = QGroupBox("Add Field")
@@ -485,7 +738,7 @@ class LabSimulator(QMainWindow):
         result_add_field_button = QPushButton("Add")
         result_field_layout.addWidget(result_add_field_button)
         
-        result_send_layout.addWidget(result_send_text)
+        result_send_layout.addWidget(self.result_send_text)
         result_send_layout.addWidget(result_field_group)
         
         # Add tabs to the ASTM templates tab widget
@@ -499,10 +752,19 @@ class LabSimulator(QMainWindow):
         test_layout = QVBoxLayout(test_group)
         
         self.test_table = QTableWidget()
-        self.test_table.setColumnCount(4)
-        self.test_table.setHorizontalHeaderLabels(["Test Code", "Unit", "Lower Range", "Upper Range"])
+        self.test_table.setColumnCount(5)
+        self.test_table.setHorizontalHeaderLabels(["Test Code", "Unit", "Lower Range", "Upper Range", "Cycle Time (s)"])
         self.test_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         
+        # Throughput of the analyzer
+        throughput_layout = QFormLayout()
+        self.channels = QLineEdit("1")
+        self.channels.setPlaceholderText("Parallel cuvettes or channels")
+        throughput_layout.addRow("Channels:", self.channels)
+        self.tests_per_hour = QLineEdit()
+        self.tests_per_hour.setPlaceholderText("Rated tests per hour (optional)")
+        throughput_layout.addRow("Tests/Hour:", self.tests_per_hour)
+        
         test_button_layout = QHBoxLayout()
         add_test_button = QPushButton("Add Test")
         add_test_button.clicked.connect(self.add_test)
@@ -516,6 +778,7 @@ class LabSimulator(QMainWindow):
         test_button_layout.addWidget(delete_test_button)
         
         test_layout.addWidget(self.test_table)
+        test_layout.addLayout(throughput_layout)
         test_layout.addLayout(test_button_layout)
         
         right_layout.addWidget(test_group)
@@ -539,8 +802,8 @@ class LabSimulator(QMainWindow):
         self.client_radio.toggled.connect(self.toggle_socket_type)
         
         # Connect field selector buttons
-        add_field_button.clicked.connect(lambda: self.add_field(field_selector, field_text, field_direction, sample_info_text))
-        result_add_field_button.clicked.connect(lambda: self.add_field(result_field_selector, result_field_text, result_field_direction, result_send_text))
+        add_field_button.clicked.connect(lambda: self.add_field(field_selector, field_text, field_direction, self.sample_info_text))
+        result_add_field_button.clicked.connect(lambda: self.add_field(result_field_selector, result_field_text, result_field_direction, self.result_send_text))
         
         LabSimulator.toggle_socket_type(self)
         
@@ -572,6 +835,11 @@ class LabSimulator(QMainWindow):
         add_sample_button = QPushButton("Add More Samples")
         add_sample_button.clicked.connect(self.add_sample_input)
         sample_input_layout.addWidget(add_sample_button)
+        
+        # Large worklists go straight to the database without input rows
+        import_button = QPushButton("Import Worklist...")
+        import_button.clicked.connect(self.import_worklist)
+        sample_input_layout.addWidget(import_button)
 
         # Now set the layout on the group box
         sample_group.setLayout(sample_input_layout)
@@ -585,7 +853,21 @@ class LabSimulator(QMainWindow):
         start_button.setIconSize(QSize(24, 24))
         start_button.setStyleSheet("font-size: 16px; padding: 10px;")
         start_button.clicked.connect(self.start_analysis)
-        sample_layout.addWidget(start_button)
+        
+        # Simulated seconds per real second; None runs as fast as possible
+        self.speed_combo = QComboBox()
+        for text, speed in (("Real Time", 1.0), ("10x", 10.0), ("100x", 100.0), ("As Fast As Possible", None)):
+            self.speed_combo.addItem(text, speed)
+        
+        stop_button = QPushButton("Stop")
+        stop_button.clicked.connect(self.stop_analysis)
+        
+        start_layout = QHBoxLayout()
+        start_layout.addWidget(start_button, 1)
+        start_layout.addWidget(QLabel("Speed:"))
+        start_layout.addWidget(self.speed_combo)
+        start_layout.addWidget(stop_button)
+        sample_layout.addLayout(start_layout)
         
         # Progress section
         progress_group = QGroupBox("Analysis Progress")
@@ -638,12 +920,13 @@ class LabSimulator(QMainWindow):
         sample_list_group = QGroupBox("Samples")
         sample_list_layout = QVBoxLayout(sample_list_group)
         
-        self.sample_list = QTableWidget()
-        self.sample_list.setColumnCount(3)
-        self.sample_list.setHorizontalHeaderLabels(["Sample No.", "Patient ID", "Patient Name"])
+        self.sample_model = SampleListModel(self.engine, self)
+        self.sample_list = QTableView()
+        self.sample_list.setModel(self.sample_model)
+        self.sample_list.verticalHeader().setDefaultSectionSize(24)  # Fixed heights keep scrolling cheap
         self.sample_list.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        self.sample_list.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.sample_list.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
+        self.sample_list.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.sample_list.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
         self.sample_list.selectionModel().selectionChanged.connect(self.load_sample_results)
         
         sample_list_layout.addWidget(self.sample_list)
@@ -652,9 +935,10 @@ class LabSimulator(QMainWindow):
         result_details_group = QGroupBox("Results")
         result_details_layout = QVBoxLayout(result_details_group)
         
-        self.result_table = QTableWidget()
-        self.result_table.setColumnCount(5)
-        self.result_table.setHorizontalHeaderLabels(["Test Code", "Result", "Unit", "Normal Range", "Sent"])
+        self.result_model = ResultTableModel(self.engine, self)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
+        self.result_table.setItemDelegate(OutOfRangeDelegate(self.result_table))
         self.result_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
         
         result_details_layout.addWidget(self.result_table)
@@ -668,8 +952,18 @@ class LabSimulator(QMainWindow):
         send_all_button = QPushButton("Send All Results")
         send_all_button.clicked.connect(self.send_all_results)
         
+        send_unsent_button = QPushButton("Send All Unsent")
+        send_unsent_button.setToolTip("Send every unsent result of the analyzer")
+        send_unsent_button.clicked.connect(self.send_unsent_results)
+        
         button_layout.addWidget(send_selected_button)
         button_layout.addWidget(send_all_button)
+        button_layout.addWidget(send_unsent_button)
+        
+        export_button = QPushButton("Export Results...")
+        export_button.setToolTip("Write every result of the analyzer to a file")
+        export_button.clicked.connect(self.export_results)
+        button_layout.addWidget(export_button)
         
         result_details_layout.addLayout(button_layout)
         
@@ -678,13 +972,91 @@ class LabSimulator(QMainWindow):
         splitter.addWidget(result_details_group)
         splitter.setSizes([300, 700])  # Initial sizes
         
+    def setup_metrics_tab(self):
+        metrics_layout = QVBoxLayout(self.metrics_tab)
+        
+        # Prometheus endpoint, for watching long runs from outside
+        endpoint_layout = QHBoxLayout()
+        endpoint_layout.addWidget(QLabel("Prometheus Port:"))
+        self.metrics_port = QLineEdit(str(DEFAULT_METRICS_PORT))
+        self.metrics_port.setMaximumWidth(80)
+        endpoint_layout.addWidget(self.metrics_port)
+        self.metrics_server_button = QPushButton("Start Endpoint")
+        self.metrics_server_button.clicked.connect(self.toggle_metrics_server)
+        endpoint_layout.addWidget(self.metrics_server_button)
+        self.metrics_url_label = QLabel()
+        endpoint_layout.addWidget(self.metrics_url_label)
+        endpoint_layout.addStretch()
+        metrics_layout.addLayout(endpoint_layout)
+        
+        self.metrics_table = QTableWidget(0, 7)
+        self.metrics_table.setHorizontalHeaderLabels(["Metric", "Labels", "Value", "Per Second", "p50", "p99", "Max"])
+        self.metrics_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.metrics_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.metrics_table.verticalHeader().setVisible(False)
+        metrics_layout.addWidget(self.metrics_table)
+        
+        self.metrics_server = None
+        # Previous (value, time) of every counter, for the per-second column
+        self.metric_rates = {}
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.refresh_metrics)
+        self.metrics_timer.start(1000)
+    
+    def refresh_metrics(self):
+        # Collecting queries the outbox, so only do it while the tab is shown
+        if self.tab_widget.currentWidget() is not self.metrics_tab:
+            return
+        now = time.monotonic()
+        rows = []
+        for name, kind, labels, metric in REGISTRY.samples():
+            label_text = ", ".join(f"{label}={value}" for label, value in labels.items())
+            key = (name, label_text)
+            if kind == "histogram":
+                value = metric.count
+                quantiles = [f"{seconds * 1000:.3f} ms" for seconds in
+                             (metric.percentile(0.5), metric.percentile(0.99), metric.max)]
+            else:
+                value = metric.value
+                quantiles = ["", "", ""]
+            rate = ""
+            if kind != "gauge":
+                previous = self.metric_rates.get(key)
+                if previous is not None and now > previous[1]:
+                    rate = f"{(value - previous[0]) / (now - previous[1]):.1f}"
+                self.metric_rates[key] = (value, now)
+            rows.append((name.removeprefix("analyzersim_"), label_text, str(value), rate, *quantiles))
+        
+        self.metrics_table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, text in enumerate(values):
+                item = self.metrics_table.item(row, column)
+                if item is None:
+                    self.metrics_table.setItem(row, column, QTableWidgetItem(text))
+                elif item.text() != text:
+                    item.setText(text)
+    
+    def toggle_metrics_server(self):
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+            self.metrics_server_button.setText("Start Endpoint")
+            self.metrics_url_label.setText("")
+            return
+        
+        try:
+            self.metrics_server = MetricsServer(port=int(self.metrics_port.text())).start()
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, "Error", f"Failed to start the metrics endpoint: {str(e)}")
+            return
+        host, port = self.metrics_server.address
+        self.metrics_server_button.setText("Stop Endpoint")
+        self.metrics_url_label.setText(f"http://{host}:{port}/metrics")
+        self.log(f"Serving Prometheus metrics at http://{host}:{port}/metrics")
+    
     def load_analyzers(self):
         try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, name FROM analyzers")
-            analyzers = cursor.fetchall()
-            conn.close()
+            analyzers = self.engine.analyzers()
             
             self.analyzer_combo.clear()
             for analyzer in analyzers:
@@ -696,71 +1068,47 @@ class LabSimulator(QMainWindow):
         analyzer_id = self.analyzer_combo.currentData()
         analyzer_name = self.analyzer_combo.currentText()
         try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT connection_type, socket_type, analyzer_address, analyzer_port, 
-                       lis_address, lis_port, serial_port, baud_rate, data_bits, 
-                       stop_bits, parity, auto_result_sending, request_sample_info,
-                       sample_id_delay, result_sending_delay 
-                FROM connection_settings 
-                WHERE analyzer_id = ?
-            """, (analyzer_id,))
-            
-            settings = cursor.fetchone()
+            settings = self.engine.connection_settings(analyzer_id)
             if settings:
-                if settings[0] == "TCP/IP":
+                if settings.is_tcp:
                     self.tcp_radio.setChecked(True)
-                    if settings[1] == "Server":
+                    if settings.is_server:
                         self.server_radio.setChecked(True)
                     else:
                         self.client_radio.setChecked(True)
-                    self.analyzer_address.setText(settings[2] or "")
-                    self.analyzer_port.setText(settings[3] or "")
-                    self.lis_address.setText(settings[4] or "")
-                    self.lis_port.setText(settings[5] or "")
+                    self.analyzer_address.setText(settings.analyzer_address)
+                    self.analyzer_port.setText(str(settings.analyzer_port))
+                    self.lis_address.setText(settings.lis_address)
+                    self.lis_port.setText(str(settings.lis_port))
                 else:
                     self.serial_radio.setChecked(True)
-                    self.serial_port.setCurrentText(settings[6] or "COM1")
-                    self.baud_rate.setText(settings[7] or "9600")
-                    self.data_bits.setText(settings[8] or "8")
-                    self.stop_bits.setText(settings[9] or "1")
-                    self.parity.setCurrentText(settings[10] or "No")
+                    self.serial_port.setCurrentText(settings.serial_port)
+                    self.baud_rate.setText(str(settings.baud_rate))
+                    self.data_bits.setText(str(settings.data_bits))
+                    self.stop_bits.setText(str(settings.stop_bits))
+                    self.parity.setCurrentText(settings.parity)
                 
-                self.auto_result.setChecked(bool(settings[11]))
-                self.request_sample.setChecked(bool(settings[12]))
-                self.sample_delay.setText(str(settings[13] or "0"))
-                self.result_delay.setText(str(settings[14] or "0"))
-            
-            cursor.execute("""
-                SELECT template_type, template_content 
-                FROM astm_templates 
-                WHERE analyzer_id = ?
-            """, (analyzer_id,))
-            
-            templates = cursor.fetchall()
-            for template in templates:
-                if template[0] == "sample_info":
-                    pass
-                elif template[0] == "result_send":
-                    pass
+                self.auto_result.setChecked(settings.auto_result_sending)
+                self.request_sample.setChecked(settings.request_sample_info)
+                self.sample_delay.setText(str(settings.sample_id_delay))
+                self.result_delay.setText(str(settings.result_sending_delay))
             
-            cursor.execute("""
-                SELECT test_code, unit, lower_range, upper_range 
-                FROM tests 
-                WHERE analyzer_id = ?
-            """, (analyzer_id,))
+            templates = self.engine.templates(analyzer_id)
+            self.sample_info_text.setPlainText(templates.get("sample_info") or DEFAULT_TEMPLATES["sample_info"])
+            self.result_send_text.setPlainText(templates.get("result_send") or DEFAULT_TEMPLATES["result_send"])
             
-            tests = cursor.fetchall()
+            tests = [test[1:] for test in self.engine.tests(analyzer_id)]
             self.test_table.setRowCount(len(tests))
             for i, test in enumerate(tests):
                 self.test_table.setItem(i, 0, QTableWidgetItem(test[0]))
                 self.test_table.setItem(i, 1, QTableWidgetItem(test[1]))
                 self.test_table.setItem(i, 2, QTableWidgetItem(str(test[2])))
                 self.test_table.setItem(i, 3, QTableWidgetItem(str(test[3])))
+                self.test_table.setItem(i, 4, QTableWidgetItem(str(test[4])))
             
-            conn.close()
+            throughput = self.engine.throughput(analyzer_id)
+            self.channels.setText(str(throughput.channels))
+            self.tests_per_hour.setText(str(throughput.tests_per_hour or ""))
             
             QMessageBox.information(self, "Success", f"Analyzer '{analyzer_name}' selected successfully")
             
@@ -792,6 +1140,25 @@ class LabSimulator(QMainWindow):
         else:
             target.append(f"{dir_text}: {field} {content}")
     
+    def connection_settings_from_ui(self):
+        return ConnectionSettings(
+            connection_type="TCP/IP" if self.tcp_radio.isChecked() else "Serial",
+            socket_type="Server" if self.server_radio.isChecked() else "Client",
+            analyzer_address=self.analyzer_address.text(),
+            analyzer_port=self.analyzer_port.text(),
+            lis_address=self.lis_address.text(),
+            lis_port=self.lis_port.text(),
+            serial_port=self.serial_port.currentText(),
+            baud_rate=self.baud_rate.text(),
+            data_bits=self.data_bits.text(),
+            stop_bits=self.stop_bits.text(),
+            parity=self.parity.currentText(),
+            auto_result_sending=self.auto_result.isChecked(),
+            request_sample_info=self.request_sample.isChecked(),
+            sample_id_delay=self.sample_delay.text(),
+            result_sending_delay=self.result_delay.text(),
+        )
+    
     def save_connection_settings(self):
         analyzer_id = self.analyzer_combo.currentData()
         if not analyzer_id:
@@ -799,57 +1166,8 @@ class LabSimulator(QMainWindow):
             return
         
         try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT id FROM connection_settings WHERE analyzer_id = ?", (analyzer_id,))
-            existing = cursor.fetchone()
-            
-            connection_type = "TCP/IP" if self.tcp_radio.isChecked() else "Serial"
-            socket_type = "Server" if self.server_radio.isChecked() else "Client"
-            analyzer_address = self.analyzer_address.text()
-            analyzer_port = self.analyzer_port.text()
-            lis_address = self.lis_address.text()
-            lis_port = self.lis_port.text()
-            serial_port = self.serial_port.currentText()
-            baud_rate = self.baud_rate.text()
-            data_bits = self.data_bits.text()
-            stop_bits = self.stop_bits.text()
-            parity = self.parity.currentText()
-            auto_result = 1 if self.auto_result.isChecked() else 0
-            request_sample = 1 if self.request_sample.isChecked() else 0
-            sample_delay = self.sample_delay.text()
-            result_delay = self.result_delay.text()
-            
-            if existing:
-                cursor.execute("""
-                    UPDATE connection_settings 
-                    SET connection_type = ?, socket_type = ?, analyzer_address = ?,
-                        analyzer_port = ?, lis_address = ?, lis_port = ?,
-                        serial_port = ?, baud_rate = ?, data_bits = ?,
-                        stop_bits = ?, parity = ?, auto_result_sending = ?,
-                        request_sample_info = ?, sample_id_delay = ?,
-                        result_sending_delay = ?
-                    WHERE analyzer_id = ?
-                """, (connection_type, socket_type, analyzer_address, analyzer_port,
-                     lis_address, lis_port, serial_port, baud_rate, data_bits,
-                     stop_bits, parity, auto_result, request_sample,
-                     sample_delay, result_delay, analyzer_id))
-            else:
-                cursor.execute("""
-                    INSERT INTO connection_settings 
-                    (analyzer_id, connection_type, socket_type, analyzer_address,
-                     analyzer_port, lis_address, lis_port, serial_port, baud_rate,
-                     data_bits, stop_bits, parity, auto_result_sending,
-                     request_sample_info, sample_id_delay, result_sending_delay)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (analyzer_id, connection_type, socket_type, analyzer_address,
-                     analyzer_port, lis_address, lis_port, serial_port, baud_rate,
-                     data_bits, stop_bits, parity, auto_result, request_sample,
-                     sample_delay, result_delay))
-            
-            conn.commit()
-            conn.close()
+            settings = self.connection_settings_from_ui()
+            self.engine.save_connection_settings(analyzer_id, settings)
             
             QMessageBox.information(self, "Success", "Connection settings saved successfully")
             
@@ -863,24 +1181,32 @@ class LabSimulator(QMainWindow):
             return
         
         try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("DELETE FROM tests WHERE analyzer_id = ?", (analyzer_id,))
-            
+            tests = []
             for row in range(self.test_table.rowCount()):
                 test_code = self.test_table.item(row, 0).text()
                 unit = self.test_table.item(row, 1).text()
                 lower_range = float(self.test_table.item(row, 2).text())
                 upper_range = float(self.test_table.item(row, 3).text())
-                
-                cursor.execute("""
-                    INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (analyzer_id, test_code, unit, lower_range, upper_range))
+                cycle_time = float(self.test_table.item(row, 4).text())
+                tests.append((test_code, unit, lower_range, upper_range, cycle_time))
+            
+            channels = int(self.channels.text())
+            tests_per_hour = int(self.tests_per_hour.text() or 0)
             
-            conn.commit()
-            conn.close()
+            removed = self.engine.removed_test_results(analyzer_id, [test[0] for test in tests])
+            if removed:
+                reply = QMessageBox.question(self, "Confirm Delete",
+                                             f"Tests no longer in the list have {removed} results, "
+                                             f"which will be deleted with them. Save anyway?",
+                                             QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                                             QMessageBox.StandardButton.No)
+                if reply != QMessageBox.StandardButton.Yes:
+                    return
+            
+            self.engine.save_configuration(analyzer_id, templates={
+                "sample_info": self.sample_info_text.toPlainText(),
+                "result_send": self.result_send_text.toPlainText(),
+            }, tests=tests, channels=channels, tests_per_hour=tests_per_hour)
             
             QMessageBox.information(self, "Success", "Templates and test data saved successfully")
             
@@ -894,6 +1220,7 @@ class LabSimulator(QMainWindow):
         self.test_table.setItem(row, 1, QTableWidgetItem("Unit"))
         self.test_table.setItem(row, 2, QTableWidgetItem("0.0"))
         self.test_table.setItem(row, 3, QTableWidgetItem("0.0"))
+        self.test_table.setItem(row, 4, QTableWidgetItem("60.0"))
     
     def edit_test(self):
         selected = self.test_table.selectedItems()
@@ -960,9 +1287,143 @@ class LabSimulator(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please select an analyzer first")
             return
         
-        self.log_text.append("Connecting to LIS...")
-        QTimer.singleShot(1000, lambda: self.log_text.append("Connected successfully"))
+        try:
+            settings = self.connection_settings_from_ui()
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        
+        self.stop_pipeline()
+        if self.session:
+            self.io_thread.submit(self.session.close())
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+        
+        name = self.analyzer_combo.currentText()
+        try:
+            if self.record_trace_check.isChecked():
+                self.trace = TraceWriter(time.strftime("analyzersim-%Y%m%d-%H%M%S.trace"))
+            transport = open_transport(settings, trace=self.trace, name=name)
+        except (ValueError, OSError) as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        if self.trace is not None:
+            self.log(f"Recording the session in {self.trace.path}")
+        
+        # Sessions prefix their messages with the name, which the log shows as the source
+        session_log = lambda message: self.log(message.removeprefix(f"{name}: "), source=name)
+        self.session = AnalyzerSession(name, transport, log=session_log)
+        if settings.auto_result_sending:
+            # Results are sent as they are generated, after the result sending delay
+            self.pipeline = ResultPipeline(
+                self.engine, analyzer_id, self.session, settings.result_delay_seconds,
+                on_sent=self.session_signals.auto_sent.emit,
+                template_text=self.result_send_text.toPlainText(),
+                log=session_log,
+            )
+        self.log("Connecting to LIS...")
+        self.statusBar().showMessage("Connecting")
+        
+        future = self.io_thread.submit(self.session.open())
+        future.add_done_callback(lambda f: self.session_signals.connected.emit(future_error(f)))
+    
+    def toggle_mock_lis(self):
+        if self.mock_lis is not None:
+            self.io_thread.submit(self.mock_lis.close())
+            summary = self.mock_lis.summary()
+            self.mock_lis = None
+            self.mock_lis_button.setText("Start Mock LIS")
+            self.log(f"Mock LIS stopped after {summary['messages']} messages, {summary['results']} results")
+            return
+        
+        try:
+            settings = self.connection_settings_from_ui()
+        except ValueError as e:
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        
+        mock_lis = MockLIS(log=lambda message: self.log(message.removeprefix("mock-lis: "), source="mock-lis"))
+        try:
+            self.io_thread.submit(mock_lis.serve(settings)).result(timeout=5)
+        except (OSError, TransportError) as e:
+            QMessageBox.critical(self, "Error", f"Failed to start the mock LIS: {str(e)}")
+            return
+        self.mock_lis = mock_lis
+        self.mock_lis_button.setText("Stop Mock LIS")
+    
+    def on_lis_connected(self, error):
+        if error:
+            self.log(f"Connection failed: {error}", ERROR)
+            self.statusBar().showMessage("Not connected")
+            return
+        
+        self.log("Connected successfully")
         self.statusBar().showMessage("Connected")
+        self.connection_status.setText("LIS Connected")
+        self.connection_status.setStyleSheet("color: #44ff44;")
+        
+        if self.pipeline:
+            self.pipeline_future = self.io_thread.submit(self.pipeline.run())
+            self.log("Automatic result sending enabled")
+    
+    def stop_pipeline(self):
+        if self.pipeline_future:
+            self.pipeline_future.cancel()
+        self.pipeline = None
+        self.pipeline_future = None
+    
+    def run_job(self, description, function, *args, on_finished=None):
+        """Run ``function(job, *args)`` in the background; ``on_finished(result)`` gets its result."""
+        job = Job(description, function, *args)
+        queued = Qt.ConnectionType.QueuedConnection
+        job.signals.progress.connect(lambda done, total: self.on_job_progress(job, done, total), queued)
+        job.signals.finished.connect(lambda result: self.on_job_done(job, result, on_finished), queued)
+        job.signals.failed.connect(lambda error: self.on_job_failed(job, error), queued)
+        job.signals.cancelled.connect(lambda: self.on_job_cancelled(job), queued)
+        self.jobs.append(job)
+        self.show_job_status()
+        self.job_pool.start(job)
+        return job
+    
+    def cancel_jobs(self):
+        for job in self.jobs:
+            job.cancel()
+    
+    def show_job_status(self):
+        running = bool(self.jobs)
+        for widget in (self.job_label, self.job_progress, self.job_cancel_button):
+            widget.setVisible(running)
+        if running:
+            self.job_label.setText(self.jobs[-1].description.capitalize() + "...")
+            self.job_progress.setRange(0, 0)  # Busy until the first progress report
+    
+    def on_job_progress(self, job, done, total):
+        if job is self.jobs[-1]:
+            self.job_progress.setRange(0, total)
+            self.job_progress.setValue(done)
+            self.statusBar().showMessage(f"{job.description.capitalize()}: {done} of {total}")
+    
+    def finish_job(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+        self.show_job_status()
+    
+    def on_job_done(self, job, result, on_finished):
+        self.finish_job(job)
+        self.statusBar().showMessage("Ready")
+        if on_finished:
+            on_finished(result)
+    
+    def on_job_failed(self, job, error):
+        self.finish_job(job)
+        self.statusBar().showMessage("Ready")
+        QMessageBox.critical(self, "Error", f"Failed to {job.description}: {error}")
+    
+    def on_job_cancelled(self, job):
+        self.finish_job(job)
+        self.statusBar().showMessage("Cancelled")
+        self.log(f"Cancelled: {job.description}", WARNING)
     
     def start_analysis(self):
         sample_ids = []
@@ -986,245 +1447,241 @@ class LabSimulator(QMainWindow):
             QMessageBox.warning(self, "Warning", "Please enter at least one sample ID")
             return
         
-        self.store_samples(sample_ids, patient_ids, patient_names)
-        self.generate_results(sample_ids)
-        self.load_sample_list()
+        if self.analysis_future and not self.analysis_future.done():
+            QMessageBox.warning(self, "Warning", "An analysis is already running")
+            return
+        
+        self.analyze_samples(list(zip(sample_ids, patient_ids, patient_names)))
         
         self.progress_bar.setMaximum(len(sample_ids))
         self.progress_bar.setValue(0)
-        
-        self.current_sample_index = 0
-        self.progress_timer = QTimer()
-        self.progress_timer.timeout.connect(lambda: self.update_progress(sample_ids))
-        self.progress_timer.start(1000)
+        self.current_sample_label.setText("Loading")
         
         QMessageBox.information(self, "Started", "Analysis started for {} samples".format(len(sample_ids)))
     
-    def update_progress(self, sample_ids):
-        if self.current_sample_index < len(sample_ids):
-            self.progress_bar.setValue(self.current_sample_index + 1)
-            self.current_sample_label.setText(sample_ids[self.current_sample_index])
-            self.current_sample_index += 1
-        else:
-            self.progress_timer.stop()
-            self.current_sample_label.setText("Completed")
-            QMessageBox.information(self, "Completed", "Analysis completed for all samples")
+    def import_worklist(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Import Worklist", "",
+            "Worklists (*.csv *.tsv *.tab *.txt *.jsonl *.ndjson);;All Files (*)",
+        )
+        if not path:
+            return
+        
+        sample_ids = []
+        self.run_job(
+            "import worklist",
+            # Progress in KiB keeps large files within the signal's int range
+            lambda job: self.engine.import_worklist(
+                path,
+                progress=lambda done, total: job.progress(done // 1024, total // 1024),
+                on_batch=sample_ids.extend,
+            ),
+            on_finished=lambda count: self.on_worklist_imported(sample_ids),
+        )
     
-    def store_samples(self, sample_ids, patient_ids, patient_names):
-        try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            for i, sample_id in enumerate(sample_ids):
-                cursor.execute("SELECT id FROM samples WHERE sample_number = ?", (sample_id,))
-                existing = cursor.fetchone()
-                
-                patient_id = patient_ids[i] if i < len(patient_ids) else ""
-                patient_name = patient_names[i] if i < len(patient_names) else ""
-                
-                if existing:
-                    cursor.execute("""
-                        UPDATE samples SET
-                        patient_id = ?,
-                        patient_name = ?,
-                        date_time = ?
-                        WHERE sample_number = ?
-                    """, (patient_id, patient_name, now, sample_id))
-                else:
-                    cursor.execute("""
-                        INSERT INTO samples
-                        (sample_number, patient_id, patient_name, date_time)
-                        VALUES (?, ?, ?, ?)
-                    """, (sample_id, patient_id, patient_name, now))
-            
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to store samples: {str(e)}")
+    def on_worklist_imported(self, sample_ids):
+        self.log(f"Imported {len(sample_ids)} samples from the worklist")
+        busy = self.analysis_future and not self.analysis_future.done()
+        if not sample_ids or busy or QMessageBox.question(
+            self, "Worklist Imported", f"Analyze the {len(sample_ids)} imported samples now?"
+        ) != QMessageBox.StandardButton.Yes:
+            self.load_sample_list()
+            return
+        
+        self.progress_bar.setMaximum(len(sample_ids))
+        self.progress_bar.setValue(0)
+        self.current_sample_label.setText("Loading")
+        self.on_samples_stored(sample_ids)
+    
+    def analyze_samples(self, samples):
+        sample_ids = [sample[0] for sample in samples]
+        self.run_job(
+            "store samples",
+            lambda job: self.engine.store_samples(samples, progress=job.progress),
+            on_finished=lambda result: self.on_samples_stored(sample_ids),
+        )
     
-    def generate_results(self, sample_ids):
+    def on_samples_stored(self, sample_ids):
+        self.log(f"Stored {len(sample_ids)} samples")
+        query = self.request_sample_info(sample_ids) if self.request_sample.isChecked() else None
+        self.load_sample_list()
+        
+        # Results appear as the simulated analyzer finishes each sample
+        analyzer_id = self.analyzer_combo.currentData()
+        speed = self.speed_combo.currentData()
+        pipeline = self.pipeline
+        
+        def on_complete(batch, results):
+            self.session_signals.samples_completed.emit(batch, results)
+            if pipeline:
+                pipeline.submit(batch)
+        
+        async def analyze():
+            if query is not None:
+                # Wait for the LIS's orders so the samples only get the tests it requested;
+                # a failed query is reported on its own and the full panel is run
+                await asyncio.wait([asyncio.wrap_future(query)])
+            return await self.engine.run_analysis(analyzer_id, sample_ids, speed, on_complete=on_complete)
+        
+        self.analysis_future = self.io_thread.submit(analyze())
+        self.analysis_future.add_done_callback(
+            lambda f: self.session_signals.analysis_done.emit(
+                *(f.result() if not future_error(f) else (0, 0.0)), future_error(f))
+        )
+    
+    def stop_analysis(self):
+        if self.analysis_future:
+            self.analysis_future.cancel()
+    
+    def update_progress(self, sample_ids, results):
+        self.progress_bar.setValue(self.progress_bar.value() + len(sample_ids))
+        self.current_sample_label.setText(sample_ids[-1])
+    
+    def on_analysis_done(self, count, simulated, error):
+        if error == "cancelled":
+            self.current_sample_label.setText("Stopped")
+            self.log("Analysis stopped", WARNING)
+            return
+        if error:
+            self.current_sample_label.setText("Failed")
+            QMessageBox.critical(self, "Error", f"Failed to generate results: {error}")
+            return
+        
+        self.current_sample_label.setText("Completed")
+        self.log(f"Generated {count} results in {simulated:.0f} simulated seconds")
+        self.load_sample_results()
+        QMessageBox.information(self, "Completed", "Analysis completed for all samples")
+    
+    def request_sample_info(self, sample_ids):
+        if not self.session or not self.session.transport.is_open:
+            self.log("Not connected to the LIS, sample info not requested", WARNING)
+            return None
+        
+        analyzer_id = self.analyzer_combo.currentData()
+        template_text = self.sample_info_text.toPlainText()
         try:
-            analyzer_id = self.analyzer_combo.currentData()
-            if not analyzer_id:
-                return
-            
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, test_code, lower_range, upper_range
-                FROM tests
-                WHERE analyzer_id = ?
-            """, (analyzer_id,))
-            
-            tests = cursor.fetchall()
-            if not tests:
-                conn.close()
-                return
-            
-            for sample_id in sample_ids:
-                cursor.execute("SELECT id FROM samples WHERE sample_number = ?", (sample_id,))
-                sample_db_id = cursor.fetchone()[0]
-                
-                for test in tests:
-                    test_id, test_code, lower_range, upper_range = test
-                    
-                    result_value = round(random.uniform(lower_range, upper_range), 3)
-                    
-                    cursor.execute("""
-                        SELECT id FROM results
-                        WHERE sample_id = ? AND test_id = ?
-                    """, (sample_db_id, test_id))
-                    
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        cursor.execute("""
-                            UPDATE results SET
-                            result_value = ?,
-                            sent = 0
-                            WHERE sample_id = ? AND test_id = ?
-                        """, (result_value, sample_db_id, test_id))
-                    else:
-                        cursor.execute("""
-                            INSERT INTO results
-                            (sample_id, test_id, result_value, sent)
-                            VALUES (?, ?, ?, 0)
-                        """, (sample_db_id, test_id, result_value))
-            
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to generate results: {str(e)}")
+            delay = self.connection_settings_from_ui().sample_id_delay_seconds
+        except ValueError:
+            delay = 0.0
+        future = self.io_thread.submit(
+            self.engine.request_sample_info(self.session, analyzer_id, sample_ids, template_text, delay=delay)
+        )
+        future.add_done_callback(
+            lambda f: self.session_signals.sample_info.emit(0 if future_error(f) else len(f.result()), future_error(f))
+        )
+        return future
+    
+    def on_sample_info_received(self, count, error):
+        if error:
+            self.log(f"Sample info request failed: {error}", ERROR)
+            return
+        
+        self.log(f"Received sample info for {count} samples")
+        self.load_sample_list()
     
     def load_sample_list(self):
-        try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT id, sample_number, patient_id, patient_name
-                FROM samples
-                ORDER BY date_time DESC
-            """)
-            
-            samples = cursor.fetchall()
-            
-            self.sample_list.setRowCount(len(samples))
-            for i, sample in enumerate(samples):
-                sample_id, sample_number, patient_id, patient_name = sample
-                
-                self.sample_list.setItem(i, 0, QTableWidgetItem(sample_number))
-                self.sample_list.setItem(i, 1, QTableWidgetItem(patient_id))
-                self.sample_list.setItem(i, 2, QTableWidgetItem(patient_name))
-                self.sample_list.item(i, 0).setData(Qt.ItemDataRole.UserRole, sample_id)
-            
-            conn.close()
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to load sample list: {str(e)}")
+        self.run_job(
+            "load sample list",
+            lambda job: self.engine.sample_page(),
+            on_finished=self.on_sample_list_loaded,
+        )
+    
+    def on_sample_list_loaded(self, first_page):
+        self.sample_model.reload(first_page)
+        self.result_model.load(None)
     
     def load_sample_results(self):
-        selected = self.sample_list.selectedItems()
+        selected = self.sample_list.selectionModel().selectedRows()
         if not selected:
             return
         
-        sample_db_id = self.sample_list.item(selected[0].row(), 0).data(Qt.ItemDataRole.UserRole)
+        sample_db_id = self.sample_model.sample_id(selected[0].row())
         
         try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
+            patient = self.engine.sample_patient(sample_db_id)
             
-            cursor.execute("""
-                SELECT patient_id, patient_name
-                FROM samples
-                WHERE id = ?
-            """, (sample_db_id,))
-            
-            patient = cursor.fetchone()
             self.patient_id_label.setText(patient[0])
             self.patient_name_label.setText(patient[1])
             
-            cursor.execute("""
-                SELECT r.id, t.test_code, r.result_value, t.unit, t.lower_range, t.upper_range, r.sent
-                FROM results r
-                JOIN tests t ON r.test_id = t.id
-                WHERE r.sample_id = ?
-            """, (sample_db_id,))
-            
-            results = cursor.fetchall()
-            
-            self.result_table.setRowCount(len(results))
-            for i, result in enumerate(results):
-                result_id, test_code, result_value, unit, lower_range, upper_range, sent = result
-                
-                normal_range = f"{lower_range} - {upper_range}"
-                sent_text = "Yes" if sent else "No"
-                
-                self.result_table.setItem(i, 0, QTableWidgetItem(test_code))
-                self.result_table.setItem(i, 1, QTableWidgetItem(str(result_value)))
-                self.result_table.setItem(i, 2, QTableWidgetItem(unit))
-                self.result_table.setItem(i, 3, QTableWidgetItem(normal_range))
-                self.result_table.setItem(i, 4, QTableWidgetItem(sent_text))
-                
-                self.result_table.item(i, 0).setData(Qt.ItemDataRole.UserRole, result_id)
-                
-                if result_value < lower_range or result_value > upper_range:
-                    for col in range(5):
-                        item = self.result_table.item(i, col)
-                        item.setBackground(QColor(80, 0, 0))
-            
-            conn.close()
+            self.result_model.load(sample_db_id)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load sample results: {str(e)}")
             
     def send_selected_results(self):
-        selected = self.result_table.selectedItems()
-        if not selected:
+        rows = {index.row() for index in self.result_table.selectionModel().selectedIndexes()}
+        if not rows:
             QMessageBox.warning(self, "Warning", "Please select results to send")
             return
         
-        rows = set()
-        for item in selected:
-            rows.add(item.row())
+        self.send_results(result_ids=self.result_model.result_ids(sorted(rows)), sent=None)
+    
+    def send_all_results(self):
+        if self.result_model.sample_id is None:
+            QMessageBox.warning(self, "Warning", "Please select a sample first")
+            return
         
-        result_ids = []
-        for row in rows:
-            result_id = self.result_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
-            result_ids.append(result_id)
+        self.send_results(sample_ids=[self.result_model.sample_id], sent=None)
+    
+    def send_unsent_results(self):
+        self.send_results()
+    
+    def export_results(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Results", "results.csv",
+            "CSV (*.csv);;JSON Lines (*.ndjson *.jsonl);;Parquet (*.parquet);;Arrow (*.arrow);;ASTM (*.astm)",
+        )
+        if not path:
+            return
         
-        self.send_results(result_ids)
+        analyzer_id = self.analyzer_combo.currentData()
+        template_text = self.result_send_text.toPlainText()
+        self.run_job(
+            "export results",
+            lambda job: export_results(
+                self.engine, path, analyzer_id=analyzer_id, progress=job.progress,
+                template_text=template_text, sent=None,
+            ),
+            on_finished=lambda count: self.log(f"Exported {count} results to {path}"),
+        )
     
-    def send_all_results(self):
-        result_ids = []
-        for row in range(self.result_table.rowCount()):
-            result_id = self.result_table.item(row, 0).data(Qt.ItemDataRole.UserRole)
-            result_ids.append(result_id)
+    def send_results(self, **selection):
+        """Send the results picked by ``selection`` (see SimulatorEngine.send_selection)."""
+        if not self.session or not self.session.transport.is_open:
+            QMessageBox.warning(self, "Warning", "Please connect to the LIS first")
+            return
         
-        self.send_results(result_ids)
+        analyzer_id = self.analyzer_combo.currentData()
+        template_text = self.result_send_text.toPlainText()
+        future = self.io_thread.submit(
+            self.engine.send_selection(self.session, analyzer_id, template_text, **selection)
+        )
+        future.add_done_callback(
+            lambda f: self.session_signals.sent.emit([] if future_error(f) else f.result(), future_error(f))
+        )
     
-    def send_results(self, result_ids):
+    def on_results_sent(self, result_ids, error):
+        if error:
+            self.log(f"Sending failed: {error}", ERROR)
+            QMessageBox.critical(self, "Error", f"Failed to send results: {error}")
+            return
+        
         if not result_ids:
+            QMessageBox.information(self, "Information", "No results to send")
             return
         
-        try:
-            conn = sqlite3.connect('analyzersim.db')
-            cursor = conn.cursor()
-            
-            for result_id in result_ids:
-                cursor.execute("UPDATE results SET sent = 1 WHERE id = ?", (result_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            self.load_sample_results()
-            
-            self.log_text.append(f"Sent {len(result_ids)} results to LIS")
-            QMessageBox.information(self, "Success", f"{len(result_ids)} results sent successfully")
-            
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to send results: {str(e)}")
+        self.result_model.mark_sent(result_ids)
+        
+        self.log(f"Sent {len(result_ids)} results to LIS")
+        QMessageBox.information(self, "Success", f"{len(result_ids)} results sent successfully")
+    
+    def on_results_auto_sent(self, result_ids, error):
+        # Background sending reports to the log only
+        if error:
+            self.log(f"Automatic sending failed: {error}", ERROR)
+            return
+        
+        self.log(f"Sent {len(result_ids)} results to LIS automatically")
+        self.result_model.mark_sent(result_ids)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
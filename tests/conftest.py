@@ -0,0 +1,13 @@
+import pytest
+
+from analyzersim.engine import SimulatorEngine
+from analyzersim.metrics import Registry
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """A SimulatorEngine on a fresh database, seeded as on first start."""
+    engine = SimulatorEngine(str(tmp_path / "analyzersim.db"), metrics=Registry())
+    engine.open()
+    yield engine
+    engine.close()
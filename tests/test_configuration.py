@@ -0,0 +1,49 @@
+import sqlite3
+
+import pytest
+
+from analyzersim.templates import DEFAULT_TEMPLATES
+
+PANEL = [("Test_1", "mmol/l", 0.5, 5.0, 60.0), ("Photometric_test", "mmol/l", 0.05, 1.2, 60.0)]
+
+
+def orphans(engine):
+    return engine.db.fetchone("SELECT COUNT(*) FROM results WHERE test_id NOT IN (SELECT id FROM tests)")[0]
+
+
+def test_configuration_is_saved_all_or_nothing(engine):
+    templates = {"result_send": DEFAULT_TEMPLATES["result_send"] + "\n"}
+    with pytest.raises(sqlite3.Error):
+        # The second test row is short a column, so its insert fails
+        engine.save_configuration(1, templates=templates, tests=PANEL + [("New_test", "g/l")], channels=4)
+    assert engine.templates(1).get("result_send") != templates["result_send"]
+    assert engine.throughput(1).channels != 4
+    assert len(engine.tests(1)) == 3
+
+
+def test_removed_tests_take_their_results_along(engine):
+    numbers = ["S1", "S2"]
+    engine.analyze(1, [(number, "", "") for number in numbers], seed=1)
+    engine.outbox.enqueue_samples(1, numbers)
+    assert engine.removed_test_results(1, [test[0] for test in PANEL]) == 2
+    engine.save_configuration(1, tests=PANEL, channels=2)
+    assert orphans(engine) == 0
+    assert engine.count_results(1, sent=None) == 4
+    assert sum(engine.outbox.depth(1).values()) == 4
+    assert [test[1] for test in engine.tests(1)] == ["Test_1", "Photometric_test"]
+
+
+def test_duplicate_tests_merge_into_the_oldest(engine):
+    engine.analyze(1, [("S1", "", "")], seed=1)
+    oldest = engine.tests(1)[0]
+    with engine.db.transaction() as cursor:
+        cursor.execute("INSERT INTO tests (analyzer_id, test_code, unit, lower_range, upper_range, cycle_time) "
+                       "VALUES (1, ?, 'mmol/l', 0.5, 5.0, 60.0)", (oldest[1],))
+    engine.invalidate(1)
+    engine.analyze(1, [("S2", "", "")], seed=1)
+    # Leave S2 with a result on the duplicate only
+    engine.db.execute("DELETE FROM results WHERE test_id = ? AND sample_id = "
+                      "(SELECT id FROM samples WHERE sample_number = 'S2')", (oldest[0],))
+    engine.save_tests(1, PANEL)
+    assert orphans(engine) == 0
+    assert engine.db.fetchone("SELECT COUNT(*) FROM results WHERE test_id = ?", (oldest[0],))[0] == 2
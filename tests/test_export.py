@@ -0,0 +1,14 @@
+import csv
+import io
+
+from analyzersim.engine import EXPORT_COLUMNS
+from analyzersim.export import export_format, export_results
+
+
+def test_standard_output_defaults_to_csv(engine, capsys):
+    engine.analyze(1, [("S1", "", "")], seed=1)
+    assert export_format("-") == "csv"
+    assert export_results(engine, "-", sent=None) == 3
+    rows = list(csv.reader(io.StringIO(capsys.readouterr().out)))
+    assert tuple(rows[0]) == EXPORT_COLUMNS
+    assert len(rows) == 4
@@ -0,0 +1,35 @@
+import asyncio
+
+from analyzersim.fleet import FleetRunner
+from analyzersim.mocklis import MockLIS, serve_analyzers
+
+
+def clone(engine, copies):
+    source_id, base = engine.analyzers()[0]
+    for number in range(1, copies + 1):
+        engine.clone_analyzer(source_id, f"{base} copy {number}", port_offset=number)
+    return [analyzer_id for analyzer_id, _ in engine.analyzers()]
+
+
+def test_clones_of_unsaved_analyzer_get_distinct_ports(engine):
+    analyzer_ids = clone(engine, 3)
+    assert engine.connection_settings(analyzer_ids[0]) is None
+    ports = [engine.endpoint_settings(analyzer_id).analyzer_port for analyzer_id in analyzer_ids]
+    assert len(set(ports)) == len(analyzer_ids)
+
+
+def test_fleet_of_clones_on_fresh_database(engine):
+    analyzer_ids = clone(engine, 3)
+
+    async def run():
+        lis = MockLIS(metrics=engine.metrics)
+        await serve_analyzers(lis, engine, analyzer_ids)
+        try:
+            return await FleetRunner(engine, analyzer_ids, 20).run()
+        finally:
+            await lis.close()
+
+    summary = asyncio.run(run())
+    assert summary["errors"] == {}
+    assert summary["analyzers"] == len(analyzer_ids)
+    assert summary["results"] > 0
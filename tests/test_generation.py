@@ -0,0 +1,51 @@
+import asyncio
+
+from analyzersim.mocklis import MockLIS
+from analyzersim.parser import parse_records
+
+
+def result_codes(engine, sample_number):
+    return {
+        row[0] for row in engine.db.fetchall("""
+            SELECT t.test_code FROM results r
+            JOIN samples s ON s.id = r.sample_id
+            JOIN tests t ON t.id = r.test_id
+            WHERE s.sample_number = ?
+        """, (sample_number,))
+    }
+
+
+def test_worklist_samples_get_their_requested_tests(engine, tmp_path):
+    worklist = tmp_path / "worklist.csv"
+    worklist.write_text(
+        "sample_number,patient_id,patient_name,tests\n"
+        "W1,P1,Ann,Test_1\n"
+        "W2,P2,Bob,Test_1;Photometric_test\n"
+        "W3,P3,Cid,\n"
+        "W4,P4,Dee,Other_test\n"
+    )
+    engine.import_worklist(str(worklist))
+    count = engine.generate_results(1, ["W1", "W2", "W3", "W4"], seed=1)
+    assert result_codes(engine, "W1") == {"Test_1"}
+    assert result_codes(engine, "W2") == {"Test_1", "Photometric_test"}
+    assert result_codes(engine, "W3") == {"Test_1", "Photo_reflex_test", "Photometric_test"}
+    assert result_codes(engine, "W4") == set()
+    assert count == 6
+
+
+def test_host_query_orders_limit_the_analysis(engine):
+    lis = MockLIS(orders={"Q1": ("P1", "Ann", ["Photo_reflex_test"])})
+    numbers = engine.store_orders(parse_records(record.encode() for record in lis.answer(["Q1"])))
+    assert numbers == ["Q1"]
+    count, _ = asyncio.run(engine.run_analysis(1, numbers, speed=None, seed=1))
+    assert count == 1
+    assert result_codes(engine, "Q1") == {"Photo_reflex_test"}
+
+
+def test_unknown_sample_numbers_are_skipped(engine):
+    engine.store_samples([("S1", "P1", "Ann")])
+    assert engine.generate_results(1, ["S1", "MISSING"], seed=1) == 3
+    assert result_codes(engine, "S1") == {"Test_1", "Photo_reflex_test", "Photometric_test"}
+    assert asyncio.run(engine.run_analysis(1, ["MISSING"], speed=None, seed=1)) == (0, 0.0)
+    count, _ = asyncio.run(engine.run_analysis(1, ["MISSING", "S1"], speed=None, seed=1))
+    assert count == 3
@@ -0,0 +1,12 @@
+import subprocess
+import sys
+
+
+def test_engine_import_leaves_heavy_modules_unloaded():
+    # Loaded only by the code paths that need them; see benchmarks.suite's import_engine
+    script = (
+        "import sys, analyzersim.engine; "
+        "print(' '.join(name for name in ('asyncio', 'http.server', 'numpy') if name in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    assert output.split() == []
@@ -0,0 +1,164 @@
+from analyzersim.astm import ACK, ENQ, EOT, NAK, frame, message_frames
+from analyzersim.link import (
+    BUSY_RETRY_DELAY, MAX_ATTEMPTS, RECEIVE_TIMEOUT, REPLY_TIMEOUT, LinkLayer, MessageFailed, MessageReceived,
+    MessageSent, State,
+)
+
+FRAMES = message_frames(["H|\\^&", "L|1|N"])
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def established(role="instrument", frames=FRAMES):
+    clock = Clock()
+    link = LinkLayer(role, clock=clock)
+    link.send(frames, "message")
+    assert link.take_output() == ENQ
+    link.data_received(ACK)
+    assert link.take_output() == frames[0]
+    assert link.state == State.TRANSFER
+    return link, clock
+
+
+def test_message_is_sent_frame_by_frame():
+    link, clock = established()
+    clock.now = 2.0
+    link.data_received(ACK)
+    assert link.take_output() == FRAMES[1]
+    link.data_received(ACK)
+    assert link.take_output() == EOT
+    assert list(link.events) == [MessageSent("message", 2, 0, 2.0)]
+    assert link.state == State.NEUTRAL and link.deadline is None
+
+
+def test_eot_acknowledges_a_frame_in_transfer():
+    link, _ = established()
+    link.data_received(EOT)
+    assert link.take_output() == FRAMES[1]
+    link.data_received(EOT)
+    assert link.take_output() == EOT
+    assert [type(event) for event in link.events] == [MessageSent]
+
+
+def test_contention_backoff_depends_on_the_role():
+    for role, delay in (("instrument", 1.0), ("computer", 20.0)):
+        clock = Clock()
+        link = LinkLayer(role, clock=clock)
+        link.send(FRAMES)
+        assert link.take_output() == ENQ
+        link.data_received(ENQ)
+        assert link.state == State.BACKOFF and link.deadline == delay
+        assert link.take_output() == b""
+        clock.now = delay - 0.1
+        link.poll()
+        assert link.take_output() == b""
+        clock.now = delay
+        link.poll()
+        assert link.take_output() == ENQ
+        assert link.state == State.ESTABLISHING
+
+
+def test_the_other_side_is_received_during_backoff():
+    clock = Clock()
+    link = LinkLayer(clock=clock)
+    link.send(FRAMES, "message")
+    link.take_output()
+    link.data_received(ENQ)
+    link.data_received(ENQ)
+    assert link.take_output() == ACK
+    link.data_received(b"".join(FRAMES))
+    assert link.take_output() == ACK + ACK
+    link.data_received(EOT)
+    # Our message goes straight after theirs
+    assert link.take_output() == ENQ
+    assert list(link.events) == [MessageReceived([b"H|\\^&\r", b"L|1|N\r"])]
+
+
+def test_nak_on_enq_waits_for_a_busy_receiver():
+    clock = Clock()
+    link = LinkLayer(clock=clock)
+    link.send(FRAMES)
+    link.take_output()
+    link.data_received(NAK)
+    assert link.state == State.BACKOFF and link.deadline == BUSY_RETRY_DELAY
+    clock.now = BUSY_RETRY_DELAY
+    link.poll()
+    assert link.take_output() == ENQ
+
+
+def test_naked_frames_are_sent_again():
+    link, _ = established()
+    link.data_received(NAK)
+    assert link.take_output() == FRAMES[0]
+    link.data_received(ACK + ACK)
+    assert link.take_output() == FRAMES[1] + EOT
+    assert list(link.events) == [MessageSent("message", 2, 1, 0.0)]
+
+
+def test_a_frame_is_given_up_after_six_attempts():
+    link, _ = established()
+    for _ in range(MAX_ATTEMPTS - 1):
+        link.data_received(NAK)
+        assert link.take_output() == FRAMES[0]
+    link.data_received(NAK)
+    assert link.take_output() == EOT
+    assert list(link.events) == [MessageFailed("message", f"frame 1 rejected {MAX_ATTEMPTS} times")]
+    assert link.state == State.NEUTRAL
+
+
+def test_no_reply_within_15_seconds_fails_the_message():
+    for wait_for_frame in (False, True):
+        if wait_for_frame:
+            link, clock = established()
+        else:
+            clock = Clock()
+            link = LinkLayer(clock=clock)
+            link.send(FRAMES, "message")
+            link.take_output()
+        assert link.deadline == REPLY_TIMEOUT
+        clock.now = REPLY_TIMEOUT - 0.1
+        link.poll()
+        assert not link.events
+        clock.now = REPLY_TIMEOUT
+        link.poll()
+        assert link.take_output() == EOT
+        assert list(link.events) == [MessageFailed("message", f"no reply within {REPLY_TIMEOUT:g} s")]
+
+
+def test_a_silent_sender_is_dropped_after_30_seconds():
+    clock = Clock()
+    link = LinkLayer("computer", clock=clock)
+    link.data_received(ENQ)
+    assert link.take_output() == ACK
+    assert link.deadline == RECEIVE_TIMEOUT
+    clock.now = 20.0
+    link.data_received(FRAMES[0])
+    assert link.take_output() == ACK
+    # Every frame restarts the timer
+    assert link.deadline == 20.0 + RECEIVE_TIMEOUT
+    clock.now = 20.0 + RECEIVE_TIMEOUT
+    link.poll()
+    assert link.state == State.NEUTRAL
+    assert not link.events
+
+
+def test_bad_and_repeated_frames_are_answered():
+    link = LinkLayer("computer", clock=Clock())
+    link.data_received(ENQ)
+    link.take_output()
+    corrupt = FRAMES[0][:-4] + b"00\r\n"
+    link.data_received(corrupt)
+    assert link.take_output() == NAK
+    link.data_received(FRAMES[0] + FRAMES[0])
+    # The repeat is the sender missing our ACK, so it is acknowledged and dropped
+    assert link.take_output() == ACK + ACK
+    link.data_received(frame(3, b"L|1|N\r"))
+    assert link.take_output() == NAK
+    link.data_received(FRAMES[1] + EOT)
+    assert list(link.events) == [MessageReceived([b"H|\\^&\r", b"L|1|N\r"])]
@@ -0,0 +1,36 @@
+import asyncio
+
+from analyzersim.config import ConnectionSettings
+from analyzersim.metrics import Registry
+from analyzersim.mocklis import MockLIS
+from analyzersim.transport import AnalyzerSession, TcpTransport
+
+MESSAGE = ["H|\\^&|||Analyzer", "P|1||P001", "O|1|S001", "R|1|^^^Test_1|2.5|mmol/l", "L|1|N"]
+
+
+async def send(lis, messages):
+    host, port = await lis.listen("127.0.0.1", 0)
+    analyzer = AnalyzerSession("analyzer", TcpTransport(ConnectionSettings(
+        socket_type="Client", lis_address=host, lis_port=port)))
+    await analyzer.open()
+    try:
+        for _ in range(messages):
+            await analyzer.send_message(MESSAGE)
+    finally:
+        await analyzer.close()
+    await lis.close()
+    return lis.summary()
+
+
+def test_mocks_sharing_a_name_report_their_own_figures():
+    metrics = Registry()
+    first = asyncio.run(send(MockLIS(metrics=metrics), 3))
+    second = asyncio.run(send(MockLIS(metrics=metrics), 1))
+    assert (first["messages"], first["results"], first["connections"]) == (3, 3, 1)
+    assert (second["messages"], second["results"], second["connections"]) == (1, 1, 1)
+    assert second["receive_max"] > 0
+
+
+def test_rate_is_over_the_time_since_start():
+    summary = asyncio.run(send(MockLIS(metrics=Registry()), 1))
+    assert summary["messages_per_second"] == summary["messages"] / summary["elapsed"] > 0
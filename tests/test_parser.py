@@ -0,0 +1,71 @@
+from analyzersim.astm import ACK, ETB, ETX, MAX_FRAME_TEXT, FrameEncoder, checksum, decode_frame, frame
+from analyzersim.parser import RecordAssembler, StreamParser, parse_record
+
+LONG = "R|1|^^^Test_1|" + "9" * 600 + "|mmol/L"
+RECORDS = ["H|\\^&|||Analyzer", "P|1|PID1||Doe^Jane&F&x", LONG, "L|1|N"]
+
+
+def test_checksum_is_the_low_byte_of_the_sum_in_hex():
+    assert checksum(b"1H|\\^&\r\x03") == b"%02X" % (sum(b"1H|\\^&\r\x03") & 0xFF)
+    assert checksum(b"\x00") == b"00"
+    assert checksum(bytes([0xFF, 0x0B])) == b"0A"
+
+
+def test_encoder_matches_frame():
+    frames = FrameEncoder().frames(["H|\\^&", "L|1|N"])
+    assert frames == [frame(1, b"H|\\^&\r"), frame(2, b"L|1|N\r")]
+    assert decode_frame(frames[0]) == (1, b"H|\\^&\r", True, True)
+
+
+def test_long_records_are_split_into_240_character_frames():
+    frames = FrameEncoder().frames([LONG])
+    text = (LONG + "\r").encode()
+    assert len(frames) == -(-len(text) // MAX_FRAME_TEXT)
+    decoded = [decode_frame(raw) for raw in frames]
+    assert all(valid for _, _, _, valid in decoded)
+    assert [len(chunk) for _, chunk, _, _ in decoded[:-1]] == [MAX_FRAME_TEXT] * (len(frames) - 1)
+    assert [final for _, _, final, _ in decoded] == [False] * (len(frames) - 1) + [True]
+    assert [raw[-5:-4] for raw in frames] == [ETB] * (len(frames) - 1) + [ETX]
+    assert b"".join(chunk for _, chunk, _, _ in decoded) == text
+
+
+def test_frame_numbers_wrap_from_7_to_0():
+    frames = FrameEncoder().frames([f"R|{number}" for number in range(10)])
+    assert [decode_frame(raw)[0] for raw in frames] == [1, 2, 3, 4, 5, 6, 7, 0, 1, 2]
+    assert decode_frame(FrameEncoder().frames(["L|1|N"], first=7)[0])[0] == 7
+
+
+def test_assembler_joins_intermediate_frames():
+    assembler = RecordAssembler()
+    assert assembler.add(b"R|1|", False) is None
+    assert assembler.add(b"^^^Test_1", False) is None
+    assert assembler.add(b"|5\r", True) == b"R|1|^^^Test_1|5\r"
+    assert assembler.add(b"L|1\r", True) == b"L|1\r"
+    assembler.add(b"partial", False)
+    assembler.reset()
+    assert assembler.add(b"L|1\r", True) == b"L|1\r"
+
+
+def test_stream_parser_reads_frames_split_across_reads():
+    data = b"".join(raw + ACK for raw in FrameEncoder().frames(RECORDS))
+    for size in (1, 7, 250):
+        parser = StreamParser()
+        records = []
+        for start in range(0, len(data), size):
+            records.extend(parser.feed(data[start:start + size]))
+        assert records == [parse_record(record.encode()) for record in RECORDS]
+    assert records[2].field(3) == "9" * 600
+    assert records[1].field(4, 1) == "Jane|x"
+    assert parser.frames == len(FrameEncoder().frames(RECORDS))
+    assert parser.bad_frames == 0
+
+
+def test_stream_parser_drops_frames_with_a_bad_checksum():
+    frames = FrameEncoder().frames(["H|\\^&", "L|1|N"])
+    corrupt = frames[0][:-4] + (b"00" if frames[0][-4:-2] != b"00" else b"01") + b"\r\n"
+    parser = StreamParser()
+    assert list(parser.feed(corrupt + frames[1])) == [parse_record(b"L|1|N")]
+    assert (parser.frames, parser.bad_frames) == (1, 1)
+    # Lowercase checksum digits are accepted
+    lower = frames[0][:-4] + frames[0][-4:-2].lower() + b"\r\n"
+    assert list(parser.feed(lower)) == [parse_record(b"H|\\^&")]
@@ -0,0 +1,51 @@
+import asyncio
+
+from analyzersim.config import ConnectionSettings
+from analyzersim.mocklis import Faults, MockLIS
+from analyzersim.outbox import ACKED, FAILED, PENDING
+from analyzersim.pipeline import ResultPipeline
+from analyzersim.transport import AnalyzerSession, TcpTransport
+
+
+def analyze(engine, count):
+    numbers = [f"S{number:03d}" for number in range(count)]
+    engine.analyze(1, [(number, "", "") for number in numbers], seed=1)
+    return numbers
+
+
+def test_pipeline_reconnects_when_the_lis_hangs_up(engine):
+    numbers = analyze(engine, 20)
+
+    async def run():
+        lis = MockLIS(faults=Faults(disconnect_every=10), metrics=engine.metrics)
+        host, port = await lis.listen("127.0.0.1", 0)
+        session = AnalyzerSession("analyzer", TcpTransport(ConnectionSettings(
+            socket_type="Client", lis_address=host, lis_port=port)), metrics=engine.metrics)
+        pipeline = ResultPipeline(engine, 1, session, message_results=3)
+        await session.open()
+        try:
+            pipeline.submit(numbers)
+            pipeline.close()
+            await asyncio.wait_for(pipeline.run(), 60)
+        finally:
+            await session.close()
+            await lis.close()
+        return pipeline.stats, lis.summary()
+
+    stats, summary = asyncio.run(run())
+    assert summary["disconnects"] > 0
+    assert stats.reconnects > 0
+    depth = engine.outbox.depth(1)
+    assert depth[FAILED] == 0
+    assert depth[ACKED] == len(numbers) * 3
+    assert engine.count_results(1, sent=False) == 0
+
+
+def test_released_rows_keep_their_attempts(engine):
+    numbers = analyze(engine, 2)
+    outbox = engine.outbox
+    outbox.enqueue_samples(1, numbers)
+    claimed = outbox.claim(1, 100)
+    outbox.release(claimed)
+    assert outbox.depth(1)[PENDING] == len(claimed)
+    assert {row.attempts for row in outbox.claim(1, 100)} == {1}
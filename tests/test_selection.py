@@ -0,0 +1,25 @@
+def analyze(engine, dates):
+    """Analyze one sample per date on Analyzer 1; return {date: result ids}."""
+    numbers = [f"S{index:03d}" for index in range(len(dates))]
+    engine.analyze(1, [(number, "", "") for number in numbers], seed=1)
+    with engine.db.transaction() as cursor:
+        cursor.executemany("UPDATE samples SET date_time = ? WHERE sample_number = ?", zip(dates, numbers))
+    return {date: engine.select_result_ids(1, sample_numbers=[number]) for date, number in zip(dates, numbers)}
+
+
+def test_result_ids_within_date_range(engine):
+    results = analyze(engine, ["2024-01-01 08:00:00", "2024-01-02 08:00:00", "2024-01-03 08:00:00"])
+    assert all(results.values())
+    every_id = [result_id for result_ids in results.values() for result_id in result_ids]
+    selected = engine.select_result_ids(
+        1, result_ids=every_id, since="2024-01-02 00:00:00", until="2024-01-03 00:00:00")
+    assert selected == results["2024-01-02 08:00:00"]
+
+
+def test_sample_ids_within_date_range(engine):
+    results = analyze(engine, ["2024-01-01 08:00:00", "2024-01-02 08:00:00"])
+    sample_ids = [row[0] for row in engine.db.fetchall("SELECT id FROM samples ORDER BY id")]
+    selected = engine.select_result_ids(1, sample_ids=sample_ids, since="2024-01-02 00:00:00")
+    assert selected == results["2024-01-02 08:00:00"]
+    assert engine.count_results(1, sample_ids=sample_ids, until="2024-01-02 00:00:00") == \
+        len(results["2024-01-01 08:00:00"])
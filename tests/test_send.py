@@ -0,0 +1,67 @@
+import asyncio
+import socket
+
+import pytest
+
+from analyzersim.cli import main
+from analyzersim.config import ConnectionSettings
+from analyzersim.mocklis import MockLIS
+from analyzersim.outbox import ACKED
+from analyzersim.transport import AnalyzerSession, TcpTransport
+
+
+async def with_lis(engine, send):
+    lis = MockLIS(metrics=engine.metrics)
+    host, port = await lis.listen("127.0.0.1", 0)
+    session = AnalyzerSession("analyzer", TcpTransport(ConnectionSettings(
+        socket_type="Client", lis_address=host, lis_port=port)), metrics=engine.metrics)
+    await session.open()
+    try:
+        result = await send(session)
+    finally:
+        await session.close()
+        await lis.close()
+    return result, lis.summary()
+
+
+def test_send_queued_sends_one_message_per_batch(engine):
+    engine.analyze(1, [("S1", "", ""), ("S2", "", "")], seed=1)
+    result_ids = engine.select_result_ids(1)
+    (sent, frames), summary = asyncio.run(with_lis(
+        engine, lambda session: engine.send_queued([session], 1, result_ids, message_results=2)))
+    assert sent == result_ids
+    assert frames > 0
+    assert summary["messages"] == 3
+    assert engine.outbox.depth(1)[ACKED] == len(result_ids)
+    assert engine.count_results(1, sent=False) == 0
+
+
+def test_send_selection_goes_through_the_outbox(engine):
+    engine.analyze(1, [("S1", "", "")], seed=1)
+    # Results the pipeline queued already are taken over, not sent twice
+    engine.outbox.enqueue_samples(1, ["S1"], delay=3600)
+    sent, _ = asyncio.run(with_lis(engine, lambda session: engine.send_selection(session, 1)))
+    assert len(sent) == 3
+    depth = engine.outbox.depth(1)
+    assert depth[ACKED] == 3
+    assert engine.outbox.next_due(1) is None
+
+
+def test_send_in_server_mode_gives_up_after_the_timeout(engine, tmp_path, capsys):
+    engine.analyze(1, [("S1", "", "")], seed=1)
+    engine.save_connection_settings(1, ConnectionSettings(socket_type="Server", analyzer_address="127.0.0.1",
+                                                          analyzer_port=0))
+    with pytest.raises(SystemExit, match="No connection to the LIS within 0.1 s"):
+        main(["--db", str(tmp_path / "analyzersim.db"), "send", "--analyzer", "1", "--timeout", "0.1"])
+    assert "waiting for LIS on 127.0.0.1:0" in capsys.readouterr().out
+
+
+def test_send_reports_a_refused_connection(engine, tmp_path):
+    engine.analyze(1, [("S1", "", "")], seed=1)
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+    engine.save_connection_settings(1, ConnectionSettings(socket_type="Client", lis_address="127.0.0.1",
+                                                          lis_port=port))
+    with pytest.raises(SystemExit, match="Send failed"):
+        main(["--db", str(tmp_path / "analyzersim.db"), "send", "--analyzer", "1"])
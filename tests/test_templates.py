@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from analyzersim.templates import DEFAULT_TEMPLATES, compile_template
+
+MOMENT = datetime(2024, 1, 2, 3, 4, 5)
+
+
+def test_default_result_template_renders_one_order_per_result():
+    template = compile_template(DEFAULT_TEMPLATES["result_send"])
+    samples = [("S1", "PID1", "Doe^Jane", [
+        ("Test_1", 2.4, "mmol/l", 0.5, 5.0),
+        ("Photometric_test", 1.5, "mmol/l", 0.05, 1.2),
+    ])]
+    assert template.render_results(samples, MOMENT) == [
+        "H|\\^&|||1 Analyzer 1^7.0|||||||||P||20240102030405",
+        "P|1|PID1|||Doe&S&Jane|||U|||||||||||||||||||",
+        "O|1|S1^0.0^5^1|||^^^Test_1^0.0|R||||||X|||3|||||||1|F",
+        "R|1|^^^Test_1^0.0|2.4|mmol/l|0.5-5.0|N||F||<root user>||20240102030405|Analyzer 1",
+        "O|2|S1^0.0^5^1|||^^^Photometric_test^0.0|R||||||X|||3|||||||1|F",
+        "R|1|^^^Photometric_test^0.0|1.5|mmol/l|0.05-1.2|H||F||<root user>||20240102030405|Analyzer 1",
+        "L|1|N",
+    ]
+
+
+def test_default_sample_info_template_renders_a_query_per_sample():
+    template = compile_template(DEFAULT_TEMPLATES["sample_info"])
+    assert template.render_query(["S1", "S|2"], MOMENT) == [
+        "H|\\^&|||1^Analyzer_1^|||||||||P||20240102030405",
+        "Q|1|^S1^^||^^^ALL^||||||O",
+        "Q|2|^S&F&2^^||^^^ALL^||||||O",
+        "L|1|N",
+    ]
@@ -0,0 +1,78 @@
+import asyncio
+
+from analyzersim.config import ConnectionSettings
+from analyzersim.mocklis import MockLIS
+from analyzersim.replay import TraceReplayer
+from analyzersim.trace import CLOSE, OPEN, RECEIVED, SENT, TraceReader, TraceWriter
+from analyzersim.transport import AnalyzerSession, open_transport
+
+
+def test_trace_round_trip(tmp_path):
+    path = str(tmp_path / "session.trace")
+    writer = TraceWriter(path)
+    first = writer.open_session("Analyzer 1", "TCP connecting to 127.0.0.1:12000", 2)
+    second = writer.open_session("Analyzer 2")
+    writer.record(first, SENT, b"\x05")
+    writer.record(second, SENT, b"\x05")
+    writer.record(first, RECEIVED, b"\x06")
+    writer.record(first, CLOSE)
+    writer.close()
+
+    with TraceReader(path) as reader:
+        events = list(reader.events())
+        assert [(event.kind, event.session, event.data) for event in events] == [
+            (OPEN, 1, events[0].data), (OPEN, 2, events[1].data), (SENT, 1, b"\x05"), (SENT, 2, b"\x05"),
+            (RECEIVED, 1, b"\x06"), (CLOSE, 1, b""),
+        ]
+        times = [event.time for event in events]
+        assert times == sorted(times)
+        assert reader.duration == times[-1]
+        assert {number: len(offsets) for number, offsets in reader.index().items()} == {1: 4, 2: 2}
+        sessions = reader.sessions
+        assert (sessions[1].name, sessions[1].transport, sessions[1].port_offset) == (
+            "Analyzer 1", "TCP connecting to 127.0.0.1:12000", 2)
+        assert (sessions[1].bytes_sent, sessions[1].bytes_received) == (1, 1)
+        assert sessions[1].closed == times[-1]
+        assert sessions[2].closed is None
+
+
+def test_a_trace_cut_short_reads_up_to_its_last_complete_event(tmp_path):
+    path = tmp_path / "session.trace"
+    writer = TraceWriter(str(path))
+    session = writer.open_session("Analyzer 1")
+    writer.record(session, SENT, b"first")
+    writer.record(session, SENT, b"second")
+    writer.close()
+    path.write_bytes(path.read_bytes()[:-1])
+    with TraceReader(str(path)) as reader:
+        assert [event.data for event in reader.events()][1:] == [b"first"]
+
+
+def test_replaying_against_the_same_lis_is_identical(engine, tmp_path):
+    engine.analyze(1, [("S1", "", ""), ("S2", "", "")], seed=1)
+    path = str(tmp_path / "session.trace")
+
+    async def run():
+        lis = MockLIS(metrics=engine.metrics)
+        host, port = await lis.listen("127.0.0.1", 0)
+        engine.save_connection_settings(1, ConnectionSettings(socket_type="Client", lis_address=host, lis_port=port))
+        trace = TraceWriter(path)
+        name = engine.analyzer_name(1)
+        session = AnalyzerSession(name, open_transport(engine.endpoint_settings(1), trace=trace, name=name),
+                                  metrics=engine.metrics)
+        await session.open()
+        try:
+            await engine.send_queued([session], 1, engine.select_result_ids(1), message_results=2)
+        finally:
+            await session.close()
+            trace.close()
+        try:
+            with TraceReader(path) as reader:
+                return await TraceReplayer(engine, reader, speed=None).run()
+        finally:
+            await lis.close()
+
+    summary = asyncio.run(run())
+    assert summary["errors"] == {}
+    assert summary["sessions"] == summary["identical"] == 1
+    assert summary["bytes_received"] > 0
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from analyzersim.config import ConnectionSettings
+from analyzersim.transport import PtyLoopback, SerialTransport
+
+termios = pytest.importorskip("termios")
+
+
+@pytest.mark.skipif(not hasattr(termios, "B4000000"), reason="needs a 4 Mbaud line to run quickly")
+def test_serial_writes_do_not_interleave():
+    async def run():
+        loopback = PtyLoopback()
+        settings = loopback.analyzer_settings(ConnectionSettings(baud_rate=4000000))
+        analyzer = SerialTransport(settings)
+        lis = loopback.lis_transport(settings)
+        await analyzer.open()
+        await lis.open()
+        loopback.close()
+        received = bytearray()
+
+        async def read(size):
+            while len(received) < size:
+                received.extend(await lis.read())
+
+        # More than the pseudo-terminal buffers, so each write has to wait
+        first, second = b"a" * 100000, b"b" * 100000
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                analyzer.write(first), analyzer.write(second), read(len(first) + len(second))), 10)
+        finally:
+            await analyzer.close()
+            await lis.close()
+        return bytes(received)
+
+    assert asyncio.run(run()) in (b"a" * 100000 + b"b" * 100000, b"b" * 100000 + b"a" * 100000)